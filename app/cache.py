@@ -0,0 +1,193 @@
+from app.config import data_path
+from app.models import Receipt
+from collections import OrderedDict
+from typing import Dict, Optional
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+RECEIPT_CACHE_ENABLED = os.getenv("RECEIPT_CACHE_ENABLED", "true").lower() == "true"
+# Relative to DATA_DIR unless absolute; set to an empty string to keep the cache in memory only
+RECEIPT_CACHE_PATH = os.getenv("RECEIPT_CACHE_PATH", "receipts.sqlite3")
+if RECEIPT_CACHE_PATH:
+    RECEIPT_CACHE_PATH = data_path(RECEIPT_CACHE_PATH)
+RECEIPT_CACHE_MEMORY_ENTRIES = int(os.getenv("RECEIPT_CACHE_MEMORY_ENTRIES", "256"))
+RECEIPT_CACHE_MAX_ENTRIES = int(os.getenv("RECEIPT_CACHE_MAX_ENTRIES", "10000"))
+RECEIPT_CACHE_TTL_SECONDS = int(os.getenv("RECEIPT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+class ReceiptCache:
+    """
+    Content-addressed cache of parsed receipts, keyed by the SHA-256 of the image bytes.
+
+    Lookups hit an in-memory LRU first and fall back to a SQLite file, so the
+    same photo uploaded twice (or after a restart) skips the LLM call. Both
+    tiers expire entries after `ttl_seconds`; the disk tier evicts the least
+    recently used entries beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = RECEIPT_CACHE_PATH,
+        memory_entries: int = RECEIPT_CACHE_MEMORY_ENTRIES,
+        max_entries: int = RECEIPT_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = RECEIPT_CACHE_TTL_SECONDS,
+        enabled: bool = RECEIPT_CACHE_ENABLED,
+    ):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._memory_lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+
+    @staticmethod
+    def key(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS receipts ("
+                "key TEXT PRIMARY KEY, receipt TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS receipts_accessed_at ON receipts (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: str, receipt: Receipt, created_at: float):
+        with self._memory_lock:
+            self._memory[key] = (receipt, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _get_memory(self, key: str, now: float) -> Optional[Receipt]:
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            receipt, created_at = entry
+            if now - created_at > self.ttl_seconds:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return receipt
+
+    def _get_disk(self, key: str, now: float) -> Optional[Receipt]:
+        with self._disk_lock:
+            conn = self._connection()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT receipt, created_at FROM receipts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                return None
+            conn.execute("UPDATE receipts SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+        receipt = Receipt.model_validate_json(row[0])
+        self._remember(key, receipt, row[1])
+        self.disk_hits += 1
+        return receipt
+
+    def _set_disk(self, key: str, receipt: Receipt, now: float):
+        with self._disk_lock:
+            conn = self._connection()
+            if conn is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO receipts (key, receipt, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, receipt.model_dump_json(), now, now),
+            )
+            conn.execute("DELETE FROM receipts WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM receipts WHERE key IN ("
+                "SELECT key FROM receipts ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def get(self, key: str) -> Optional[Receipt]:
+        """
+        Look up a parsed receipt.
+
+        Args:
+            key: SHA-256 hex digest of the image bytes
+
+        Returns:
+            The cached Receipt, or None on a miss or expired entry
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        receipt = self._get_memory(key, now) or self._get_disk(key, now)
+        if receipt is None:
+            self.misses += 1
+        return receipt
+
+    def set(self, key: str, receipt: Receipt):
+        """
+        Store a parsed receipt in both tiers, evicting expired and excess entries.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        self._remember(key, receipt, now)
+        self._set_disk(key, receipt, now)
+
+    async def get_async(self, key: str) -> Optional[Receipt]:
+        """
+        Like `get`, but the SQLite lookup runs in a worker thread.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        receipt = self._get_memory(key, now)
+        if receipt is None:
+            receipt = await asyncio.to_thread(self._get_disk, key, now)
+        if receipt is None:
+            self.misses += 1
+        return receipt
+
+    async def set_async(self, key: str, receipt: Receipt):
+        """
+        Like `set`, but the SQLite write runs in a worker thread.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        self._remember(key, receipt, now)
+        await asyncio.to_thread(self._set_disk, key, receipt, now)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        with self._disk_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+receipt_cache = ReceiptCache()
@@ -0,0 +1,10 @@
+from pathlib import Path
+import os
+
+PACKAGE_ROOT = Path(__file__).resolve().parent.parent
+# Local state (receipt cache, Notion outbox) lives here rather than in the working directory
+DATA_DIR = PACKAGE_ROOT / os.getenv("DATA_DIR", ".cache")
+
+def data_path(path: str) -> str:
+    """Resolve a configured file path against DATA_DIR; absolute paths are kept as they are."""
+    return str(DATA_DIR / path)
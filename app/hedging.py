@@ -0,0 +1,177 @@
+from app.overload import CANCELLED, SUCCESS, AdaptiveLimiter, classify_error
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+import asyncio
+import math
+import os
+import threading
+import time
+
+T = TypeVar("T")
+
+# Off by default: a hedge is a second, billed extraction of the same image
+OPENAI_HEDGE_ENABLED = os.getenv("OPENAI_HEDGE_ENABLED", "false").lower() == "true"
+# Hedge once the first call has been outstanding longer than this share of recent calls
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0.95"))
+# Hedges may add at most this fraction of extra calls, e.g. 0.05 for 5%
+OPENAI_HEDGE_BUDGET = float(os.getenv("OPENAI_HEDGE_BUDGET", "0.05"))
+# Never hedge sooner than this, however fast recent calls were
+OPENAI_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("OPENAI_HEDGE_MIN_DELAY_SECONDS", "1.0"))
+# Recent latencies kept per model, and how many are needed before hedging starts
+OPENAI_HEDGE_WINDOW = int(os.getenv("OPENAI_HEDGE_WINDOW", "200"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+
+class RequestHedger:
+    """
+    Send a duplicate request when the first one is slower than usual.
+
+    Latencies of recent calls are kept per key (the model). Once a call has
+    been outstanding longer than the `percentile` of that window, an
+    identical second call is started and whichever finishes first wins; the
+    other is cancelled. If the first to finish failed, the other is still
+    awaited. Hedges are capped at `budget` extra calls per call made, so a
+    slow provider can't double the load on it, and when run with a concurrency
+    limiter a hedge needs a free slot of its own or isn't sent.
+
+    Args:
+        enabled: Whether to hedge at all; when False calls are only timed
+        percentile: Share of recent calls that finish before a hedge is sent
+        budget: Maximum hedges as a fraction of calls
+        min_delay: Lower bound on the hedge delay, in seconds
+        window: Recent latencies kept per key
+        min_samples: Latencies needed for a key before it is hedged
+    """
+
+    def __init__(
+        self,
+        enabled: bool = OPENAI_HEDGE_ENABLED,
+        percentile: float = OPENAI_HEDGE_PERCENTILE,
+        budget: float = OPENAI_HEDGE_BUDGET,
+        min_delay: float = OPENAI_HEDGE_MIN_DELAY_SECONDS,
+        window: int = OPENAI_HEDGE_WINDOW,
+        min_samples: int = OPENAI_HEDGE_MIN_SAMPLES,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+        self.no_slot = 0
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging a call for `key`, or None if there are too few samples."""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, math.ceil(self.percentile * len(samples)) - 1)
+        return max(samples[index], self.min_delay)
+
+    def _record(self, key: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                self.over_budget += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def _take_slot(self, limiter: Optional[AdaptiveLimiter]) -> bool:
+        if limiter is None or limiter.try_acquire():
+            return True
+        with self._lock:
+            # Give back the budget taken for a hedge that isn't sent
+            self.hedges -= 1
+            self.no_slot += 1
+        return False
+
+    @staticmethod
+    def _release_slot(limiter: AdaptiveLimiter, started: float, task: asyncio.Future):
+        if task.cancelled():
+            outcome = CANCELLED
+        else:
+            outcome = SUCCESS if task.exception() is None else classify_error(task.exception())
+        limiter.release(time.monotonic() - started, outcome)
+
+    async def run(self, key: str, call: Callable[[], Awaitable[T]],
+                  limiter: Optional[AdaptiveLimiter] = None) -> T:
+        """
+        Await `call()`, hedging it with a second `call()` if it runs long.
+
+        Args:
+            key: Latency window to use, e.g. the model name
+            call: Starts one request; invoked again for the hedge
+            limiter: Concurrency limit the caller already holds a slot of for
+                `call()`; the hedge is only sent if it can take another slot
+                straight away, and releases it when it finishes
+
+        Returns:
+            The result of whichever call succeeded first
+        """
+        started = time.monotonic()
+        with self._lock:
+            self.calls += 1
+        delay = self.hedge_delay(key) if self.enabled else None
+        if delay is None:
+            result = await call()
+            self._record(key, time.monotonic() - started)
+            return result
+
+        primary = asyncio.ensure_future(call())
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._take_budget() or not self._take_slot(limiter):
+                result = await primary
+                self._record(key, time.monotonic() - started)
+                return result
+
+            hedge = asyncio.ensure_future(call())
+            if limiter is not None:
+                # A done callback rather than `finally`, so the slot is freed even if the hedge never starts
+                hedge_started = time.monotonic()
+                hedge.add_done_callback(lambda task: self._release_slot(limiter, hedge_started, task))
+            pending = {primary, hedge}
+            try:
+                while True:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    winner = min(done, key=lambda task: task.exception() is not None)
+                    if winner.exception() is None or not pending:
+                        break
+                if winner is hedge and winner.exception() is None:
+                    with self._lock:
+                        self.hedge_wins += 1
+                result = winner.result()
+                # Timed from the primary's start, never the hedge's: a hedge's own shorter latency
+                # would pull the percentile, and with it the hedge delay, down with every win
+                self._record(key, time.monotonic() - started)
+                return result
+            finally:
+                for task in pending:
+                    task.cancel()
+        finally:
+            if not primary.done():
+                primary.cancel()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "over_budget": self.over_budget,
+                "no_slot": self.no_slot,
+                "hedge_rate": round(self.hedges / self.calls, 4) if self.calls else 0.0,
+            }
+
+# Shared by every extraction so the latency window and budget are process-wide
+openai_hedger = RequestHedger()
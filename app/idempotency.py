@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Tuple
+import asyncio
+import os
+import time
+
+# How long a completed result is replayed for, and how many keys are remembered
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused for a different request."""
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    task: asyncio.Future
+    created_at: float
+
+class IdempotencyStore:
+    """
+    Run each idempotency key's work once and share its result.
+
+    The first request with a key starts the work as its own task. Duplicates
+    that arrive while it runs await the same task; duplicates that arrive
+    later get the stored result straight away. A key reused with a different
+    fingerprint (request body) raises IdempotencyConflict. Work that fails is
+    forgotten, so a retry runs it again.
+
+    Completed entries expire after `ttl` seconds, and the oldest completed
+    ones are evicted beyond `max_entries`. In-flight entries are never evicted.
+
+    Args:
+        ttl: Seconds a completed result is kept
+        max_entries: Completed results kept at most
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.replays = 0
+        self.attached = 0
+        self.conflicts = 0
+        # Kept on the loop so stats(), read from /metrics' threadpool, never iterates _entries
+        self.in_flight = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def _prune(self, now: float):
+        # Entries are in creation order, so only the expired prefix is scanned
+        stale = []
+        excess = len(self._entries) + 1 - self.max_entries  # room for the entry about to be added
+        for key, entry in self._entries.items():
+            if now - entry.created_at <= self.ttl and len(stale) >= excess:
+                break
+            if entry.task.done():
+                stale.append(key)
+        for key in stale:
+            del self._entries[key]
+
+    def _settled(self, key: str, entry: _Entry):
+        self.in_flight -= 1
+        if (entry.task.cancelled() or entry.task.exception() is not None) and self._entries.get(key) is entry:
+            del self._entries[key]
+
+    async def run(self, key: str, fingerprint: str, work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Return the result of `work` for `key`, running it only if no request has yet.
+
+        Args:
+            key: The client's Idempotency-Key
+            fingerprint: Identifies the request body; a different one for the same key is a conflict
+            work: Produces the result; called at most once per key while its result is kept
+
+        Returns:
+            The result, and whether it came from an earlier request
+        """
+        now = time.monotonic()
+        self._prune(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict(key)
+            if entry.task.done():
+                self.replays += 1
+            else:
+                self.attached += 1
+            # Shielded so a duplicate that disconnects doesn't cancel the original's work
+            return await asyncio.shield(entry.task), True
+
+        entry = _Entry(fingerprint, asyncio.ensure_future(work()), now)
+        self._entries[key] = entry
+        self.in_flight += 1
+        entry.task.add_done_callback(lambda task: self._settled(key, entry))
+        return await asyncio.shield(entry.task), False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "in_flight": self.in_flight,
+            "replays": self.replays,
+            "attached": self.attached,
+            "conflicts": self.conflicts,
+        }
+
+# Results of /scan requests sent with an Idempotency-Key
+idempotency_store = IdempotencyStore()
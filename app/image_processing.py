@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+import logging
+import os
+
+# Try to import Pillow, fall back to passing images through untouched if unavailable
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+    PILLOW_AVAILABLE = True
+except Exception:
+    PILLOW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+IMAGE_NORMALIZATION_ENABLED = os.getenv("IMAGE_NORMALIZATION_ENABLED", "true").lower() == "true"
+# The vision model downsamples to a 2048px box anyway; anything larger is wasted upload
+IMAGE_MAX_LONG_EDGE = int(os.getenv("IMAGE_MAX_LONG_EDGE", "2048"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() == "true"
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    base64: Optional[str] = None
+
+    @property
+    def normalized_bytes(self) -> int:
+        return len(self.data)
+
+def sniff_mime_type(image_bytes: bytes) -> str:
+    """
+    Detect the image MIME type from its magic bytes, defaulting to JPEG.
+    """
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_bytes[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+def normalize_image(
+    image_bytes: bytes,
+    max_long_edge: int = IMAGE_MAX_LONG_EDGE,
+    grayscale: bool = IMAGE_GRAYSCALE,
+    output_format: str = IMAGE_OUTPUT_FORMAT,
+    quality: int = IMAGE_QUALITY,
+    enabled: bool = IMAGE_NORMALIZATION_ENABLED,
+) -> NormalizedImage:
+    """
+    Prepare a receipt photo for the vision model.
+
+    Applies the EXIF orientation, optionally converts to grayscale, downsizes
+    so the long edge fits `max_long_edge`, and re-encodes to `output_format`.
+    If Pillow is unavailable or the bytes can't be decoded, the original
+    image is passed through with its sniffed MIME type. This is CPU-bound;
+    call it from a worker thread on the request path.
+
+    Args:
+        image_bytes: Raw bytes of the uploaded image
+        max_long_edge: Maximum size of the longest side in pixels
+        grayscale: Whether to drop colour information
+        output_format: Pillow format name to re-encode to (JPEG, WEBP, PNG)
+        quality: Encoder quality for lossy formats
+
+    Returns:
+        NormalizedImage with the bytes to send and their MIME type
+    """
+    original = NormalizedImage(image_bytes, sniff_mime_type(image_bytes), len(image_bytes))
+    if not enabled or not PILLOW_AVAILABLE:
+        return original
+
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            source_size = image.size
+            # 0x0112 is the EXIF Orientation tag; 1 means already upright
+            rotated = image.getexif().get(0x0112, 1) != 1
+            oriented = ImageOps.exif_transpose(image)
+            if grayscale:
+                oriented = oriented.convert("L")
+            elif oriented.mode not in ("RGB", "L"):
+                oriented = oriented.convert("RGB")
+            oriented.thumbnail((max_long_edge, max_long_edge), Image.Resampling.LANCZOS)
+            resized = oriented.size != source_size
+
+            buffer = BytesIO()
+            save_kwargs = {"optimize": True}
+            if output_format in ("JPEG", "WEBP"):
+                save_kwargs["quality"] = quality
+            oriented.save(buffer, format=output_format, **save_kwargs)
+            width, height = oriented.size
+    # DecompressionBombError (a small file that decodes to a huge image) derives straight from Exception
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+        logger.warning(f"Image normalization skipped: {e}")
+        return original
+
+    data = buffer.getvalue()
+    # Re-encoding an already small, upright image can make it bigger; keep the original then
+    if len(data) >= len(image_bytes) and not (rotated or resized):
+        original.width, original.height = source_size
+        return original
+
+    return NormalizedImage(data, MIME_TYPES.get(output_format, "image/jpeg"), len(image_bytes), width, height)
@@ -0,0 +1,268 @@
+from app.llm_handler import extract_receipt, notion_outbox, push_to_notion_async
+from app.models import Receipt
+from app.outbox import DELIVERED, FAILED, PENDING
+from app.overload import CircuitOpen
+from app.uploads import UploadedImage
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+MAX_RETAINED_JOBS = int(os.getenv("MAX_RETAINED_JOBS", "1000"))
+# Deferred Notion writes run at once; beyond this they are left to the outbox drainer
+JOB_MAX_NOTION_WRITES = int(os.getenv("JOB_MAX_NOTION_WRITES", "32"))
+# How long shutdown waits for in-flight background Notion writes
+JOB_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("JOB_SHUTDOWN_TIMEOUT_SECONDS", "30"))
+# How long a queued scan waits for the OpenAI circuit breaker to close before failing
+JOB_CIRCUIT_WAIT_SECONDS = float(os.getenv("JOB_CIRCUIT_WAIT_SECONDS", "120"))
+
+class JobStage(Enum):
+    QUEUED = "queued"
+    EXTRACTING = "extracting"
+    PUSHING_TO_NOTION = "pushing_to_notion"
+    # The first Notion write failed and the outbox is retrying it
+    NOTION_QUEUED = "notion_queued"
+    DONE = "done"
+    FAILED = "failed"
+
+@dataclass
+class Job:
+    id: str
+    stage: JobStage = JobStage.QUEUED
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    receipt_data: Optional[Dict[str, Any]] = None
+    notion_response: Optional[Dict[str, Any]] = None
+    outbox_id: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in (JobStage.DONE, JobStage.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "stage": self.stage.value,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "timings": self.timings,
+            "receipt_data": self.receipt_data,
+            "notion_response": self.notion_response,
+            "outbox_id": self.outbox_id,
+            "error": self.error,
+        }
+
+class JobQueueFull(Exception):
+    pass
+
+class JobManager:
+    """
+    In-process worker pool that runs receipt scans in the background.
+
+    `submit` enqueues an already-validated image and returns immediately;
+    `workers` coroutines pull from the queue and run the extraction and
+    Notion stages, recording per-stage timings on the job.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._background: Set[asyncio.Task] = set()
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.started:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} scan job workers")
+
+    async def stop(self):
+        if self._background:
+            await asyncio.wait(self._background, timeout=JOB_SHUTDOWN_TIMEOUT_SECONDS)
+        # Writes still running are cancelled, which hands their receipts back to the outbox
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def submit(self, upload: UploadedImage) -> Job:
+        """
+        Enqueue an image for background processing.
+
+        Args:
+            upload: The already-validated receipt image
+
+        Returns:
+            The queued Job
+
+        Raises:
+            JobQueueFull: If the queue is at capacity
+        """
+        await self.start()
+        self._prune()
+        job = Job(id=uuid.uuid4().hex)
+        try:
+            self._queue.put_nowait((job, upload))
+        except asyncio.QueueFull:
+            raise JobQueueFull("Scan job queue is full")
+        self.jobs[job.id] = job
+        return job
+
+    async def submit_notion_write(self, receipt: Receipt) -> Job:
+        """
+        Write an already-extracted receipt to Notion in the background.
+
+        The returned job starts in the Notion stage; poll it for the page id and url.
+        At most JOB_MAX_NOTION_WRITES writes run at once. Past that the
+        receipt is recorded in the outbox for its drainer to write, and the
+        job starts out queued on it.
+
+        Args:
+            receipt: The parsed Receipt
+
+        Returns:
+            The Job tracking the Notion write
+
+        Raises:
+            JobQueueFull: If the writes are at capacity and the outbox is disabled
+        """
+        self._prune()
+        job = Job(id=uuid.uuid4().hex, stage=JobStage.PUSHING_TO_NOTION, receipt_data=receipt.model_dump())
+        if len(self._background) >= JOB_MAX_NOTION_WRITES:
+            if not notion_outbox.enabled:
+                raise JobQueueFull("Too many Notion writes in progress")
+            job.outbox_id = await asyncio.to_thread(notion_outbox.add, receipt, PENDING)
+            job.stage = JobStage.NOTION_QUEUED
+            self._finish(job)
+            self.jobs[job.id] = job
+            return job
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run_notion_write(job, receipt))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def refresh(self, job: Job) -> Job:
+        """
+        Settle a job whose Notion write was left to the outbox.
+
+        Once the outbox has delivered the receipt the job is done with the
+        delivered page; once it has given up the job fails with the last error.
+        """
+        if job.stage is not JobStage.NOTION_QUEUED or job.outbox_id is None:
+            return job
+        entry = await asyncio.to_thread(notion_outbox.get, job.outbox_id)
+        if entry is None:
+            return job
+        if entry["status"] == DELIVERED:
+            job.notion_response = {
+                "status": "success",
+                "page_id": entry["page_id"],
+                "page_url": entry["page_url"],
+                "outbox_id": job.outbox_id,
+                "message": "Receipt successfully added to Notion database",
+            }
+            job.stage = JobStage.DONE
+        elif entry["status"] == FAILED:
+            job.error = entry["last_error"]
+            job.stage = JobStage.FAILED
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self.jobs.items()):
+            # Jobs waiting on the outbox are kept as long as finished ones
+            if job.finished_at is not None and (job.finished_at < cutoff or len(self.jobs) >= MAX_RETAINED_JOBS):
+                del self.jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job, upload = await self._queue.get()
+            try:
+                await self._run(job, upload)
+            finally:
+                self._queue.task_done()
+
+    async def _extract(self, upload: UploadedImage) -> Receipt:
+        # Background scans wait out an open circuit instead of failing like /scan does
+        deadline = time.monotonic() + JOB_CIRCUIT_WAIT_SECONDS
+        while True:
+            try:
+                return await extract_receipt(upload.data, upload.sha256, upload.base64)
+            except CircuitOpen as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                await asyncio.sleep(min(max(e.retry_after, 0.1), remaining))
+
+    async def _push(self, job: Job, receipt: Receipt):
+        job.stage = JobStage.PUSHING_TO_NOTION
+        stage_start = time.perf_counter()
+        job.notion_response = await push_to_notion_async(receipt)
+        job.outbox_id = job.notion_response.get("outbox_id")
+        job.timings["notion"] = time.perf_counter() - stage_start
+        status = job.notion_response.get("status")
+        if status == "error":
+            raise RuntimeError(job.notion_response.get("message", "Failed to push to Notion"))
+        job.stage = JobStage.NOTION_QUEUED if status == "queued" else JobStage.DONE
+
+    def _fail(self, job: Job, error: Exception):
+        logger.exception(f"Scan job {job.id} failed")
+        job.error = str(error)
+        job.stage = JobStage.FAILED
+
+    def _finish(self, job: Job):
+        job.finished_at = time.time()
+        job.timings["total"] = job.finished_at - job.created_at
+
+    async def _run(self, job: Job, upload: UploadedImage):
+        started = time.time()
+        job.timings["queued"] = started - job.created_at
+        try:
+            job.stage = JobStage.EXTRACTING
+            stage_start = time.perf_counter()
+            receipt = await self._extract(upload)
+            job.receipt_data = receipt.model_dump()
+            job.timings["extraction"] = time.perf_counter() - stage_start
+
+            await self._push(job, receipt)
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self._finish(job)
+
+    async def _run_notion_write(self, job: Job, receipt: Receipt):
+        try:
+            await self._push(job, receipt)
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self._finish(job)
+
+job_manager = JobManager()
@@ -1,61 +1,437 @@
 import os
+import asyncio
 import base64
+import hashlib
+import httpx
+import json
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from openai import OpenAI
+from functools import lru_cache
+from pathlib import Path
+from app.cache import receipt_cache
+from app.hedging import openai_hedger
+from app import image_processing
+from app.image_processing import NormalizedImage, normalize_image, sniff_mime_type
+from app.metrics import (
+    OPENAI_INPUT_TOKENS, OPENAI_OUTPUT_TOKENS, OPENAI_REQUESTS, OPENAI_TIER_SECONDS,
+    RECEIPT_ESCALATIONS, RECEIPT_MODEL_ROUTING, stage,
+)
 from app.models import Receipt
-from app.notion_client import NotionReceiptManager
-import yaml
+from app.outbox import NotionOutbox
+from app.overload import SUCCESS, classify_error, openai_breaker, openai_limiter
+from app.progress import ProgressCallback, report
+from app.logging_setup import log_event
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
 import logging
+import threading
+import time
+
+if TYPE_CHECKING:
+    from app.notion_client import NotionReceiptManager
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-with open('app/prompt.yaml', 'r') as file:
-    system_prompt = yaml.safe_load(file)['SYSTEM_PROMPT']
+# Resolved next to this module so the app can start from any working directory
+PROMPT_PATH = Path(__file__).with_name("prompt.yaml")
+EXTRACTION_INSTRUCTION = "Analyze this receipt image and extract the information according to the specified format."
+# Requests sharing a key are routed together, which raises prompt cache hit rates; empty disables
+OPENAI_PROMPT_CACHE_KEY = os.getenv("OPENAI_PROMPT_CACHE_KEY", "receipt-extraction-v1")
 
-def get_openai_client():
-    """Initializes and returns the OpenAI client, ensuring the API key is set."""
+# Receipts are extracted with the fast model first and re-extracted with the strong
+# model only when the result fails receipt_problems(); an empty fast model disables this
+OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", "gpt-5-mini")
+OPENAI_STRONG_MODEL = os.getenv("OPENAI_STRONG_MODEL", "gpt-5")
+# Largest difference between the item sum (less discount) and the total that still counts as reconciled
+RECEIPT_TOTAL_TOLERANCE = float(os.getenv("RECEIPT_TOTAL_TOLERANCE", "0.05"))
+
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+
+_openai_client = None
+_async_openai_client = None
+_client_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def get_system_prompt() -> str:
+    """Load the extraction system prompt on first use."""
+    import yaml
+
+    with open(PROMPT_PATH, 'r') as file:
+        return yaml.safe_load(file)['SYSTEM_PROMPT']
+
+@lru_cache(maxsize=1)
+def extraction_version() -> str:
+    """
+    Fingerprint of everything that shapes an extraction besides the image.
+
+    Prefixed to receipt cache keys, so a new prompt, schema, model or
+    normalization setting stops old extractions from being served.
+    """
+    parts = [
+        get_system_prompt(),
+        EXTRACTION_INSTRUCTION,
+        json.dumps(Receipt.model_json_schema(), sort_keys=True),
+        json.dumps(_model_tiers()),
+        json.dumps([
+            image_processing.PILLOW_AVAILABLE, image_processing.IMAGE_NORMALIZATION_ENABLED,
+            image_processing.IMAGE_MAX_LONG_EDGE, image_processing.IMAGE_GRAYSCALE,
+            image_processing.IMAGE_OUTPUT_FORMAT, image_processing.IMAGE_QUALITY,
+        ]),
+    ]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+def _get_openai_api_key() -> str:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         # This will be caught by the global exception handler in main.py
         raise ValueError("OPENAI_API_KEY environment variable not found.")
-    return OpenAI(api_key=api_key)
+    return api_key
+
+def get_openai_client():
+    """Returns the shared synchronous OpenAI client, creating it on first use."""
+    global _openai_client
+    with _client_lock:
+        if _openai_client is None:
+            # The SDK is imported on first use; it is the largest part of `import app.main`
+            from openai import OpenAI
+
+            _openai_client = OpenAI(api_key=_get_openai_api_key(), timeout=OPENAI_TIMEOUT_SECONDS)
+    return _openai_client
+
+def get_async_openai_client():
+    """
+    Returns the shared AsyncOpenAI client, creating it on first use.
+
+    The client owns a single keep-alive connection pool so concurrent scans
+    reuse connections instead of paying a TLS handshake per request.
+    """
+    global _async_openai_client
+    with _client_lock:
+        if _async_openai_client is None:
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                )
+            )
+            _async_openai_client = AsyncOpenAI(
+                api_key=_get_openai_api_key(),
+                timeout=OPENAI_TIMEOUT_SECONDS,
+                http_client=http_client,
+            )
+    return _async_openai_client
+
+def warm_up():
+    """
+    Import the OpenAI SDK, build the shared client and load the prompt.
+
+    Blocking; the app lifespan runs it in a worker thread so the server starts
+    accepting requests (and passing health checks) while this finishes.
+    """
+    get_system_prompt()
+    if os.getenv("OPENAI_API_KEY"):
+        get_async_openai_client()
+
+async def close_openai_clients():
+    """Closes the shared OpenAI clients. Called from the app lifespan on shutdown."""
+    global _openai_client, _async_openai_client
+    if _async_openai_client is not None:
+        await _async_openai_client.close()
+        _async_openai_client = None
+    if _openai_client is not None:
+        _openai_client.close()
+        _openai_client = None
 
 database_id = os.getenv("NOTION_TRANSACTIONS_DATABASE_ID")
 
-def process_receipt(image_bytes: bytes):
-    # Convert image bytes to base64
-    base64_image = base64.b64encode(image_bytes).decode('utf-8')
-    
-    client = get_openai_client()
-    response = client.responses.parse(
-        model="gpt-5",
-        input=[
-            {"role": "system", "content": system_prompt},
+def build_receipt_request(image: NormalizedImage, model: str = OPENAI_STRONG_MODEL) -> dict:
+    """
+    Build the keyword arguments for a `responses.parse` receipt extraction call.
+
+    The provider caches prompts by exact prefix, so everything that is the same
+    for every scan comes first and is byte-identical between calls: the system
+    prompt (loaded once), the Receipt schema (sent by the SDK as the response
+    format) and the instruction text. The image, the only per-request part,
+    goes last.
+
+    Args:
+        image: The normalized receipt image
+        model: OpenAI model to extract with
+
+    Returns:
+        Dictionary of arguments shared by the sync and async extraction paths
+    """
+    # Convert image bytes to base64, unless it was built while the upload streamed in
+    base64_image = image.base64
+    if base64_image is None:
+        with stage("base64_encode"):
+            base64_image = base64.b64encode(image.data).decode('utf-8')
+
+    request = {
+        "model": model,
+        "input": [
+            {"role": "system", "content": get_system_prompt()},
             {
                 "role": "user",
                 "content": [
                     {
-                        "type": "input_text", 
-                        "text": "Analyze this receipt image and extract the information according to the specified format."
+                        "type": "input_text",
+                        "text": EXTRACTION_INSTRUCTION
                     },
                     {
                         "type": "input_image",
-                        "image_url": f"data:image/jpeg;base64,{base64_image}"
+                        "image_url": f"data:{image.mime_type};base64,{base64_image}"
                     }
                 ]
             }
         ],
-        text_format=Receipt,
-        reasoning={
-        "effort": "minimal"
+        "text_format": Receipt,
+        "reasoning": {
+            "effort": "minimal"
+        },
     }
+    if OPENAI_PROMPT_CACHE_KEY:
+        # Not a named parameter of responses.parse in the pinned SDK
+        request["extra_body"] = {"prompt_cache_key": OPENAI_PROMPT_CACHE_KEY}
+    return request
+
+def _log_normalization(image: NormalizedImage):
+    log_event(
+        logger, logging.INFO, "image_normalized", "Image normalized: %d -> %d bytes",
+        image.original_bytes, image.normalized_bytes,
+        mime_type=image.mime_type, width=image.width, height=image.height,
+    )
+
+def record_openai_usage(response):
+    """
+    Count input tokens as cached or uncached, and log a summary of the response.
+
+    `usage.input_tokens_details.cached_tokens` is the part of the prompt the
+    provider served from its prompt cache.
+    """
+    usage = getattr(response, "usage", None)
+    input_tokens = getattr(usage, "input_tokens", None) or 0
+    details = getattr(usage, "input_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    output_tokens = getattr(usage, "output_tokens", None) or 0
+
+    OPENAI_INPUT_TOKENS.inc(cached_tokens, cache="cached")
+    OPENAI_INPUT_TOKENS.inc(input_tokens - cached_tokens, cache="uncached")
+    OPENAI_OUTPUT_TOKENS.inc(output_tokens)
+    OPENAI_REQUESTS.inc(cache="hit" if cached_tokens else "miss")
+
+    # A summary at INFO; the full response object only when DEBUG is on
+    log_event(
+        logger, logging.INFO, "openai_response", "OpenAI response %s", getattr(response, "id", None),
+        model=getattr(response, "model", None),
+        input_tokens=input_tokens,
+        cached_tokens=cached_tokens,
+        output_tokens=output_tokens,
     )
-    logger.info(f"OpenAIResponse: {response}")
+    logger.debug("OpenAIResponse: %s", response)
+
+def receipt_problems(receipt: Optional[Receipt]) -> List[str]:
+    """
+    Check an extracted Receipt for internal consistency.
+
+    The checks are cheap and local: the item, price and quantity lists line
+    up, the items add up to the total, and the date is plausible. Whether
+    `items_price` is per unit or per line and whether the discount is already
+    in the prices varies between receipts, so the total reconciles if any of
+    those readings matches within RECEIPT_TOTAL_TOLERANCE.
+
+    Args:
+        receipt: The parsed Receipt, or None if the response couldn't be parsed
+
+    Returns:
+        Names of the failed checks; empty if the receipt looks consistent
+    """
+    if receipt is None:
+        return ["not_parsed"]
+
+    problems = []
+    if not (len(receipt.items) == len(receipt.items_price) == len(receipt.items_quantity)):
+        problems.append("length_mismatch")
+    else:
+        unit_sum = sum(receipt.items_price)
+        line_sum = sum(price * quantity for price, quantity in zip(receipt.items_price, receipt.items_quantity))
+        discount = abs(receipt.discount or 0.0)
+        if not any(abs(items - deduction - receipt.total) <= RECEIPT_TOTAL_TOLERANCE
+                   for items in (unit_sum, line_sum) for deduction in (discount, 0.0)):
+            problems.append("total_mismatch")
+
+    receipt_date = receipt.date.replace(tzinfo=None)
+    if receipt_date.year < 2000 or receipt_date > datetime.now() + timedelta(days=1):
+        problems.append("implausible_date")
+    return problems
+
+def _model_tiers():
+    if OPENAI_FAST_MODEL and OPENAI_FAST_MODEL != OPENAI_STRONG_MODEL:
+        return [("fast", OPENAI_FAST_MODEL), ("strong", OPENAI_STRONG_MODEL)]
+    return [("strong", OPENAI_STRONG_MODEL)]
+
+def _accept_tier(tier: str, response, final: bool) -> bool:
+    # The last tier's result is used as-is; earlier tiers must pass the local checks
+    problems = [] if final else receipt_problems(response.output_parsed)
+    if problems:
+        for problem in problems:
+            RECEIPT_ESCALATIONS.inc(reason=problem)
+        log_event(logger, logging.INFO, "receipt_escalated", "Escalating from %s model: %s",
+                  tier, ", ".join(problems), tier=tier, problems=problems)
+        return False
+    RECEIPT_MODEL_ROUTING.inc(tier=tier)
+    return True
+
+def process_receipt(image_bytes: bytes):
+    with stage("image_normalize"):
+        image = normalize_image(image_bytes)
+    _log_normalization(image)
+    client = get_openai_client()
+    request = build_receipt_request(image)
+    tiers = _model_tiers()
+    for index, (tier, model) in enumerate(tiers):
+        with stage("openai_call"), OPENAI_TIER_SECONDS.time(tier=tier):
+            response = client.responses.parse(**dict(request, model=model))
+        record_openai_usage(response)
+        if _accept_tier(tier, response, final=index == len(tiers) - 1):
+            break
     return response
 
+async def _guarded_parse(client, request: dict, model: str):
+    """
+    One extraction call behind the circuit breaker and the adaptive concurrency limit.
+
+    A hedge of the call takes a concurrency slot of its own, see RequestHedger.
+    Raises CircuitOpen without calling OpenAI while the breaker is open.
+    """
+    openai_breaker.before_call()
+    outcome = SUCCESS
+    try:
+        await openai_limiter.acquire()
+    except BaseException as e:
+        openai_breaker.record(classify_error(e))
+        raise
+    started = time.monotonic()
+    try:
+        return await openai_hedger.run(
+            model, lambda: client.responses.parse(**dict(request, model=model)), openai_limiter
+        )
+    except BaseException as e:
+        outcome = classify_error(e)
+        raise
+    finally:
+        openai_limiter.release(time.monotonic() - started, outcome)
+        openai_breaker.record(outcome)
+
+async def process_receipt_async(image_bytes: bytes, image_base64: str = None,
+                                on_progress: Optional[ProgressCallback] = None):
+    """
+    Extract receipt data without blocking the event loop.
+
+    The image is normalized in a worker thread before being sent to OpenAI,
+    unless a precomputed base64 payload is supplied. It is extracted with
+    OPENAI_FAST_MODEL first and sent to OPENAI_STRONG_MODEL only if that
+    result fails `receipt_problems`. With OPENAI_HEDGE_ENABLED, a call that
+    runs longer than usual is hedged with a duplicate (see RequestHedger).
+    Calls go through the OpenAI circuit breaker and adaptive concurrency
+    limit; CircuitOpen is raised while the breaker is open.
+
+    Args:
+        image_bytes: Raw bytes of the receipt image
+        image_base64: Base64 of image_bytes built while the upload streamed in
+        on_progress: Receives "normalized", then "extracting" before each model call
+
+    Returns:
+        The parsed OpenAI response; `output_parsed` holds the Receipt
+    """
+    if image_base64 is not None:
+        image = NormalizedImage(image_bytes, sniff_mime_type(image_bytes), len(image_bytes), base64=image_base64)
+    else:
+        with stage("image_normalize"):
+            image = await asyncio.to_thread(normalize_image, image_bytes)
+    _log_normalization(image)
+    report(on_progress, "normalized", original_bytes=image.original_bytes, normalized_bytes=image.normalized_bytes,
+           mime_type=image.mime_type, width=image.width, height=image.height)
+    client = get_async_openai_client()
+    request = build_receipt_request(image)
+    tiers = _model_tiers()
+    for index, (tier, model) in enumerate(tiers):
+        report(on_progress, "extracting", tier=tier, model=model)
+        with stage("openai_call"), OPENAI_TIER_SECONDS.time(tier=tier):
+            response = await _guarded_parse(client, request, model)
+        record_openai_usage(response)
+        if _accept_tier(tier, response, final=index == len(tiers) - 1):
+            break
+    return response
+
+async def extract_receipt(image_bytes: bytes, image_hash: str = None, image_base64: str = None,
+                          on_progress: Optional[ProgressCallback] = None) -> Receipt:
+    """
+    Return the parsed Receipt for an image, consulting the content-addressed cache first.
+
+    Re-uploads of the same bytes are answered from the cache without calling
+    OpenAI, as long as the prompt, schema, models and normalization settings
+    are unchanged (see extraction_version).
+
+    Args:
+        image_bytes: Raw bytes of the receipt image
+        image_hash: SHA-256 hex digest of image_bytes, if already computed
+        image_base64: Base64 of image_bytes, if already computed; the image is then sent as-is
+        on_progress: Receives the extraction stage events, see process_receipt_async
+
+    Returns:
+        The parsed Receipt
+    """
+    key = f"{extraction_version()}:{image_hash or receipt_cache.key(image_bytes)}"
+    receipt = await receipt_cache.get_async(key)
+    if receipt is not None:
+        log_event(logger, logging.INFO, "receipt_cache_hit", "Receipt cache hit for %s", key[:12])
+        return receipt
+
+    response = await process_receipt_async(image_bytes, image_base64, on_progress)
+    receipt = response.output_parsed
+    if receipt is not None:
+        await receipt_cache.set_async(key, receipt)
+    return receipt
+
+def normalize_receipt_for_notion(receipt_data: Receipt) -> dict:
+    """
+    Convert a Receipt into the property dictionary NotionReceiptManager expects.
+
+    Args:
+        receipt_data: Receipt object containing parsed receipt information
+
+    Returns:
+        Dictionary with the category as a string and missing text fields filled in
+    """
+    # Convert enum to string value before sending to Notion
+    receipt_dict = receipt_data.model_dump()
+    receipt_dict['reciept_category'] = receipt_dict['reciept_category'].value
+    # Do NOT blanket-replace None with strings. Notion expects correct types.
+    # Normalize optional text fields to a friendly fallback, leave numbers/dates as-is.
+    for text_key in [
+        'store_name',
+        'store_first_line',
+        'store_second_line',
+        'store_postcode',
+    ]:
+        if receipt_dict.get(text_key) in (None, ""):
+            receipt_dict[text_key] = "Unknown"
+    return receipt_dict
+
+def _notion_success(page: dict) -> dict:
+    return {
+        "status": "success",
+        "database_id": database_id,
+        "page_id": page["id"],
+        "page_url": page.get("url", ""),
+        "message": "Receipt successfully added to Notion database"
+    }
+
 def push_to_notion(receipt_data: Receipt) -> dict:
     """
     Push receipt data to Notion database.
@@ -67,31 +443,14 @@ def push_to_notion(receipt_data: Receipt) -> dict:
         Dictionary containing the response from Notion
     """
     try:
+        from app.notion_client import NotionReceiptManager
         notion_manager = NotionReceiptManager()
-        # Convert enum to string value before sending to Notion
-        receipt_dict = receipt_data.model_dump()
-        receipt_dict['reciept_category'] = receipt_dict['reciept_category'].value
-        # Do NOT blanket-replace None with strings. Notion expects correct types.
-        # Normalize optional text fields to a friendly fallback, leave numbers/dates as-is.
-        for text_key in [
-            'store_name',
-            'store_first_line',
-            'store_second_line',
-            'store_postcode',
-        ]:
-            if receipt_dict.get(text_key) in (None, ""):
-                receipt_dict[text_key] = "Unknown"
-
-        logger.info(f"Receipt dictionary (normalized): {receipt_dict}")
+        receipt_dict = normalize_receipt_for_notion(receipt_data)
+
+        logger.debug("Receipt dictionary (normalized): %s", receipt_dict)
         page = notion_manager.create_new_entry(receipt_dict)
         if page:
-            return {
-                "status": "success",
-                "database_id": database_id,
-                "page_id": page["id"],
-                "page_url": page.get("url", ""),
-                "message": "Receipt successfully added to Notion database"
-            }
+            return _notion_success(page)
         
     except Exception as e:
         return {
@@ -99,6 +458,64 @@ def push_to_notion(receipt_data: Receipt) -> dict:
             "message": f"Failed to push to Notion: {str(e)}"
         }
 
+async def write_receipt_to_notion(receipt_data: Receipt, notion_manager: "NotionReceiptManager" = None,
+                                  on_progress: Optional[ProgressCallback] = None,
+                                  checkpoint: Optional[Dict[str, Any]] = None,
+                                  save_checkpoint: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None) -> dict:
+    """
+    Write receipt data to Notion, raising on failure.
+
+    Item rows are written concurrently under the shared Notion rate limit.
+
+    Args:
+        receipt_data: Receipt object containing parsed receipt information
+        notion_manager: Optional manager to reuse across receipts
+        on_progress: Receives the page and item write events, see create_new_entry_async
+        checkpoint: Progress of an earlier, failed attempt to resume from
+        save_checkpoint: Called with the progress after every step that succeeds
+
+    Returns:
+        Dictionary containing the response from Notion
+    """
+    # Imported on first write, like the OpenAI SDK, to keep it out of startup
+    from app.notion_client import NotionReceiptManager, WriteCheckpoint
+    notion_manager = notion_manager or NotionReceiptManager()
+    receipt_dict = normalize_receipt_for_notion(receipt_data)
+
+    logger.debug("Receipt dictionary (normalized): %s", receipt_dict)
+    page = await notion_manager.create_new_entry_async(
+        receipt_dict, on_progress, WriteCheckpoint(checkpoint, save_checkpoint)
+    )
+    return _notion_success(page)
+
+notion_outbox = NotionOutbox(write_receipt_to_notion)
+
+async def push_to_notion_async(receipt_data: Receipt, notion_manager: "NotionReceiptManager" = None,
+                               on_progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Push receipt data to Notion without blocking the event loop.
+
+    With the outbox enabled the receipt is recorded durably first, so a failed
+    write is retried in the background instead of being lost.
+
+    Args:
+        receipt_data: Receipt object containing parsed receipt information
+        notion_manager: Optional manager to reuse across receipts
+        on_progress: Receives the page and item write events
+
+    Returns:
+        Dictionary containing the response from Notion
+    """
+    try:
+        if notion_outbox.enabled:
+            return await notion_outbox.deliver(receipt_data, notion_manager=notion_manager, on_progress=on_progress)
+        return await write_receipt_to_notion(receipt_data, notion_manager, on_progress)
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Failed to push to Notion: {str(e)}"
+        }
+
 if __name__ == "__main__":
     import requests
     image_path = '/Users/admin/Desktop/test_receipt2.png'
@@ -0,0 +1,214 @@
+from app.security import SensitiveDataFilter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for human-readable lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Longest string kept in a structured field; longer values are truncated
+LOG_MAX_FIELD_LENGTH = int(os.getenv("LOG_MAX_FIELD_LENGTH", "1024"))
+# Comma-separated event=rate pairs, e.g. "receipt_scan_requested=0.1,openai_response=0.01"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for pair in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = pair.partition("=")
+        rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+def _truncate(value: Any, max_length: int) -> Any:
+    if isinstance(value, str) and max_length and len(value) > max_length:
+        return f"{value[:max_length]}... [truncated {len(value) - max_length} chars]"
+    return value
+
+def log_event(logger: logging.Logger, level: int, event: str, message: str, *args, **fields):
+    """
+    Log a structured event.
+
+    Nothing is built when the level is disabled; otherwise the fields travel
+    with the record and are only serialized on the listener thread.
+
+    Args:
+        logger: Logger to emit on
+        level: Logging level, e.g. logging.INFO
+        event: Event name, used for sampling and as the "event" JSON key
+        message: Human-readable message, %-formatted with args on the listener thread
+        *args: Message arguments
+        **fields: Structured fields added to the JSON object
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={"event": event, "fields": fields})
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of high-volume events.
+
+    Records whose `event` has a configured rate are kept with that
+    probability; everything else passes. Runs before the record is queued,
+    so dropped events cost a dict lookup and a random draw.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.dropped = 0
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+class JsonFormatter(logging.Formatter):
+    """
+    Render a record as one JSON object per line.
+
+    Structured fields passed with `log_event` (or any `extra` keys) become
+    top-level keys, with long strings truncated to `max_field_length`.
+    """
+
+    def __init__(self, max_field_length: int = LOG_MAX_FIELD_LENGTH):
+        super().__init__()
+        self.max_field_length = max_field_length
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key != "fields":
+                entry[key] = _truncate(value, self.max_field_length)
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = _truncate(value, self.max_field_length)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with structured fields appended as key=value."""
+
+    def __init__(self, max_field_length: int = LOG_MAX_FIELD_LENGTH):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.max_field_length = max_field_length
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={_truncate(str(value), self.max_field_length)}"
+                                   for key, value in fields.items())
+        return line
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hand records to the listener thread without formatting them.
+
+    The stock QueueHandler formats the message on the calling thread before
+    queuing it. Here the record is queued as-is, so formatting, redaction and
+    the write to stderr all happen on the listener thread. When the queue is
+    full, the record is dropped and counted rather than blocking the event loop.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Shallow copy: redaction on the listener thread mustn't mutate the record other handlers see
+        return copy.copy(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_sampling_filter: Optional[SamplingFilter] = None
+_setup_lock = threading.Lock()
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    log_format: str = LOG_FORMAT,
+    sample_rates: Optional[Dict[str, float]] = None,
+    queue_size: int = LOG_QUEUE_SIZE,
+    stream=None,
+) -> QueueListener:
+    """
+    Route all logging through a queue drained by a background listener thread.
+
+    Application threads only filter (level, sampling) and enqueue records;
+    the listener formats them, redacts secrets and writes them out. Existing
+    root handlers are left in place. Safe to call more than once: later calls
+    return the running listener.
+
+    Args:
+        level: Root log level
+        log_format: "json" or "text"
+        sample_rates: Per-event keep probabilities; defaults to LOG_SAMPLE_RATES
+        queue_size: Records buffered before new ones are dropped
+        stream: Output stream; defaults to stderr
+
+    Returns:
+        The running QueueListener
+    """
+    global _listener, _queue_handler, _sampling_filter
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+        output.addFilter(SensitiveDataFilter())
+
+        _sampling_filter = SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES) if sample_rates is None else sample_rates)
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        _queue_handler.addFilter(_sampling_filter)
+
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+
+        _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _listener
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener = None
+        _queue_handler = None
+
+def logging_stats() -> Dict[str, int]:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped_queue_full": _queue_handler.dropped if _queue_handler else 0,
+        "dropped_sampled": _sampling_filter.dropped if _sampling_filter else 0,
+    }
@@ -1,69 +1,387 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Request
-from app.llm_handler import process_receipt, push_to_notion
-from app.security import setup_security_middleware, validate_file_upload, validate_auth_token, log_security_event
-from datetime import datetime
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import List
+from app.llm_handler import process_receipt, extract_receipt, push_to_notion, push_to_notion_async, warm_up, close_openai_clients, notion_outbox
+from app.cache import receipt_cache
+from app.jobs import job_manager, JobQueueFull
+from app.logging_setup import setup_logging, logging_stats
+from app.metrics import MetricsMiddleware, registry, stage, stats_family
+from app.notion_governor import notion_governor
+from app.hedging import openai_hedger
+from app.idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyConflict, idempotency_store
+from app.overload import CircuitOpen, STATES, openai_breaker, openai_limiter
+from app.security import setup_security_middleware, validate_file_upload, validate_auth_token, log_security_event, RequestSizeLimitMiddleware
+from app.uploads import read_upload
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import math
 import os
+import time
 
-app = FastAPI(title="Receipt Scanner API", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+# Format, redact and write log records on a background thread, off the event loop
+setup_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the OpenAI SDK and create its connection pool in the background, so
+    # startup isn't held up by it but the first scan usually doesn't pay for it
+    warm = asyncio.create_task(asyncio.to_thread(warm_up))
+    # Likewise for the process-wide Notion clients; the SDK is only imported when configured
+    if os.getenv("NOTION_TOKEN"):
+        from app.notion_client import NotionReceiptManager, get_notion_client, get_async_notion_client, \
+            NOTION_WRITE_LAYOUT
+        get_notion_client()
+        get_async_notion_client()
+        # Validate (or find or create) the shared Items database once rather than per receipt
+        if NOTION_WRITE_LAYOUT == "shared_items":
+            try:
+                await NotionReceiptManager().ensure_shared_items_db_async()
+            except Exception:
+                # Start anyway rather than crash-looping on a Notion outage; the first write tries again
+                logger.exception("Could not prepare the shared Items database; retrying on the first write")
+    await job_manager.start()
+    # Replay Notion writes interrupted by the last shutdown and keep retrying failed ones
+    await notion_outbox.start()
+    yield
+    await asyncio.gather(warm, return_exceptions=True)
+    await job_manager.stop()
+    await notion_outbox.stop()
+    await close_openai_clients()
+    from app.notion_client import close_notion_clients
+    await close_notion_clients()
+    receipt_cache.close()
+
+app = FastAPI(title="Receipt Scanner API", version="1.0.0", lifespan=lifespan)
 limiter = setup_security_middleware(app)
 
 AUTH_TOKEN = os.getenv("AUTH_TOKEN")
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE_MB", "100"))
+# Return /scan as soon as extraction finishes and write to Notion in the background
+DEFER_NOTION_WRITE = os.getenv("DEFER_NOTION_WRITE", "false").lower() == "true"
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "8"))
+# Whole /scan/batch body, however many files it holds
+BATCH_MAX_BODY_MB = int(os.getenv("BATCH_MAX_BODY_MB", "200"))
+
+# Refuse oversized bodies before multipart parsing; 1MB of slack covers form overhead
+app.add_middleware(RequestSizeLimitMiddleware, limits={
+    "/scan": (MAX_FILE_SIZE + 1) * 1024 * 1024,
+    "/scan/stream": (MAX_FILE_SIZE + 1) * 1024 * 1024,
+    "/scan/batch": (BATCH_MAX_BODY_MB + 1) * 1024 * 1024,
+})
+app.add_middleware(MetricsMiddleware, paths=["/scan", "/scan/stream", "/scan/batch"])
+
+def notion_connection_snapshot() -> dict:
+    # Imported here rather than at module level so the Notion SDK stays out of startup
+    from app.notion_client import notion_connection_stats
+    return notion_connection_stats.snapshot()
+
+@registry.register_collector
+def collect_component_stats():
+    # Read on each scrape from the stats the components already keep
+    cache_stats = receipt_cache.stats()
+    memory_entries = cache_stats.pop("memory_entries")
+    breaker_stats = openai_breaker.stats()
+    return [
+        stats_family("receipt_cache_lookups_total", "counter", "Receipt cache lookups by result",
+                     cache_stats, "result"),
+        ("receipt_cache_memory_entries", "gauge", "Receipts held in the in-memory cache tier",
+         [("", {}, memory_entries)]),
+        stats_family("notion_governor", "gauge", "Notion rate governor statistics",
+                     notion_governor.stats(), "stat"),
+        stats_family("openai_hedging", "gauge", "OpenAI request hedging: calls, hedges sent and won, hedge rate",
+                     openai_hedger.stats(), "stat"),
+        stats_family("openai_concurrency", "gauge", "Adaptive OpenAI concurrency limit and slot usage",
+                     openai_limiter.stats(), "stat"),
+        ("openai_circuit_state", "gauge", "OpenAI circuit breaker state, 1 for the current one",
+         [("", {"state": state}, int(state == breaker_stats["state"])) for state in STATES]),
+        stats_family("openai_circuit", "gauge", "OpenAI circuit breaker failure rate, openings and rejected calls",
+                     {key: value for key, value in breaker_stats.items() if key != "state"}, "stat"),
+        stats_family("idempotency", "gauge", "Idempotency-Key store entries, replays and conflicts",
+                     idempotency_store.stats(), "stat"),
+        stats_family("notion_connections", "gauge", "Notion HTTP connection pool statistics",
+                     notion_connection_snapshot(), "stat"),
+        stats_family("notion_outbox_entries", "gauge", "Notion outbox entries by status",
+                     notion_outbox.stats(), "status"),
+        stats_family("log_records", "gauge", "Logging queue depth and dropped records",
+                     logging_stats(), "stat"),
+    ]
+
+def circuit_open_error(error: CircuitOpen) -> HTTPException:
+    # Fail fast while OpenAI is failing rather than waiting out its timeout
+    return HTTPException(
+        status_code=503,
+        detail="Receipt extraction is temporarily unavailable, try again later",
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
 
 @app.post("/scan")
 @limiter.limit(f"{os.getenv('RATE_LIMIT_PER_MINUTE', '10')}/minute")
 async def scan_receipt(
     request: Request,
     file: UploadFile = File(...),
-    authorization: str = Header(None)
+    authorization: str = Header(None),
+    idempotency_key: str = Header(None),
+    async_mode: bool = Query(False, alias="async"),
+    defer_notion: bool = Query(DEFER_NOTION_WRITE)
 ):
-    # Authentication
-    validate_auth_token(authorization, AUTH_TOKEN)
-    
-    # File validation
-    validate_file_upload(file, MAX_FILE_SIZE)
+    with stage("validation"):
+        # Authentication
+        validate_auth_token(authorization, AUTH_TOKEN)
+
+        # File validation
+        validate_file_upload(file, MAX_FILE_SIZE)
+
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400,
+                                detail=f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
     
     try:
-        # Read the uploaded file
-        image_bytes = await file.read()
-        
-        # Additional file size check after reading
-        if len(image_bytes) > MAX_FILE_SIZE * 1024 * 1024:
-            raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_FILE_SIZE}MB")
+        # Read the uploaded file in chunks, aborting once it exceeds the size limit
+        with stage("upload_read"):
+            upload = await read_upload(file, MAX_FILE_SIZE)
         
         # Log successful request
         log_security_event("receipt_scan_requested", request, {
-            "file_size": len(image_bytes),
+            "file_size": upload.size,
             "content_type": file.content_type
         })
-        
-        # Process the receipt image
-        receipt_response = process_receipt(image_bytes)       
 
-        #  
-        # Push to Notion
-        notion_response = push_to_notion(receipt_response.output_parsed)
-        
-        return {
-            "status": "success",
-            "receipt_data": receipt_response.output_parsed.model_dump(),
-            "notion_response": notion_response
-        }
+        async def scan() -> tuple:
+            # In async mode, hand the image to the worker pool and return straight away
+            if async_mode:
+                try:
+                    job = await job_manager.submit(upload)
+                except JobQueueFull:
+                    raise HTTPException(status_code=503, detail="Too many scans in progress, try again later")
+                return 202, {
+                    "status": "accepted",
+                    "job_id": job.id,
+                    "status_url": f"/jobs/{job.id}"
+                }
+
+            # Process the receipt image (served from the cache for repeat uploads)
+            receipt = await extract_receipt(upload.data, upload.sha256, upload.base64)
+
+            # Push to Notion, either now or in the background with the result available from /jobs
+            if defer_notion:
+                try:
+                    job = await job_manager.submit_notion_write(receipt)
+                except JobQueueFull:
+                    raise HTTPException(status_code=503, detail="Too many Notion writes in progress, try again later")
+                notion_response = {
+                    "status": "pending",
+                    "job_id": job.id,
+                    "status_url": f"/jobs/{job.id}"
+                }
+            else:
+                notion_response = await push_to_notion_async(receipt)
+
+            return 200, jsonable_encoder({
+                "status": "success",
+                "receipt_data": receipt.model_dump(),
+                "notion_response": notion_response
+            })
+
+        # A retry with the same Idempotency-Key replays (or waits for) the first request's
+        # response instead of extracting again and creating a second Notion page
+        replayed = False
+        if idempotency_key:
+            fingerprint = f"{upload.sha256}:{async_mode}:{defer_notion}"
+            (status_code, content), replayed = await idempotency_store.run(idempotency_key, fingerprint, scan)
+        else:
+            status_code, content = await scan()
+
+        response = JSONResponse(status_code=status_code, content=content)
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return response
         
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    except CircuitOpen as e:
+        raise circuit_open_error(e)
     except Exception as e:
         # Log error
         log_security_event("receipt_scan_error", request, {"error": str(e)})
         raise HTTPException(status_code=500, detail="Error processing receipt")
 
+# Streamed scans keep running if the client disconnects; hold them so they aren't garbage collected
+_stream_tasks = set()
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/scan/stream")
+@limiter.limit(f"{os.getenv('RATE_LIMIT_PER_MINUTE', '10')}/minute")
+async def scan_receipt_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    authorization: str = Header(None)
+):
+    """
+    Scan a receipt and report each stage as a server-sent event.
+
+    Events, each with a `timestamp` and `elapsed_ms` since the upload was read:
+    received, normalized, extracting (per model tier), extracted (with the
+    receipt), notion_page_created, notion_items_written (written/total),
+    then done (with the Notion response) or error.
+    """
+    with stage("validation"):
+        validate_auth_token(authorization, AUTH_TOKEN)
+        validate_file_upload(file, MAX_FILE_SIZE)
+
+    # Read before streaming starts; the upload is closed once the response begins
+    with stage("upload_read"):
+        upload = await read_upload(file, MAX_FILE_SIZE)
+    log_security_event("receipt_scan_requested", request, {
+        "file_size": upload.size,
+        "content_type": file.content_type,
+        "stream": True
+    })
+
+    received = time.monotonic()
+    events = asyncio.Queue()
+
+    def on_progress(event: str, fields: dict):
+        # Stamped when the stage happens, not when the client reads it
+        events.put_nowait((event, {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "elapsed_ms": round((time.monotonic() - received) * 1000, 1),
+            **fields
+        }))
+
+    async def scan():
+        try:
+            receipt = await extract_receipt(upload.data, upload.sha256, upload.base64, on_progress=on_progress)
+            on_progress("extracted", {"receipt_data": receipt.model_dump(mode="json")})
+            notion_response = await push_to_notion_async(receipt, on_progress=on_progress)
+            on_progress("done", {"notion_response": notion_response})
+        except CircuitOpen as e:
+            on_progress("error", {"detail": circuit_open_error(e).detail, "retry_after": math.ceil(e.retry_after)})
+        except Exception as e:
+            log_security_event("receipt_scan_error", request, {"error": str(e)})
+            on_progress("error", {"detail": "Error processing receipt"})
+
+    on_progress("received", {"file_size": upload.size, "content_type": file.content_type})
+
+    async def stream():
+        task = asyncio.create_task(scan())
+        _stream_tasks.add(task)
+        task.add_done_callback(_stream_tasks.discard)
+        while True:
+            event, data = await events.get()
+            yield sse_event(event, data)
+            if event in ("done", "error"):
+                return
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stop nginx-style proxies from buffering the stream
+        "X-Accel-Buffering": "no"
+    })
+
+@app.post("/scan/batch")
+@limiter.limit(f"{os.getenv('RATE_LIMIT_PER_MINUTE', '10')}/minute")
+async def scan_receipt_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    authorization: str = Header(None)
+):
+    # Authentication
+    validate_auth_token(authorization, AUTH_TOKEN)
+
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files. Maximum batch size is {BATCH_MAX_FILES}")
+
+    log_security_event("receipt_batch_scan_requested", request, {
+        "file_count": len(files)
+    })
+
+    # One Notion manager for the whole batch
+    try:
+        from app.notion_client import NotionReceiptManager
+        notion_manager = NotionReceiptManager()
+    except Exception:
+        notion_manager = None
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_PARALLELISM)
+
+    async def scan_file(file: UploadFile) -> dict:
+        async with semaphore:
+            try:
+                with stage("validation"):
+                    validate_file_upload(file, MAX_FILE_SIZE)
+                with stage("upload_read"):
+                    upload = await read_upload(file, MAX_FILE_SIZE)
+
+                receipt = await extract_receipt(upload.data, upload.sha256, upload.base64)
+                notion_response = await push_to_notion_async(receipt, notion_manager)
+                return {
+                    "filename": file.filename,
+                    "status": "success",
+                    "receipt_data": receipt.model_dump(),
+                    "notion_response": notion_response
+                }
+            except HTTPException as e:
+                return {"filename": file.filename, "status": "error", "error": e.detail}
+            except CircuitOpen as e:
+                return {"filename": file.filename, "status": "error", "error": circuit_open_error(e).detail}
+            except Exception as e:
+                log_security_event("receipt_scan_error", request, {"error": str(e), "filename": file.filename})
+                return {"filename": file.filename, "status": "error", "error": "Error processing receipt"}
+
+    results = await asyncio.gather(*(scan_file(file) for file in files))
+
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    if succeeded == len(results):
+        status = "success"
+    elif succeeded:
+        status = "partial"
+    else:
+        status = "error"
+
+    return {
+        "status": status,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, authorization: str = Header(None)):
+    validate_auth_token(authorization, AUTH_TOKEN)
+
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = await job_manager.refresh(job)
+    return job.to_dict()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Sync so the outbox's SQLite count runs in the threadpool, off the event loop
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health():
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "notion_connections": notion_connection_snapshot(),
+        "notion_governor": notion_governor.stats(),
+        "openai_concurrency": openai_limiter.stats(),
+        "openai_circuit": openai_breaker.stats()
     }
 
 @app.get("/")
@@ -74,7 +392,11 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
-            "scan": "/scan (POST)"
+            "metrics": "/metrics",
+            "scan": "/scan (POST)",
+            "scan_stream": "/scan/stream (POST, text/event-stream)",
+            "batch": "/scan/batch (POST)",
+            "jobs": "/jobs/{job_id} (GET)"
         }
     }
 
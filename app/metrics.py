@@ -0,0 +1,363 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import threading
+import time
+
+# Stage latencies range from sub-millisecond validation to multi-second LLM calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REPORTED_QUANTILES = (0.5, 0.95, 0.99)
+
+# (metric name, type, help, [(sample suffix, labels, value)])
+MetricFamily = Tuple[str, str, str, List[Tuple[str, Dict[str, str], float]]]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. errors or cache hits."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            samples = [("", self._labels(key), value) for key, value in self._values.items()]
+        return [(self.name, self.kind, self.documentation, samples)]
+
+class Gauge(_Metric):
+    """Value that can go up and down, e.g. requests in flight."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            samples = [("", self._labels(key), value) for key, value in self._values.items()]
+        return [(self.name, self.kind, self.documentation, samples)]
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket latency histogram.
+
+    Observing a value is a bisect and three additions under a lock, so it is
+    cheap enough for every request. Quantiles are estimated from the buckets
+    by linear interpolation, the same way Prometheus' `histogram_quantile` does,
+    and are exported alongside the buckets as a `<name>_quantile` gauge.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._counts: Dict[tuple, List[int]] = {}
+        self._sums: Dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), ()))
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """
+        Estimate the q-quantile (0 < q < 1) for one label set.
+
+        Returns:
+            The estimated value in seconds, or None if nothing has been observed
+        """
+        with self._lock:
+            counts = list(self._counts.get(self._key(labels), ()))
+        return self._estimate(q, counts)
+
+    def _estimate(self, q: float, counts: List[int]) -> Optional[float]:
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    # Beyond the last bucket all we know is the lower bound
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            snapshot = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+
+        samples = []
+        quantiles = []
+        for key, counts, total_sum in snapshot:
+            labels = self._labels(key)
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", {**labels, "le": _format_value(upper)}, cumulative))
+            samples.append(("_sum", labels, total_sum))
+            samples.append(("_count", labels, cumulative))
+            for q in REPORTED_QUANTILES:
+                quantiles.append(("", {**labels, "quantile": str(q)}, self._estimate(q, counts)))
+
+        return [
+            (self.name, self.kind, self.documentation, samples),
+            (f"{self.name}_quantile", "gauge",
+             f"{self.documentation} (estimated p50/p95/p99)", quantiles),
+        ]
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them in the Prometheus text format.
+
+    Besides registered metrics, collectors can be added for components that
+    already keep their own statistics (cache, outbox, Notion pools); they are
+    called on each scrape rather than on the request path.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: Dict[str, Callable[[], Iterable[MetricFamily]]] = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        # Keyed by name so re-importing the registering module doesn't duplicate output
+        self._collectors[collector.__name__] = collector
+        return collector
+
+    def collect(self) -> List[MetricFamily]:
+        families = []
+        for metric in self._metrics:
+            families.extend(metric.collect())
+        for collector in self._collectors.values():
+            families.extend(collector())
+        return families
+
+    def render(self) -> str:
+        lines = []
+        for name, kind, documentation, samples in self.collect():
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def stats_family(name: str, kind: str, documentation: str, values: Dict[str, float],
+                 label: str) -> MetricFamily:
+    """
+    Turn a component's stats dict into one metric family, one sample per key.
+
+    Args:
+        name: Metric name
+        kind: "counter" or "gauge"
+        documentation: HELP text
+        values: The stats, e.g. `{"memory_hits": 3, "misses": 1}`
+        label: Label name the dict keys are exported under
+    """
+    return (name, kind, documentation, [("", {label: key}, value) for key, value in values.items()])
+
+registry = MetricsRegistry()
+
+SCAN_STAGE_SECONDS = registry.register(Histogram(
+    "receipt_scan_stage_duration_seconds",
+    "Time spent in each stage of a receipt scan",
+    ["stage"],
+))
+SCAN_STAGE_ERRORS = registry.register(Counter(
+    "receipt_scan_stage_errors_total",
+    "Exceptions raised inside each stage of a receipt scan",
+    ["stage"],
+))
+HTTP_REQUESTS = registry.register(Counter(
+    "receipt_scanner_http_requests_total",
+    "HTTP requests by path and response status",
+    ["path", "status"],
+))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "receipt_scanner_http_requests_in_flight",
+    "HTTP requests currently being handled",
+    ["path"],
+))
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "receipt_scanner_http_request_duration_seconds",
+    "End-to-end HTTP request latency",
+    ["path"],
+))
+OPENAI_INPUT_TOKENS = registry.register(Counter(
+    "openai_input_tokens_total",
+    "OpenAI input tokens, split by whether the provider's prompt cache served them",
+    ["cache"],
+))
+OPENAI_OUTPUT_TOKENS = registry.register(Counter(
+    "openai_output_tokens_total",
+    "OpenAI output tokens",
+))
+OPENAI_REQUESTS = registry.register(Counter(
+    "openai_requests_total",
+    "OpenAI requests, by whether any input tokens were served from the prompt cache",
+    ["cache"],
+))
+OPENAI_TIER_SECONDS = registry.register(Histogram(
+    "openai_model_tier_duration_seconds",
+    "OpenAI extraction latency per model tier",
+    ["tier"],
+))
+RECEIPT_MODEL_ROUTING = registry.register(Counter(
+    "receipt_model_routing_total",
+    "Extractions by the model tier whose result was used",
+    ["tier"],
+))
+RECEIPT_ESCALATIONS = registry.register(Counter(
+    "receipt_model_escalations_total",
+    "Fast-tier extractions escalated to the strong model, by failed check",
+    ["reason"],
+))
+
+@registry.register_collector
+def collect_prompt_cache_hit_ratio():
+    cached = OPENAI_INPUT_TOKENS.value(cache="cached")
+    total = cached + OPENAI_INPUT_TOKENS.value(cache="uncached")
+    return [("openai_prompt_cache_hit_ratio", "gauge", "Share of OpenAI input tokens served from the prompt cache",
+             [("", {}, cached / total if total else 0.0)])]
+
+@contextmanager
+def stage(name: str):
+    """
+    Time one stage of a scan and count the exceptions it raises.
+
+    Usage:
+        with stage("openai_call"):
+            response = await client.responses.parse(...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SCAN_STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        SCAN_STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+class MetricsMiddleware:
+    """
+    Count requests, errors and in-flight requests for the instrumented paths.
+
+    Only the listed paths get their own label, so per-job URLs can't blow up
+    the label cardinality.
+
+    Args:
+        app: ASGI application
+        paths: Request paths to instrument
+    """
+
+    def __init__(self, app, paths: Sequence[str]):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["type"] != "http" or path not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def recording_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(path=path)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            HTTP_IN_FLIGHT.dec(path=path)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+            HTTP_REQUESTS.inc(path=path, status=str(status))
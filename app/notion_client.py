@@ -1,19 +1,181 @@
-from notion_client import Client
+from notion_client import AsyncClient, Client, APIResponseError
 from dotenv import load_dotenv
-from typing import Dict, Any, List
+from typing import Dict, Any, Awaitable, Callable, List, Optional
 from app.models import ReceiptCategory
+from app.metrics import stage
+from app.notion_governor import notion_governor, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from app.progress import ProgressCallback, report
 from datetime import datetime
+import asyncio
+import httpx
 import os 
+import threading
 import logging
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.info("NotionReceiptManager initialized")
 
-class NotionReceiptManager:
+NOTION_BASE_URL = os.getenv("NOTION_BASE_URL", "https://api.notion.com")
+NOTION_MAX_CONCURRENCY = int(os.getenv("NOTION_MAX_CONCURRENCY", "3"))
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))
+NOTION_MAX_CONNECTIONS = int(os.getenv("NOTION_MAX_CONNECTIONS", "10"))
+NOTION_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("NOTION_KEEPALIVE_EXPIRY_SECONDS", "60"))
+NOTION_TIMEOUT_MS = int(os.getenv("NOTION_TIMEOUT_MS", "60000"))
+# "inline_database": an Items database under each page with one row per item (N + 2 calls)
+# "table": items as a table block created together with the page (1 call up to 99 items)
+# "shared_items": one page per item in a single shared Items database, related to the transaction
+#                 (async write path only; the sync path falls back to "inline_database")
+NOTION_WRITE_LAYOUT = os.getenv("NOTION_WRITE_LAYOUT", "inline_database")
+# Shared Items database for the "shared_items" layout; if unset, an "Items" database under
+# PAGE_ID is looked up at startup and only created when there isn't one
+NOTION_ITEMS_DATABASE_ID = os.getenv("NOTION_ITEMS_DATABASE_ID")
+SHARED_ITEMS_DB_TITLE = "Items"
+# Notion accepts at most 100 children in any single block array
+NOTION_MAX_BLOCK_CHILDREN = 100
+
+class ConnectionStats:
+    """
+    Counts Notion requests and the TCP connections opened to serve them.
+
+    Uses httpcore's trace extension, so every request that doesn't open a new
+    connection was served from the keep-alive pool.
+    """
+
     def __init__(self):
-        self.client = Client(auth=os.environ["NOTION_TOKEN"])
+        self.requests = 0
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+    def _on_trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+
+    async def _on_trace_async(self, event_name: str, info: dict):
+        self._on_trace(event_name, info)
+
+    def on_request(self, request: httpx.Request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._on_trace
+
+    async def on_request_async(self, request: httpx.Request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._on_trace_async
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": max(self.requests - self.connections_opened, 0),
+            }
+
+notion_connection_stats = ConnectionStats()
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=NOTION_MAX_CONNECTIONS,
+        max_keepalive_connections=NOTION_MAX_CONNECTIONS,
+        keepalive_expiry=NOTION_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+def create_notion_client(base_url: str = NOTION_BASE_URL, stats: ConnectionStats = notion_connection_stats) -> Client:
+    """Build a synchronous Notion client backed by a keep-alive connection pool."""
+    http_client = httpx.Client(limits=_pool_limits(), event_hooks={"request": [stats.on_request]})
+    return Client(client=http_client, auth=os.environ["NOTION_TOKEN"], base_url=base_url, timeout_ms=NOTION_TIMEOUT_MS)
+
+def create_async_notion_client(base_url: str = NOTION_BASE_URL, stats: ConnectionStats = notion_connection_stats) -> AsyncClient:
+    """Build an asynchronous Notion client backed by a keep-alive connection pool."""
+    http_client = httpx.AsyncClient(limits=_pool_limits(), event_hooks={"request": [stats.on_request_async]})
+    return AsyncClient(client=http_client, auth=os.environ["NOTION_TOKEN"], base_url=base_url, timeout_ms=NOTION_TIMEOUT_MS)
+
+_notion_client: Optional[Client] = None
+_async_notion_client: Optional[AsyncClient] = None
+
+def get_notion_client() -> Client:
+    """Returns the process-wide synchronous Notion client, creating it on first use."""
+    global _notion_client
+    if _notion_client is None:
+        _notion_client = create_notion_client()
+    return _notion_client
+
+def get_async_notion_client() -> AsyncClient:
+    """Returns the process-wide asynchronous Notion client, creating it on first use."""
+    global _async_notion_client
+    if _async_notion_client is None:
+        _async_notion_client = create_async_notion_client()
+    return _async_notion_client
+
+async def close_notion_clients():
+    """Closes the shared Notion clients. Called from the app lifespan on shutdown."""
+    global _notion_client, _async_notion_client
+    if _async_notion_client is not None:
+        await _async_notion_client.aclose()
+        _async_notion_client = None
+    if _notion_client is not None:
+        _notion_client.close()
+        _notion_client = None
+
+# Resolved (and validated or created) once by `ensure_shared_items_db_async`
+shared_items_db_id: Optional[str] = NOTION_ITEMS_DATABASE_ID
+shared_items_db_ready = False
+_shared_items_db_lock = asyncio.Lock()
+
+def _retry_after_seconds(error: APIResponseError, attempt: int) -> float:
+    retry_after = error.headers.get("retry-after") if error.headers else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(2 ** attempt * 0.5, 30.0)
+
+class WriteCheckpoint:
+    """
+    How far one receipt's Notion write got, so a retry resumes instead of starting over.
+
+    Holds the ids of what has been created so far (transaction page, item
+    database, table block) and which item rows or table chunks were written.
+    Every step calls `update`, which hands a snapshot to `save`, e.g. to
+    persist it on the outbox row. Saves run one at a time, so a slow save
+    can't overwrite a newer snapshot.
+
+    Args:
+        state: Progress recorded by an earlier attempt
+        save: Coroutine persisting a snapshot of the state
+    """
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None,
+                 save: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        self.state = dict(state or {})
+        self._save = save
+        self._lock = asyncio.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.state.get(key, default)
+
+    async def update(self, **values):
+        async with self._lock:
+            self.state.update(values)
+            if self._save is not None:
+                await self._save(dict(self.state))
+
+    async def item_written(self, index: int):
+        async with self._lock:
+            self.state["items_written"] = sorted(set(self.state.get("items_written", [])) | {index})
+            if self._save is not None:
+                await self._save(dict(self.state))
+
+class NotionReceiptManager:
+    def __init__(self, client: Client = None, async_client: AsyncClient = None, write_layout: str = None):
+        # Default to the shared pooled clients so managers are cheap to create per request
+        self.client = client or get_notion_client()
+        self.async_client = async_client or get_async_notion_client()
+        self.write_layout = write_layout or NOTION_WRITE_LAYOUT
+        self.items_db_id = shared_items_db_id
+        self.governor = notion_governor
+        self.max_concurrency = NOTION_MAX_CONCURRENCY
         self.parent_page_id = os.getenv("PAGE_ID")
         self.transaction_db_id = os.getenv("NOTION_TRANSACTIONS_DATABASE_ID")
 
@@ -67,7 +229,8 @@ class NotionReceiptManager:
             }
         }
         
-        database = self.client.databases.create(
+        database = self._request(
+            self.client.databases.create,
             parent={"page_id": parent_page_id},
             title=[{"type": "text", "text": {"content": database_name}}],
             properties=properties,
@@ -76,9 +239,59 @@ class NotionReceiptManager:
         
         return database
 
-    def create_page(self, database_id: str, properties: Dict[str, Any]) -> Dict[str, Any]:
+    def _request(self, endpoint, priority: int = PRIORITY_NORMAL, **kwargs) -> Dict[str, Any]:
         """
-        Create a new page in the database with the given properties.
+        Issue a governed Notion call on the sync client, retrying 429s.
+
+        Args:
+            endpoint: Bound endpoint method, e.g. `self.client.pages.create`
+            priority: Queue priority when waiting for the rate limit
+            **kwargs: Arguments forwarded to the endpoint
+
+        Returns:
+            The Notion API response
+        """
+        attempt = 0
+        while True:
+            self.governor.acquire_sync(priority)
+            try:
+                return endpoint(**kwargs)
+            except APIResponseError as e:
+                if e.status != 429 or attempt >= NOTION_MAX_RETRIES:
+                    raise
+                delay = _retry_after_seconds(e, attempt)
+                logger.warning("Notion rate limited, retrying in %.2fs", delay)
+                self.governor.on_rate_limited(delay)
+                attempt += 1
+
+    async def _request_async(self, endpoint, priority: int = PRIORITY_NORMAL, **kwargs) -> Dict[str, Any]:
+        """
+        Issue a governed Notion call on the async client, retrying 429s.
+
+        Args:
+            endpoint: Bound async endpoint method, e.g. `self.async_client.pages.create`
+            priority: Queue priority when waiting for the rate limit
+            **kwargs: Arguments forwarded to the endpoint
+
+        Returns:
+            The Notion API response
+        """
+        attempt = 0
+        while True:
+            await self.governor.acquire(priority)
+            try:
+                return await endpoint(**kwargs)
+            except APIResponseError as e:
+                if e.status != 429 or attempt >= NOTION_MAX_RETRIES:
+                    raise
+                delay = _retry_after_seconds(e, attempt)
+                logger.warning("Notion rate limited, retrying in %.2fs", delay)
+                self.governor.on_rate_limited(delay)
+                attempt += 1
+
+    def build_page_properties(self, properties: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the Notion property payload for a transaction page.
         """
         page_properties = {
             "Store Name": {
@@ -108,23 +321,34 @@ class NotionReceiptManager:
         if isinstance(discount_value, (int, float)):
             page_properties["Discount"] = {"number": float(discount_value)}
 
-        page = self.client.pages.create(
-            parent={"database_id": database_id},
-            properties=page_properties
-        )
+        return page_properties
+
+    def create_page(self, database_id: str, properties: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Create a new page in the database with the given properties.
+        """
+        with stage("notion_page_create"):
+            page = self._request(
+                self.client.pages.create,
+                PRIORITY_HIGH,
+                parent={"database_id": database_id},
+                properties=self.build_page_properties(properties)
+            )
         return page
 
-    def create_item_db(self, parent_page_id: str, db_name: str = "Items Database") -> Dict[str, Any]:
+    async def create_page_async(self, database_id: str, properties: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Create a new database for items.
-        
-        Args:
-            parent_page_id: The ID of the parent page where the database will be created
-            db_name: The name of the database
-            
-        Returns:
-            The created database object
+        Async variant of `create_page`.
         """
+        with stage("notion_page_create"):
+            return await self._request_async(
+                self.async_client.pages.create,
+                PRIORITY_HIGH,
+                parent={"database_id": database_id},
+                properties=self.build_page_properties(properties)
+            )
+
+    def _item_db_payload(self, parent_page_id: str, db_name: str) -> Dict[str, Any]:
         properties = {
             "Item": {
                 "title": {}  # Required property
@@ -145,13 +369,48 @@ class NotionReceiptManager:
         icon = {"type": "emoji", "emoji": "🧾"}
         parent = {"type": "page_id", "page_id": parent_page_id}
         
-        return self.client.databases.create(
-            parent=parent,
-            title=title, 
-            properties=properties,
-            icon=icon,
-            is_inline=True
-        )
+        return {
+            "parent": parent,
+            "title": title,
+            "properties": properties,
+            "icon": icon,
+            "is_inline": True
+        }
+
+    def create_item_db(self, parent_page_id: str, db_name: str = "Items Database") -> Dict[str, Any]:
+        """
+        Create a new database for items.
+        
+        Args:
+            parent_page_id: The ID of the parent page where the database will be created
+            db_name: The name of the database
+            
+        Returns:
+            The created database object
+        """
+        with stage("notion_item_db_create"):
+            return self._request(self.client.databases.create, **self._item_db_payload(parent_page_id, db_name))
+
+    async def create_item_db_async(self, parent_page_id: str, db_name: str = "Items Database") -> Dict[str, Any]:
+        """
+        Async variant of `create_item_db`.
+        """
+        with stage("notion_item_db_create"):
+            return await self._request_async(
+                self.async_client.databases.create,
+                **self._item_db_payload(parent_page_id, db_name)
+            )
+
+    @staticmethod
+    def _item_properties(item: str, price: float, quantity: int, transaction_id: str = None) -> Dict[str, Any]:
+        item_properties = {
+            "Item": {"title": [{"text": {"content": item}}]},
+            "Price": {"number": price},
+            "Quantity": {"number": quantity}
+        }
+        if transaction_id:
+            item_properties["Transaction"] = {"relation": [{"id": transaction_id}]}
+        return item_properties
 
     def create_items_within_page(self, database_id: str, properties: Dict[str, Any]) -> bool:
         """
@@ -162,22 +421,297 @@ class NotionReceiptManager:
         items_price = properties["items_price"]
         items_quantity = properties["items_quantity"]
         
-        for item, price, quantity in zip(items, items_price, items_quantity):
-            self.client.pages.create(
-                parent={"database_id": database_id},
-                properties={
-                    "Item": {"title": [{"text": {"content": item}}]},
-                    "Price": {"number": price},
-                    "Quantity": {"number": quantity}
-                }
-            )
+        with stage("notion_item_writes"):
+            for item, price, quantity in zip(items, items_price, items_quantity):
+                self._request(
+                    self.client.pages.create,
+                    PRIORITY_LOW,
+                    parent={"database_id": database_id},
+                    properties=self._item_properties(item, price, quantity)
+                )
+        return True
+
+    async def create_items_within_page_async(self, database_id: str, properties: Dict[str, Any],
+                                             transaction_id: str = None,
+                                             on_progress: Optional[ProgressCallback] = None,
+                                             checkpoint: Optional[WriteCheckpoint] = None) -> bool:
+        """
+        Create items within a page concurrently.
+
+        At most `max_concurrency` item writes are in flight at once, and every
+        write goes through the shared rate limiter so bursts of receipts stay
+        under Notion's per-integration quota. When `transaction_id` is given,
+        each item is related to that transaction page. `on_progress` gets a
+        "notion_items_written" event as each item lands. Items already in
+        `checkpoint` are skipped, and each new one is recorded there.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        total = len(properties["items"])
+        done = set(checkpoint.get("items_written", [])) if checkpoint else set()
+        written = len(done)
+
+        async def create_item(index: int, item: str, price: float, quantity: int):
+            nonlocal written
+            async with semaphore:
+                row = await self._request_async(
+                    self.async_client.pages.create,
+                    PRIORITY_LOW,
+                    parent={"database_id": database_id},
+                    properties=self._item_properties(item, price, quantity, transaction_id)
+                )
+            if checkpoint is not None:
+                await checkpoint.item_written(index)
+            written += 1
+            report(on_progress, "notion_items_written", written=written, total=total)
+            return row
+
+        with stage("notion_item_writes"):
+            await asyncio.gather(*(
+                create_item(index, item, price, quantity)
+                for index, (item, price, quantity) in enumerate(zip(
+                    properties["items"], properties["items_price"], properties["items_quantity"]
+                ))
+                if index not in done
+            ))
         return True
 
+    def _shared_items_db_properties(self) -> Dict[str, Any]:
+        return {
+            "Item": {"title": {}},
+            "Price": {"number": {"format": "pound"}},
+            "Quantity": {"number": {"format": "number"}},
+            "Transaction": {
+                "relation": {"database_id": self.transaction_db_id, "single_property": {}}
+            }
+        }
+
+    async def _find_shared_items_db_async(self) -> Optional[str]:
+        # An Items database left under PAGE_ID by an earlier start, so restarts don't create another
+        parent_page_id = self.parent_page_id.replace("-", "")
+        query = {"query": SHARED_ITEMS_DB_TITLE, "filter": {"property": "object", "value": "database"},
+                 "page_size": 100}
+        while True:
+            response = await self._request_async(self.async_client.search, **query)
+            for database in response["results"]:
+                title = "".join(part.get("plain_text", "") for part in database.get("title", []))
+                parent = database.get("parent", {}).get("page_id") or ""
+                if title == SHARED_ITEMS_DB_TITLE and parent.replace("-", "") == parent_page_id \
+                        and not database.get("archived") and not database.get("in_trash"):
+                    return database["id"]
+            if not response.get("has_more"):
+                return None
+            query["start_cursor"] = response["next_cursor"]
+
+    async def ensure_shared_items_db_async(self) -> str:
+        """
+        Validate the shared Items database, finding or creating it under PAGE_ID if none is configured.
+
+        Without NOTION_ITEMS_DATABASE_ID, an "Items" database already under
+        PAGE_ID is reused and a new one is only created when there is none.
+        Missing properties (e.g. the Transaction relation on an existing
+        database) are added. The resolved id is cached process-wide so
+        per-receipt writes never pay for this again; until it succeeds,
+        every shared_items write tries again first.
+
+        Returns:
+            The shared Items database id
+
+        Raises:
+            ValueError: If neither NOTION_ITEMS_DATABASE_ID nor PAGE_ID is set
+        """
+        global shared_items_db_id, shared_items_db_ready
+        async with _shared_items_db_lock:
+            if shared_items_db_ready:
+                self.items_db_id = shared_items_db_id
+                return self.items_db_id
+            if not self.items_db_id and not self.parent_page_id:
+                raise ValueError("The shared_items layout needs NOTION_ITEMS_DATABASE_ID or PAGE_ID to be set")
+            if not self.items_db_id:
+                self.items_db_id = await self._find_shared_items_db_async()
+                if self.items_db_id:
+                    logger.info(f"Found shared Items database {self.items_db_id}; "
+                                f"set NOTION_ITEMS_DATABASE_ID to skip the lookup")
+            await self._prepare_shared_items_db_async()
+            shared_items_db_id = self.items_db_id
+            shared_items_db_ready = True
+            return self.items_db_id
+
+    async def _prepare_shared_items_db_async(self):
+        expected = self._shared_items_db_properties()
+
+        if self.items_db_id:
+            database = await self._request_async(self.async_client.databases.retrieve, database_id=self.items_db_id)
+            existing = database.get("properties", {})
+            missing = {
+                name: schema for name, schema in expected.items()
+                if name not in existing or existing[name].get("type") != next(iter(schema))
+            }
+            # A database has exactly one title property; rename it rather than adding another
+            if "Item" in missing:
+                del missing["Item"]
+                title_name = next(name for name, prop in existing.items() if prop.get("type") == "title")
+                missing[title_name] = {"name": "Item"}
+            if missing:
+                logger.info(f"Adding missing properties to Items database: {sorted(missing)}")
+                await self._request_async(
+                    self.async_client.databases.update, database_id=self.items_db_id, properties=missing
+                )
+        else:
+            database = await self._request_async(
+                self.async_client.databases.create,
+                parent={"type": "page_id", "page_id": self.parent_page_id},
+                title=[{"type": "text", "text": {"content": SHARED_ITEMS_DB_TITLE}}],
+                properties=expected,
+                icon={"type": "emoji", "emoji": "🧾"},
+            )
+            self.items_db_id = database["id"]
+            logger.info(f"Created shared Items database {self.items_db_id}; set NOTION_ITEMS_DATABASE_ID to reuse it")
+
+    async def query_shared_items_async(self, filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch every item in the shared Items database, following pagination.
+
+        Args:
+            filter: Optional Notion database query filter, e.g. on the Transaction relation
+
+        Returns:
+            All matching item pages
+        """
+        results = []
+        query = {"database_id": self.items_db_id, "page_size": 100}
+        if filter:
+            query["filter"] = filter
+        while True:
+            response = await self._request_async(self.async_client.databases.query, **query)
+            results.extend(response["results"])
+            if not response.get("has_more"):
+                return results
+            query["start_cursor"] = response["next_cursor"]
+
+    @staticmethod
+    def _table_row(*cells: str) -> Dict[str, Any]:
+        return {
+            "object": "block",
+            "type": "table_row",
+            "table_row": {
+                "cells": [[{"type": "text", "text": {"content": cell}}] for cell in cells]
+            }
+        }
+
+    def build_items_table_rows(self, properties: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Build the header and one table row per item.
+        """
+        rows = [self._table_row("Item", "Price", "Quantity")]
+        for item, price, quantity in zip(properties["items"], properties["items_price"], properties["items_quantity"]):
+            rows.append(self._table_row(item, f"{price:.2f}", str(quantity)))
+        return rows
+
+    def build_page_with_items_table(self, database_id: str, properties: Dict[str, Any]) -> tuple:
+        """
+        Build a `pages.create` payload whose body holds the items as a table block.
+
+        Args:
+            database_id: The transactions database to create the page in
+            properties: Normalized receipt properties
+
+        Returns:
+            The payload, and the table rows that didn't fit in this request
+        """
+        rows = self.build_items_table_rows(properties)
+        payload = {
+            "parent": {"database_id": database_id},
+            "properties": self.build_page_properties(properties),
+            "children": [
+                {
+                    "object": "block",
+                    "type": "heading_3",
+                    "heading_3": {"rich_text": [{"type": "text", "text": {"content": "Items"}}]}
+                },
+                {
+                    "object": "block",
+                    "type": "table",
+                    "table": {
+                        "table_width": 3,
+                        "has_column_header": True,
+                        "has_row_header": False,
+                        "children": rows[:NOTION_MAX_BLOCK_CHILDREN]
+                    }
+                }
+            ]
+        }
+        return payload, rows[NOTION_MAX_BLOCK_CHILDREN:]
+
+    @staticmethod
+    def _row_chunks(rows: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        return [rows[i:i + NOTION_MAX_BLOCK_CHILDREN] for i in range(0, len(rows), NOTION_MAX_BLOCK_CHILDREN)]
+
+    @staticmethod
+    def _find_table_id(children: Dict[str, Any]) -> str:
+        table_id = next((block["id"] for block in children["results"] if block["type"] == "table"), None)
+        if table_id is None:
+            raise RuntimeError("Items table not found among the page's blocks; cannot append the remaining rows")
+        return table_id
+
+    def create_page_with_items_table(self, database_id: str, properties: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Create the transaction page and its items table in a single call.
+
+        Receipts with more items than fit in one request get the remaining
+        rows appended to the table in chunks.
+        """
+        payload, overflow = self.build_page_with_items_table(database_id, properties)
+        with stage("notion_page_create"):
+            page = self._request(self.client.pages.create, PRIORITY_HIGH, **payload)
+        if overflow:
+            with stage("notion_item_writes"):
+                table_id = self._find_table_id(self._request(self.client.blocks.children.list, block_id=page["id"]))
+                for chunk in self._row_chunks(overflow):
+                    self._request(self.client.blocks.children.append, block_id=table_id, children=chunk)
+        return page
+
+    async def create_page_with_items_table_async(self, database_id: str, properties: Dict[str, Any],
+                                                 on_progress: Optional[ProgressCallback] = None,
+                                                 checkpoint: Optional[WriteCheckpoint] = None) -> Dict[str, Any]:
+        """
+        Async variant of `create_page_with_items_table`, reporting the page and each row chunk to `on_progress`.
+
+        Resumes from `checkpoint`: an existing page isn't created again and
+        row chunks already appended are skipped.
+        """
+        checkpoint = checkpoint or WriteCheckpoint()
+        payload, overflow = self.build_page_with_items_table(database_id, properties)
+        page = await self._checkpointed_page(checkpoint, lambda: self._request_async(
+            self.async_client.pages.create, PRIORITY_HIGH, **payload
+        ))
+        total = len(properties["items"])
+        written = total - len(overflow)
+        report(on_progress, "notion_page_created", page_id=page["id"], page_url=page.get("url", ""))
+        report(on_progress, "notion_items_written", written=written, total=total)
+        if overflow:
+            with stage("notion_item_writes"):
+                table_id = checkpoint.get("table_id")
+                if table_id is None:
+                    children = await self._request_async(self.async_client.blocks.children.list, block_id=page["id"])
+                    table_id = self._find_table_id(children)
+                    await checkpoint.update(table_id=table_id)
+                chunks_written = checkpoint.get("chunks_written", 0)
+                for index, chunk in enumerate(self._row_chunks(overflow)):
+                    if index >= chunks_written:
+                        await self._request_async(
+                            self.async_client.blocks.children.append, block_id=table_id, children=chunk
+                        )
+                        await checkpoint.update(chunks_written=index + 1)
+                    written += len(chunk)
+                    report(on_progress, "notion_items_written", written=written, total=total)
+        return page
+
     def search_db(self, database_id: str, query: str) -> List[Dict[str, Any]]:
         """
         Search the database for pages that match the query.
         """
-        results = self.client.databases.retrieve(
+        results = self._request(
+            self.client.databases.retrieve,
             database_id=database_id,
             filter={"property": "Name", "text": {"equals": query}}
         )
@@ -186,16 +720,81 @@ class NotionReceiptManager:
     def create_new_entry(self, properties: Dict[str, Any]) -> Dict[str, Any]:
         """
         Create a new entry in the database.
+
+        The items are written according to `write_layout`: an inline Items
+        database with one page per item, or a table block on the page itself.
         """
-        logger.info(f"Creating new entry with properties: {properties['store_name']}")
+        logger.info("Creating new entry with properties: %s", properties['store_name'])
+        if self.write_layout == "table":
+            page = self.create_page_with_items_table(self.transaction_db_id, properties)
+            logger.info("Page created with %d items", len(properties['items']))
+            return page
         page = self.create_page(self.transaction_db_id, properties)
-        logger.info(f"Page created ")
+        logger.info("Page created")
         item_db = self.create_item_db(page['id'], "Items Database")
-        logger.info(f"Item database created: with {len(properties['items'])} items")
+        logger.info("Item database created: with %d items", len(properties['items']))
         self.create_items_within_page(item_db['id'], properties) 
         logger.info("Items created within page")
         return page
 
+    @staticmethod
+    async def _checkpointed_page(checkpoint: WriteCheckpoint,
+                                 create: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        # The transaction page from an earlier attempt, or a new one recorded straight away
+        if checkpoint.get("page_id"):
+            return {"id": checkpoint.get("page_id"), "url": checkpoint.get("page_url", "")}
+        with stage("notion_page_create"):
+            page = await create()
+        await checkpoint.update(page_id=page["id"], page_url=page.get("url", ""))
+        return page
+
+    async def create_new_entry_async(self, properties: Dict[str, Any],
+                                     on_progress: Optional[ProgressCallback] = None,
+                                     checkpoint: Optional[WriteCheckpoint] = None) -> Dict[str, Any]:
+        """
+        Async variant of `create_new_entry`; item rows are written concurrently.
+
+        `on_progress` gets "notion_page_created" once the transaction page
+        exists, then "notion_items_written" as item rows land. Each step is
+        recorded in `checkpoint` as it succeeds; given the checkpoint of a
+        failed attempt, the write resumes after the last completed step
+        rather than creating a second transaction page.
+        """
+        logger.info("Creating new entry with properties: %s", properties['store_name'])
+        checkpoint = checkpoint or WriteCheckpoint()
+        if self.write_layout == "table":
+            page = await self.create_page_with_items_table_async(
+                self.transaction_db_id, properties, on_progress, checkpoint
+            )
+            logger.info("Page created with %d items", len(properties['items']))
+            return page
+        page = await self._checkpointed_page(checkpoint, lambda: self._request_async(
+            self.async_client.pages.create,
+            PRIORITY_HIGH,
+            parent={"database_id": self.transaction_db_id},
+            properties=self.build_page_properties(properties)
+        ))
+        report(on_progress, "notion_page_created", page_id=page['id'], page_url=page.get('url', ''))
+        if self.write_layout == "shared_items":
+            # The process-wide id, not this manager's copy, which predates setup finishing elsewhere
+            if shared_items_db_ready:
+                self.items_db_id = shared_items_db_id
+            items_db_id = self.items_db_id if shared_items_db_ready else await self.ensure_shared_items_db_async()
+            await self.create_items_within_page_async(items_db_id, properties, transaction_id=page['id'],
+                                                      on_progress=on_progress, checkpoint=checkpoint)
+            logger.info("Page created with %d items in the shared Items database", len(properties['items']))
+            return page
+        logger.info("Page created")
+        item_db_id = checkpoint.get("item_db_id")
+        if item_db_id is None:
+            item_db_id = (await self.create_item_db_async(page['id'], "Items Database"))['id']
+            await checkpoint.update(item_db_id=item_db_id)
+        logger.info("Item database created: with %d items", len(properties['items']))
+        await self.create_items_within_page_async(item_db_id, properties, on_progress=on_progress,
+                                                  checkpoint=checkpoint)
+        logger.info("Items created within page")
+        return page
+
 if __name__ == "__main__":
     # Example usage
     mock_data = {
@@ -0,0 +1,133 @@
+from itertools import count
+from typing import Dict, List, Optional
+import asyncio
+import heapq
+import os
+import threading
+import time
+
+# Notion allows an average of 3 requests per second per integration, with short bursts
+NOTION_REQUESTS_PER_SECOND = float(os.getenv("NOTION_REQUESTS_PER_SECOND", "3"))
+NOTION_BURST = int(os.getenv("NOTION_BURST", "3"))
+
+# Lower numbers are served first when requests are queued for a token
+PRIORITY_HIGH = 0     # transaction pages: the receipt exists once this lands
+PRIORITY_NORMAL = 1   # per-receipt databases, block appends, reads
+PRIORITY_LOW = 2      # individual item rows
+
+class NotionGovernor:
+    """
+    Process-wide token bucket in front of every Notion API call.
+
+    Tokens refill at `rate` per second up to `burst`. When no token is free,
+    callers queue by priority (then arrival order), so a new receipt's
+    transaction page overtakes a backlog of item rows. A 429 empties the
+    bucket and pauses every caller until its Retry-After has passed, so
+    writers back off together instead of each discovering the limit.
+
+    Async callers use `acquire`; synchronous callers use `acquire_sync`.
+
+    Args:
+        rate: Sustained requests per second; 0 disables limiting
+        burst: Bucket capacity
+    """
+
+    def __init__(self, rate: float = NOTION_REQUESTS_PER_SECOND, burst: int = NOTION_BURST):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.requests = 0
+        self.throttled = 0
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[tuple] = []
+        self._sequence = count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = threading.Lock()
+
+    def _try_take(self, now: float) -> bool:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now < self._paused_until or self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def _delay_until_token(self, now: float) -> float:
+        with self._lock:
+            refill = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+            return max(self._paused_until - now, refill, 0.001)
+
+    def _record(self, started: float):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.requests += 1
+            if waited > 0.001:
+                self.waits += 1
+                self.waited_seconds += waited
+
+    def _dispatch(self):
+        """Hand out free tokens to queued callers in priority order."""
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._try_take(now):
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        if self._waiters:
+            self._timer = asyncio.get_running_loop().call_later(self._delay_until_token(now), self._dispatch)
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL):
+        """Wait for a token, queuing behind higher-priority callers."""
+        started = time.monotonic()
+        if self.rate <= 0 or (not self._waiters and self._try_take(started)):
+            self._record(started)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._timer is None:
+            self._dispatch()
+        await future
+        self._record(started)
+
+    def acquire_sync(self, priority: int = PRIORITY_NORMAL):
+        """
+        Blocking variant for synchronous callers; shares the same bucket.
+
+        `priority` is accepted for parity with `acquire` but ignored: sync
+        callers poll the bucket rather than queueing, so they are never
+        ordered against each other or against async waiters.
+        """
+        started = time.monotonic()
+        while self.rate > 0 and not self._try_take(time.monotonic()):
+            time.sleep(self._delay_until_token(time.monotonic()))
+        self._record(started)
+
+    def on_rate_limited(self, retry_after: float):
+        """Empty the bucket and hold every caller until Retry-After has passed."""
+        with self._lock:
+            self.throttled += 1
+            self.tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "waits": self.waits,
+                "waited_seconds": round(self.waited_seconds, 3),
+                "queued": len(self._waiters),
+            }
+
+# Shared by every NotionReceiptManager so all writers draw from one quota
+notion_governor = NotionGovernor()
@@ -0,0 +1,295 @@
+from app.config import data_path
+from app.models import Receipt
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+NOTION_OUTBOX_ENABLED = os.getenv("NOTION_OUTBOX_ENABLED", "true").lower() == "true"
+# Relative to DATA_DIR unless absolute
+NOTION_OUTBOX_PATH = data_path(os.getenv("NOTION_OUTBOX_PATH", "notion_outbox.sqlite3"))
+NOTION_OUTBOX_MAX_ATTEMPTS = int(os.getenv("NOTION_OUTBOX_MAX_ATTEMPTS", "10"))
+NOTION_OUTBOX_BASE_DELAY_SECONDS = float(os.getenv("NOTION_OUTBOX_BASE_DELAY_SECONDS", "2"))
+NOTION_OUTBOX_MAX_DELAY_SECONDS = float(os.getenv("NOTION_OUTBOX_MAX_DELAY_SECONDS", "600"))
+NOTION_OUTBOX_POLL_SECONDS = float(os.getenv("NOTION_OUTBOX_POLL_SECONDS", "5"))
+# An in-flight entry whose write hasn't saved progress for this long is claimed again
+NOTION_OUTBOX_LEASE_SECONDS = float(os.getenv("NOTION_OUTBOX_LEASE_SECONDS", "300"))
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+def backoff_delay(attempts: int, base: float = NOTION_OUTBOX_BASE_DELAY_SECONDS,
+                  cap: float = NOTION_OUTBOX_MAX_DELAY_SECONDS) -> float:
+    """
+    Exponential backoff with jitter: half the capped delay is fixed, half is random.
+    """
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class NotionOutbox:
+    """
+    Durable outbox for Notion writes.
+
+    Every parsed receipt is recorded in SQLite before the Notion write is
+    attempted. Failed writes stay in the outbox and a background drainer
+    retries them with exponential backoff and jitter; entries that were in
+    flight when the process stopped are replayed on startup. A receipt we have
+    already paid to extract is therefore never lost to a Notion outage.
+
+    The write is passed the entry's `checkpoint`, the progress saved by
+    earlier attempts, and a `save_checkpoint` coroutine to record each step
+    as it succeeds. A retry then resumes where the last attempt stopped
+    instead of creating the transaction page again.
+
+    An in-flight entry holds a lease, kept in `next_attempt_at` and renewed
+    by every checkpoint. A write that was abandoned without failing lets the
+    lease expire, and the drainer then claims the entry again. Cancelled
+    writes, including those cut off at shutdown, go straight back to pending.
+
+    Args:
+        write: Coroutine that writes a Receipt to Notion and raises on failure
+        path: SQLite file backing the outbox
+    """
+
+    def __init__(
+        self,
+        write: Callable[..., Awaitable[Dict[str, Any]]],
+        path: str = NOTION_OUTBOX_PATH,
+        enabled: bool = NOTION_OUTBOX_ENABLED,
+        max_attempts: int = NOTION_OUTBOX_MAX_ATTEMPTS,
+        poll_seconds: float = NOTION_OUTBOX_POLL_SECONDS,
+        lease_seconds: float = NOTION_OUTBOX_LEASE_SECONDS,
+    ):
+        self.write = write
+        self.path = path
+        self.enabled = enabled
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self._attempting: Set[str] = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._drainer: Optional[asyncio.Task] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id TEXT PRIMARY KEY, receipt TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, "
+                "last_error TEXT, page_id TEXT, page_url TEXT, "
+                "checkpoint TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            if "checkpoint" not in columns:
+                # Outboxes created before writes were checkpointed
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN checkpoint TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+
+    def add(self, receipt: Receipt, status: str = IN_FLIGHT) -> str:
+        """Record a receipt as in flight, or as pending for the drainer to write, and return its outbox id."""
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO outbox (id, receipt, status, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (entry_id, receipt.model_dump_json(), status, now + self.lease_seconds if status == IN_FLIGHT else now,
+             now, now),
+        )
+        return entry_id
+
+    def save_checkpoint(self, entry_id: str, checkpoint: Dict[str, Any]):
+        """Record how far the entry's Notion write got, renewing its lease."""
+        now = time.time()
+        self._execute(
+            "UPDATE outbox SET checkpoint = ?, next_attempt_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (json.dumps(checkpoint), now + self.lease_seconds, now, entry_id, IN_FLIGHT),
+        )
+
+    def release(self, entry_ids: List[str]):
+        """Put in-flight entries back to pending, due now, e.g. when their writes are cancelled."""
+        now = time.time()
+        for entry_id in entry_ids:
+            self._execute(
+                "UPDATE outbox SET status = ?, next_attempt_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (PENDING, now, now, entry_id, IN_FLIGHT),
+            )
+
+    def get(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        """Return an entry's status, attempts, last error and page, or None if it isn't in the outbox."""
+        if self._conn is None and not os.path.exists(self.path):
+            return None
+        rows = self._execute(
+            "SELECT status, attempts, last_error, page_id, page_url FROM outbox WHERE id = ?", (entry_id,)
+        )
+        if not rows:
+            return None
+        return dict(zip(("status", "attempts", "last_error", "page_id", "page_url"), rows[0]))
+
+    def mark_delivered(self, entry_id: str, response: Dict[str, Any]):
+        self._execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = NULL, "
+            "page_id = ?, page_url = ?, updated_at = ? WHERE id = ?",
+            (DELIVERED, response.get("page_id"), response.get("page_url"), time.time(), entry_id),
+        )
+
+    def mark_failed(self, entry_id: str, error: str) -> str:
+        """Schedule a retry, or give up after max_attempts. Returns the new status."""
+        rows = self._execute("SELECT attempts FROM outbox WHERE id = ?", (entry_id,))
+        attempts = (rows[0][0] if rows else 0) + 1
+        now = time.time()
+        status = FAILED if attempts >= self.max_attempts else PENDING
+        self._execute(
+            "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, "
+            "updated_at = ? WHERE id = ?",
+            (status, attempts, error, now + backoff_delay(attempts), now, entry_id),
+        )
+        return status
+
+    def claim_due(self, limit: int = 10) -> List[Tuple[str, Receipt, Dict[str, Any]]]:
+        """
+        Mark up to `limit` due entries as in flight and return them with their checkpoints.
+
+        Due entries are pending ones whose backoff has passed and in-flight
+        ones whose lease has expired.
+        """
+        now = time.time()
+        rows = self._execute(
+            "SELECT id, receipt, checkpoint FROM outbox WHERE status IN (?, ?) AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT ?",
+            (PENDING, IN_FLIGHT, now, limit),
+        )
+        for entry_id, _, _ in rows:
+            self._execute(
+                "UPDATE outbox SET status = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                (IN_FLIGHT, now + self.lease_seconds, now, entry_id),
+            )
+        return [
+            (entry_id, Receipt.model_validate_json(receipt), json.loads(checkpoint) if checkpoint else {})
+            for entry_id, receipt, checkpoint in rows
+        ]
+
+    def replay_interrupted(self) -> int:
+        """Make entries left in flight by a previous process due immediately."""
+        if self._conn is None and not os.path.exists(self.path):
+            return 0
+        rows = self._execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (IN_FLIGHT,))
+        self._execute(
+            "UPDATE outbox SET status = ?, next_attempt_at = ? WHERE status = ?",
+            (PENDING, time.time(), IN_FLIGHT),
+        )
+        return rows[0][0]
+
+    def stats(self) -> Dict[str, int]:
+        counts = {PENDING: 0, IN_FLIGHT: 0, DELIVERED: 0, FAILED: 0}
+        if self._conn is None and not os.path.exists(self.path):
+            return counts
+        for status, count in self._execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    async def _attempt(self, entry_id: str, receipt: Receipt, checkpoint: Optional[Dict[str, Any]] = None,
+                       **write_kwargs) -> Dict[str, Any]:
+        async def save_checkpoint(state: Dict[str, Any]):
+            await asyncio.to_thread(self.save_checkpoint, entry_id, state)
+
+        self._attempting.add(entry_id)
+        try:
+            response = await self.write(receipt, checkpoint=checkpoint or {},
+                                        save_checkpoint=save_checkpoint, **write_kwargs)
+        except asyncio.CancelledError:
+            # Not a failure: retry as soon as something drains the outbox again
+            self.release([entry_id])
+            raise
+        except Exception as e:
+            status = await asyncio.to_thread(self.mark_failed, entry_id, str(e))
+            logger.warning(f"Notion write for outbox entry {entry_id} failed ({status}): {e}")
+            return {
+                "status": "queued" if status == PENDING else "error",
+                "outbox_id": entry_id,
+                "message": f"Failed to push to Notion: {str(e)}"
+                           + (" (will retry)" if status == PENDING else ""),
+            }
+        finally:
+            self._attempting.discard(entry_id)
+        await asyncio.to_thread(self.mark_delivered, entry_id, response)
+        return {**response, "outbox_id": entry_id}
+
+    async def deliver(self, receipt: Receipt, **write_kwargs) -> Dict[str, Any]:
+        """
+        Record a receipt in the outbox, then try to write it to Notion straight away.
+
+        Args:
+            receipt: The parsed Receipt
+            **write_kwargs: Extra arguments for the write coroutine
+
+        Returns:
+            The Notion response on success, otherwise a "queued" status with the outbox id
+        """
+        entry_id = await asyncio.to_thread(self.add, receipt)
+        return await self._attempt(entry_id, receipt, **write_kwargs)
+
+    async def drain_once(self) -> int:
+        """Retry every due entry once. Returns the number of entries attempted."""
+        if self._conn is None and not os.path.exists(self.path):
+            return 0
+        entries = await asyncio.to_thread(self.claim_due)
+        for entry_id, receipt, checkpoint in entries:
+            await self._attempt(entry_id, receipt, checkpoint)
+        return len(entries)
+
+    async def _drain_forever(self):
+        while True:
+            try:
+                while await self.drain_once():
+                    pass
+            except Exception:
+                logger.exception("Notion outbox drain failed")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def start(self):
+        """Replay writes interrupted by the last shutdown and start the background drainer."""
+        if not self.enabled or self._drainer is not None:
+            return
+        replayed = await asyncio.to_thread(self.replay_interrupted)
+        if replayed:
+            logger.info(f"Replaying {replayed} interrupted Notion writes from the outbox")
+        self._drainer = asyncio.create_task(self._drain_forever())
+
+    async def stop(self):
+        """Stop the drainer and put writes still in flight back to pending before closing the database."""
+        if self._drainer is not None:
+            self._drainer.cancel()
+            await asyncio.gather(self._drainer, return_exceptions=True)
+            self._drainer = None
+        if self._attempting:
+            logger.warning(f"Returning {len(self._attempting)} unfinished Notion writes to the outbox")
+            self.release(list(self._attempting))
+            self._attempting.clear()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,272 @@
+from collections import deque
+from typing import Deque, Dict, List
+import asyncio
+import os
+import threading
+import time
+
+# Concurrent OpenAI extraction calls: starting point and bounds for the adaptive limit
+OPENAI_CONCURRENCY_INITIAL = int(os.getenv("OPENAI_CONCURRENCY_INITIAL", "8"))
+OPENAI_CONCURRENCY_MIN = int(os.getenv("OPENAI_CONCURRENCY_MIN", "1"))
+OPENAI_CONCURRENCY_MAX = int(os.getenv("OPENAI_CONCURRENCY_MAX", "64"))
+# Latency counts as stable while under this multiple of its running average
+OPENAI_LATENCY_TOLERANCE = float(os.getenv("OPENAI_LATENCY_TOLERANCE", "2.0"))
+# Factor the limit is multiplied by on a 429 or timeout
+OPENAI_CONCURRENCY_BACKOFF = float(os.getenv("OPENAI_CONCURRENCY_BACKOFF", "0.5"))
+
+# The breaker opens when this share of the last OPENAI_BREAKER_WINDOW calls failed
+OPENAI_BREAKER_FAILURE_RATE = float(os.getenv("OPENAI_BREAKER_FAILURE_RATE", "0.5"))
+OPENAI_BREAKER_WINDOW = int(os.getenv("OPENAI_BREAKER_WINDOW", "20"))
+OPENAI_BREAKER_MIN_CALLS = int(os.getenv("OPENAI_BREAKER_MIN_CALLS", "10"))
+# Seconds the breaker stays open before letting a probe call through
+OPENAI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("OPENAI_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Outcomes of a guarded call, see classify_error
+SUCCESS = "success"
+OVERLOAD = "overload"          # 429 or timeout: the provider wants less traffic
+FAILURE = "failure"            # 5xx or connection error
+CLIENT_ERROR = "client_error"  # anything else; says nothing about provider health
+CANCELLED = "cancelled"
+
+def classify_error(error: BaseException) -> str:
+    """
+    Map an exception from an API call to a call outcome.
+
+    Matched on class names and `status_code` so the OpenAI SDK needn't be
+    imported here.
+    """
+    if isinstance(error, asyncio.CancelledError):
+        return CANCELLED
+    names = {cls.__name__ for cls in type(error).__mro__}
+    status = getattr(error, "status_code", None)
+    if status == 429 or "RateLimitError" in names or "TimeoutError" in names or "APITimeoutError" in names:
+        return OVERLOAD
+    if (status or 0) >= 500 or "APIConnectionError" in names or "ConnectionError" in names:
+        return FAILURE
+    return CLIENT_ERROR
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent calls to a remote API.
+
+    Every successful call whose latency stays within `latency_tolerance` of
+    the running average adds 1/limit, so the limit grows by about one slot
+    per limit's worth of calls. A 429 or timeout multiplies it by `backoff`,
+    at most once per average latency so a burst of failures from the same
+    moment counts once. The limit only grows while it is actually in use.
+    Callers over the limit wait in arrival order.
+
+    Args:
+        initial: Starting limit
+        min_limit: Lowest the limit can fall
+        max_limit: Highest the limit can grow
+        latency_tolerance: Multiple of the average latency still counted as stable
+        backoff: Factor applied to the limit on overload
+    """
+
+    def __init__(
+        self,
+        initial: int = OPENAI_CONCURRENCY_INITIAL,
+        min_limit: int = OPENAI_CONCURRENCY_MIN,
+        max_limit: int = OPENAI_CONCURRENCY_MAX,
+        latency_tolerance: float = OPENAI_LATENCY_TOLERANCE,
+        backoff: float = OPENAI_CONCURRENCY_BACKOFF,
+    ):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.latency_average = None
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        """Wait for a free slot."""
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self._take()
+                return
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as we were cancelled
+                    self.in_flight -= 1
+                    self._wake()
+                elif future in self._waiters:
+                    self._waiters.remove(future)
+            raise
+
+    def try_acquire(self) -> bool:
+        """Take a free slot without waiting; False if none is free or callers are already waiting."""
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self._take()
+                return True
+            return False
+
+    def _take(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self._take()
+                future.get_loop().call_soon_threadsafe(self._resolve, future)
+
+    def _resolve(self, future: asyncio.Future):
+        if future.cancelled():
+            with self._lock:
+                self.in_flight -= 1
+                self._wake()
+        else:
+            future.set_result(None)
+
+    def release(self, latency: float, outcome: str):
+        """
+        Free a slot and adjust the limit from the call's outcome.
+
+        Args:
+            latency: Seconds the call took
+            outcome: One of the outcome constants, see classify_error
+        """
+        with self._lock:
+            busy = self.in_flight >= self.limit / 2
+            self.in_flight -= 1
+            if outcome == SUCCESS:
+                stable = self.latency_average is None or latency <= self.latency_tolerance * self.latency_average
+                self.latency_average = latency if self.latency_average is None else \
+                    0.9 * self.latency_average + 0.1 * latency
+                if stable and busy and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    self.increases += 1
+            elif outcome == OVERLOAD:
+                now = time.monotonic()
+                if now - self._last_decrease >= (self.latency_average or 0.0):
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.decreases += 1
+                    self._last_decrease = now
+            self._wake()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "queued": len(self._waiters),
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "latency_average_seconds": round(self.latency_average or 0.0, 3),
+            }
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an API whose circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES: List[str] = [CLOSED, OPEN, HALF_OPEN]
+
+class CircuitBreaker:
+    """
+    Fail fast while a remote API is failing.
+
+    Closed: calls go through and their outcomes fill a rolling window. Once
+    the window holds at least `min_calls` and the failure share reaches
+    `failure_rate`, the breaker opens and `before_call` raises CircuitOpen
+    for `cooldown` seconds. Then it is half-open: a single probe call goes
+    through, closing the breaker if it succeeds and reopening it if not.
+    Overloads and failures count as failures; client errors don't.
+
+    Args:
+        failure_rate: Failure share that opens the breaker
+        window: Recent outcomes considered
+        min_calls: Outcomes needed before the breaker can open
+        cooldown: Seconds to stay open before probing
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = OPENAI_BREAKER_FAILURE_RATE,
+        window: int = OPENAI_BREAKER_WINDOW,
+        min_calls: int = OPENAI_BREAKER_MIN_CALLS,
+        cooldown: float = OPENAI_BREAKER_COOLDOWN_SECONDS,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go through now."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(remaining)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpen(self.cooldown)
+                self._probing = True
+
+    def record(self, outcome: str):
+        """Record the outcome of a call allowed by `before_call`."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if outcome in (SUCCESS, CLIENT_ERROR):
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                elif outcome != CANCELLED:
+                    self._open()
+                return
+            if outcome == CANCELLED:
+                return
+            self._outcomes.append(outcome in (OVERLOAD, FAILURE))
+            failures = sum(self._outcomes)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls and \
+                    failures >= self.failure_rate * len(self._outcomes):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failure_rate": round(sum(self._outcomes) / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+# Shared by every extraction so the limit and failure window are process-wide
+openai_limiter = AdaptiveLimiter()
+openai_breaker = CircuitBreaker()
@@ -0,0 +1,13 @@
+from typing import Any, Callable, Dict, Optional
+
+# Called with an event name and its fields as a scan moves through its stages
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+def report(on_progress: Optional[ProgressCallback], event: str, **fields):
+    """
+    Send a progress event, if anyone is listening.
+
+    Callbacks must be cheap and non-blocking; they run inline on the event loop.
+    """
+    if on_progress is not None:
+        on_progress(event, fields)
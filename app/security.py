@@ -1,4 +1,5 @@
 from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 import os
@@ -33,18 +34,63 @@ except Exception:
     class RateLimitExceeded(Exception):  # type: ignore
         pass
 
+# Messages longer than this are truncated before they are scanned for secrets
+LOG_REDACTION_MAX_LENGTH = int(os.getenv("LOG_REDACTION_MAX_LENGTH", "4096"))
+
+# Compiled once. Bearer tokens are rare, so that pattern only runs when its
+# literal prefix is present (a C-speed substring check); every other record
+# gets a single regex pass for API keys. An alternation of the two measured
+# twice as slow, since it defeats the regex engine's literal-prefix scan.
+BEARER_PATTERN = re.compile(r'Bearer [a-zA-Z0-9]+')
+API_KEY_PATTERN = re.compile(r'[a-zA-Z0-9]{32,}+')
+
+def redact(text: str, max_length: int = LOG_REDACTION_MAX_LENGTH) -> str:
+    """
+    Mask bearer tokens and API keys in a log string.
+
+    Args:
+        text: The text to redact
+        max_length: Truncate longer text before scanning; 0 disables truncation
+
+    Returns:
+        The redacted (and possibly truncated) text
+    """
+    if max_length and len(text) > max_length:
+        text = f"{text[:max_length]}... [truncated {len(text) - max_length} chars]"
+    if "Bearer " in text:
+        text = BEARER_PATTERN.sub('Bearer ***', text)
+    return API_KEY_PATTERN.sub('***', text)
+
 # Configure logging with sensitive data filtering
 class SensitiveDataFilter(logging.Filter):
+    """
+    Redact secrets from log records in a single pass.
+
+    The message is merged with its %-style args first, so secrets passed as
+    arguments are caught too, and oversized messages are truncated before the
+    scan. Exception tracebacks are formatted and redacted here as well, without
+    truncation.
+    """
+
     def filter(self, record):
-        if hasattr(record, 'msg'):
-            # Remove Bearer tokens from logs
-            record.msg = re.sub(r'Bearer [a-zA-Z0-9]+', 'Bearer ***', str(record.msg))
-            # Remove API keys from logs
-            record.msg = re.sub(r'[a-zA-Z0-9]{32,}', '***', str(record.msg))
-        return True
+        try:
+            message = record.getMessage()
+        except (TypeError, ValueError):
+            # Mismatched args; leave them for the handler to report
+            message = str(record.msg)
+        else:
+            record.args = None
+        record.msg = redact(message)
+
+        fields = getattr(record, "fields", None)
+        if fields:
+            record.fields = {key: redact(value) if isinstance(value, str) else value for key, value in fields.items()}
 
-# Add filter to root logger
-logging.getLogger().addFilter(SensitiveDataFilter())
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text, max_length=0)
+        return True
 
 def setup_security_middleware(app):
     """
@@ -85,6 +131,50 @@ def setup_security_middleware(app):
     
     return limiter
 
+class RequestSizeLimitMiddleware:
+    """
+    Reject oversized request bodies before they are parsed.
+
+    Requests to a limited path are refused up front when their Content-Length
+    is too large, and chunked bodies are counted as they stream in and aborted
+    once they cross the limit.
+
+    Args:
+        app: ASGI application
+        limits: Maximum body size in bytes, keyed by request path
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request too large. Maximum size is {limit // (1024 * 1024)}MB"
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
 def validate_file_upload(file, max_size_mb=10):
     """
     Validate file upload for security.
@@ -149,7 +239,9 @@ def log_security_event(event_type: str, request: Request, details: dict = None):
         details: Additional details to log
     """
     logger = logging.getLogger("security")
-    
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+
     log_data = {
         "event_type": event_type,
         "client_ip": request.client.host,
@@ -161,4 +253,5 @@ def log_security_event(event_type: str, request: Request, details: dict = None):
     if details:
         log_data.update(details)
     
-    logger.warning(f"Security event: {log_data}") 
\ No newline at end of file
+    # Formatted and serialized on the logging listener thread, not here
+    logger.warning("Security event: %s", event_type, extra={"event": event_type, "fields": log_data})
@@ -0,0 +1,81 @@
+from app.image_processing import IMAGE_NORMALIZATION_ENABLED, PILLOW_AVAILABLE
+from dataclasses import dataclass
+from fastapi import HTTPException, UploadFile
+from typing import Optional
+import base64
+import hashlib
+import os
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+@dataclass
+class UploadedImage:
+    data: bytes
+    sha256: str
+    base64: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+async def read_upload(
+    file: UploadFile,
+    max_size_mb: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    encode_base64: Optional[bool] = None,
+) -> UploadedImage:
+    """
+    Read an uploaded file in chunks, aborting as soon as it exceeds the size limit.
+
+    The SHA-256 digest is computed as chunks arrive. When the image will be sent
+    to the model as-is (normalization disabled or Pillow unavailable), the base64
+    payload is built incrementally too, so it never needs a second full pass.
+
+    Args:
+        file: UploadFile object
+        max_size_mb: Maximum file size in MB
+        chunk_size: Number of bytes to read at a time
+        encode_base64: Whether to build the base64 payload; defaults to whether
+            the image will skip normalization
+
+    Returns:
+        UploadedImage with the raw bytes, their SHA-256 digest and optional base64
+
+    Raises:
+        HTTPException: If the file is larger than max_size_mb
+    """
+    if encode_base64 is None:
+        encode_base64 = not (IMAGE_NORMALIZATION_ENABLED and PILLOW_AVAILABLE)
+
+    max_size_bytes = max_size_mb * 1024 * 1024
+    hasher = hashlib.sha256()
+    chunks = []
+    encoded = []
+    pending = b""
+    total = 0
+
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. Maximum size is {max_size_mb}MB"
+            )
+        hasher.update(chunk)
+        chunks.append(chunk)
+        if encode_base64:
+            # Only encode whole 3-byte groups so the pieces concatenate cleanly
+            pending += chunk
+            cut = len(pending) - len(pending) % 3
+            encoded.append(base64.b64encode(pending[:cut]))
+            pending = pending[cut:]
+
+    image_base64 = None
+    if encode_base64:
+        encoded.append(base64.b64encode(pending))
+        image_base64 = b"".join(encoded).decode("ascii")
+
+    return UploadedImage(b"".join(chunks), hasher.hexdigest(), image_base64)
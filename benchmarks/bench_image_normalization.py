@@ -0,0 +1,104 @@
+'''
+Benchmark: image normalization bytes, vision tokens and upload latency.
+
+Runs `normalize_image` over a local corpus of receipt photos and reports,
+per image, the bytes sent before/after, the estimated image input tokens
+before/after, the normalization time, and the estimated end-to-end cost of
+getting the image to the model (normalization + base64 upload at the given
+bandwidth). Without --corpus, a few synthetic phone-sized photos are used.
+
+Usage:
+    python -m benchmarks.bench_image_normalization --corpus ~/receipts --bandwidth-mbps 10
+'''
+
+import argparse
+import math
+import os
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from app.image_processing import normalize_image
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estimate high-detail image input tokens using OpenAI's published tiling rule:
+    fit in 2048x2048, scale the short side to 768, then 170 tokens per 512px tile plus 85.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+def synthetic_corpus():
+    corpus = []
+    for name, size in [("synthetic_12mp.jpg", (4032, 3024)), ("synthetic_8mp.jpg", (3264, 2448)),
+                       ("synthetic_screenshot.png", (1170, 2532))]:
+        image = Image.effect_noise(size, 40).convert("RGB")
+        buffer = BytesIO()
+        image.save(buffer, format="PNG" if name.endswith(".png") else "JPEG", quality=92)
+        corpus.append((name, buffer.getvalue()))
+    return corpus
+
+def load_corpus(directory: str):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            with open(os.path.join(directory, name), "rb") as image_file:
+                corpus.append((name, image_file.read()))
+    return corpus
+
+def upload_seconds(num_bytes: int, bandwidth_mbps: float) -> float:
+    base64_bytes = 4 * math.ceil(num_bytes / 3)
+    return base64_bytes * 8 / (bandwidth_mbps * 1_000_000)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of receipt images")
+    parser.add_argument("--bandwidth-mbps", type=float, default=10.0, help="Uplink bandwidth to OpenAI")
+    parser.add_argument("--max-long-edge", type=int, default=2048)
+    parser.add_argument("--format", default="JPEG")
+    parser.add_argument("--color", action="store_true", help="Keep colour instead of converting to grayscale")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    print(f"{'image':<28} {'bytes before':>12} {'bytes after':>12} {'tokens':>13} "
+          f"{'normalize':>10} {'e2e before':>11} {'e2e after':>10}")
+
+    totals = {"before": 0, "after": 0, "tokens_before": 0, "tokens_after": 0, "e2e_before": 0.0, "e2e_after": 0.0}
+    for name, data in corpus:
+        with Image.open(BytesIO(data)) as image:
+            tokens_before = estimate_image_tokens(*image.size)
+
+        start = time.perf_counter()
+        normalized = normalize_image(data, max_long_edge=args.max_long_edge, grayscale=not args.color,
+                                     output_format=args.format.upper(), enabled=True)
+        normalize_seconds = time.perf_counter() - start
+        tokens_after = estimate_image_tokens(normalized.width, normalized.height) if normalized.width else tokens_before
+
+        e2e_before = upload_seconds(len(data), args.bandwidth_mbps)
+        e2e_after = normalize_seconds + upload_seconds(normalized.normalized_bytes, args.bandwidth_mbps)
+
+        totals["before"] += len(data)
+        totals["after"] += normalized.normalized_bytes
+        totals["tokens_before"] += tokens_before
+        totals["tokens_after"] += tokens_after
+        totals["e2e_before"] += e2e_before
+        totals["e2e_after"] += e2e_after
+        print(f"{name[:28]:<28} {len(data):>12,} {normalized.normalized_bytes:>12,} "
+              f"{tokens_before:>6}->{tokens_after:<6} {normalize_seconds * 1000:>8.0f}ms "
+              f"{e2e_before:>10.2f}s {e2e_after:>9.2f}s")
+
+    print(f"{'TOTAL':<28} {totals['before']:>12,} {totals['after']:>12,} "
+          f"{totals['tokens_before']:>6}->{totals['tokens_after']:<6} {'':>10} "
+          f"{totals['e2e_before']:>10.2f}s {totals['e2e_after']:>9.2f}s")
+    print(f"bytes saved: {1 - totals['after'] / totals['before']:.0%}, "
+          f"tokens saved: {1 - totals['tokens_after'] / totals['tokens_before']:.0%}")
+
+if __name__ == "__main__":
+    main()
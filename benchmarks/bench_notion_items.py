@@ -0,0 +1,78 @@
+'''
+Benchmark: Notion item-write latency versus item count.
+
+Compares the serial `create_items_within_page` loop with the concurrent
+`create_items_within_page_async` writer against a local fake Notion server.
+
+Usage:
+    python -m benchmarks.bench_notion_items --latency-ms 300 --items 5 10 20 40
+'''
+
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.fake_notion import FakeNotionServer
+
+def make_properties(count: int) -> dict:
+    return {
+        "items": [f"Item {i}" for i in range(count)],
+        "items_price": [1.0 + i for i in range(count)],
+        "items_quantity": [1 for _ in range(count)],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[5, 10, 20, 40, 80])
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--rate", type=float, default=3.0, help="Requests per second allowed by the limiter (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with FakeNotionServer(args.latency_ms, args.jitter_ms, args.rate_limit_probability) as server:
+        os.environ["NOTION_TOKEN"] = "fake-token"
+        os.environ["NOTION_BASE_URL"] = server.base_url
+        from notion_client import APIResponseError
+        from app.notion_governor import NotionGovernor
+        from app.notion_client import NotionReceiptManager, close_notion_clients, notion_connection_stats
+
+        print(f"latency={args.latency_ms}ms±{args.jitter_ms}ms rate={args.rate or 'unlimited'}/s "
+              f"burst={args.burst} concurrency={args.concurrency}")
+        print(f"{'items':>6} {'serial (s)':>12} {'concurrent (s)':>15} {'speedup':>8}")
+
+        async def run():
+            for count in args.items:
+                properties = make_properties(count)
+                manager = NotionReceiptManager()
+                manager.max_concurrency = args.concurrency
+
+                manager.governor = NotionGovernor(args.rate, args.burst)
+                start = time.perf_counter()
+                try:
+                    manager.create_items_within_page("items-db", properties)
+                    serial = time.perf_counter() - start
+                except APIResponseError:
+                    # Retries exhausted under heavy injected rate limiting
+                    serial = None
+
+                manager.governor = NotionGovernor(args.rate, args.burst)
+                start = time.perf_counter()
+                await manager.create_items_within_page_async("items-db", properties)
+                concurrent = time.perf_counter() - start
+
+                if serial is None:
+                    print(f"{count:>6} {'failed':>12} {concurrent:>15.2f} {'-':>8}")
+                else:
+                    print(f"{count:>6} {serial:>12.2f} {concurrent:>15.2f} {serial / concurrent:>7.1f}x")
+            await close_notion_clients()
+
+        asyncio.run(run())
+        print(f"connections: {notion_connection_stats.snapshot()}")
+        print(f"fake server handled {server.request_count} requests, {server.rate_limited_count} rate limited")
+
+if __name__ == "__main__":
+    main()
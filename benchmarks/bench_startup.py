@@ -0,0 +1,144 @@
+'''
+Benchmark: cold start, from `import app.main` to the first served request.
+
+Each run is a fresh interpreter that imports the app, runs its lifespan and
+serves one request in-process, timing each phase. The median over --runs is
+compared against --budget-ms and the script exits non-zero when it is over
+budget, so it can gate a deploy.
+
+With --profile, `python -X importtime` is used to list the modules that
+dominate `import app.main`, grouped by top-level package.
+
+The default first request is /health, i.e. how soon a scaled-from-zero
+instance passes its health check. With --first-request /scan a receipt is
+scanned against the fake OpenAI and Notion servers instead, which also pays
+for the OpenAI SDK import the lifespan starts in the background.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 5 --profile
+    python -m benchmarks.bench_startup --first-request /scan --budget-ms 2000
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+from benchmarks.fake_notion import FakeNotionServer
+from benchmarks.fake_openai import FakeOpenAIServer
+
+CHILD = r'''
+import time
+started = time.perf_counter()
+import asyncio, io, json, sys
+import app.main
+imported = time.perf_counter()
+
+import httpx
+from PIL import Image
+
+def receipt_image():
+    buffer = io.BytesIO()
+    Image.new("L", (800, 1200), 255).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+async def first_request(path):
+    application = app.main.app
+    async with application.router.lifespan_context(application):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            if path == "/scan":
+                response = await client.post("/scan?defer_notion=true",
+                                             files={"file": ("r.jpg", receipt_image(), "image/jpeg")})
+            else:
+                response = await client.get(path)
+        served = time.perf_counter()
+    return ready, served, response.status_code
+
+ready, served, status = asyncio.run(first_request(sys.argv[1]))
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "lifespan_ms": (ready - imported) * 1000,
+    "first_request_ms": (served - ready) * 1000,
+    "total_ms": (served - started) * 1000,
+    "status": status,
+}))
+'''
+
+def child_environment(openai_url: str, notion_url: str, workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "fake-openai-key",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "NOTION_TOKEN": "fake-notion-token",
+        "NOTION_BASE_URL": notion_url,
+        "NOTION_TRANSACTIONS_DATABASE_ID": "bench-transactions",
+        "AUTH_TOKEN": "",
+        "ALLOWED_HOSTS": "",
+        "RECEIPT_CACHE_ENABLED": "false",
+        "NOTION_OUTBOX_PATH": os.path.join(workdir, "notion_outbox.sqlite3"),
+        "LOG_LEVEL": "WARNING",
+    })
+    return env
+
+def run_once(path: str, env: dict) -> dict:
+    result = subprocess.run([sys.executable, "-c", CHILD, path], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"Startup run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def import_profile(env: dict, top: int):
+    """Self import time of everything `app.main` pulls in, summed per top-level package."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                            env=env, capture_output=True, text=True)
+    by_package = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, _, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            by_package[name.split(".")[0]] += int(self_us)
+        except ValueError:
+            continue
+    total = sum(by_package.values())
+    print(f"\nimport profile (self time summed per top-level package, total {total / 1000:.0f}ms):")
+    for package, micros in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<24} {micros / 1000:>8.1f}ms  {micros / total:>5.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1000,
+                        help="Median budget for import + lifespan + first request")
+    parser.add_argument("--first-request", default="/health", choices=["/health", "/scan"])
+    parser.add_argument("--profile", action="store_true", help="Print an import-time breakdown")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    with FakeOpenAIServer() as openai_server, FakeNotionServer() as notion_server, \
+            tempfile.TemporaryDirectory() as workdir:
+        env = child_environment(openai_server.base_url, notion_server.base_url, workdir)
+        runs = [run_once(args.first_request, env) for _ in range(args.runs)]
+
+        print(f"{args.runs} cold starts, first request {args.first_request} (status {runs[-1]['status']})")
+        for phase in ("import_ms", "lifespan_ms", "first_request_ms", "total_ms"):
+            values = [run[phase] for run in runs]
+            print(f"  {phase:<18} median {statistics.median(values):>7.0f}ms  "
+                  f"min {min(values):>7.0f}ms  max {max(values):>7.0f}ms")
+
+        if args.profile:
+            import_profile(env, args.top)
+
+    median_total = statistics.median(run["total_ms"] for run in runs)
+    if median_total > args.budget_ms:
+        print(f"\nOVER BUDGET: median {median_total:.0f}ms > {args.budget_ms:.0f}ms")
+        sys.exit(1)
+    print(f"\nwithin budget: median {median_total:.0f}ms <= {args.budget_ms:.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+'''
+Local stand-in for the Notion API used by the benchmarks.
+
+Serves the endpoints NotionReceiptManager calls (pages, databases, blocks)
+with a configurable response latency and optional 429 and 500 injection, so
+Notion write paths can be measured without network access.
+'''
+
+import uuid
+
+from benchmarks.fake_server import FakeAPIServer
+
+class FakeNotionServer(FakeAPIServer):
+    """
+    Threaded HTTP server emulating the subset of the Notion API we use.
+
+    Args:
+        latency_ms: Fixed delay added to every response
+        jitter_ms: Extra delay added on top of latency_ms
+        rate_limit_probability: Fraction of requests answered with 429
+        retry_after: Value of the Retry-After header sent with 429s, in seconds
+        error_probability: Fraction of requests answered with 500
+        latency_distribution: How jitter_ms is applied, see sample_latency_ms
+    """
+
+    def rate_limited_body(self) -> dict:
+        return {"object": "error", "status": 429, "code": "rate_limited", "message": "Rate limited"}
+
+    def error_body(self) -> dict:
+        return {"object": "error", "status": 500, "code": "internal_server_error", "message": "Internal error"}
+
+    def respond(self, method: str, path: str, body: dict) -> dict:
+        object_type = "database" if "/databases" in path else "page"
+        if "/blocks" in path:
+            object_type = "list"
+        object_id = str(uuid.uuid4())
+        return {
+            "object": object_type,
+            "id": object_id,
+            "url": f"https://www.notion.so/{object_id.replace('-', '')}",
+            "results": [],
+        }
@@ -0,0 +1,83 @@
+'''
+Local stand-in for the OpenAI Responses API used by the benchmarks.
+
+Answers `POST /v1/responses` with a completed response whose output text is
+a valid Receipt, so `responses.parse(..., text_format=Receipt)` succeeds
+without network access. A fraction of receipts can be made internally
+inconsistent to exercise escalation to the strong model. Latency, 429 and 500 injection come from
+FakeAPIServer.
+'''
+
+import json
+import random
+import time
+import uuid
+
+from benchmarks.fake_server import FakeAPIServer
+
+def fake_receipt(item_count: int = 5) -> dict:
+    """A plausible Receipt payload with `item_count` line items."""
+    prices = [round(1.25 + index * 0.5, 2) for index in range(item_count)]
+    return {
+        "date": "2025-07-27",
+        "total": round(sum(prices), 2),
+        "items": [f"Item {index}" for index in range(item_count)],
+        "items_price": prices,
+        "items_quantity": [1] * item_count,
+        "reciept_category": "Grocery",
+        "store_name": "Benchmark Store",
+        "store_first_line": "1 Test Street",
+        "store_second_line": "Testville",
+        "store_postcode": "TE1 1ST",
+        "discount": 0.0,
+    }
+
+class FakeOpenAIServer(FakeAPIServer):
+    """
+    Threaded HTTP server emulating the Responses endpoint.
+
+    Args:
+        item_count: Line items in every extracted receipt
+        input_tokens: Input token count reported in usage
+        cached_tokens: Cached input tokens reported in usage
+        invalid_probability: Fraction of receipts whose total doesn't match their items
+        **kwargs: Latency and failure injection, see FakeAPIServer
+    """
+
+    def __init__(self, item_count: int = 5, input_tokens: int = 1200, cached_tokens: int = 0,
+                 invalid_probability: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.item_count = item_count
+        self.input_tokens = input_tokens
+        self.cached_tokens = cached_tokens
+        self.invalid_probability = invalid_probability
+
+    def respond(self, method: str, path: str, body: dict) -> dict:
+        receipt = fake_receipt(self.item_count)
+        if random.random() < self.invalid_probability:
+            receipt["total"] += 10
+        text = json.dumps(receipt)
+        return {
+            "id": f"resp_{uuid.uuid4().hex}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": body.get("model", "gpt-5"),
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex}",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }],
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {
+                "input_tokens": self.input_tokens,
+                "input_tokens_details": {"cached_tokens": self.cached_tokens},
+                "output_tokens": len(text) // 4,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": self.input_tokens + len(text) // 4,
+            },
+        }
@@ -0,0 +1,151 @@
+'''
+Shared plumbing for the local stand-in API servers used by the benchmarks.
+
+FakeAPIServer runs a ThreadingHTTPServer on an ephemeral port, delays each
+response according to a latency distribution, and can answer a fraction of
+requests with 429s or 500s. Subclasses only decide what a successful
+response looks like.
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+
+LATENCY_DISTRIBUTIONS = ("uniform", "normal", "exponential")
+
+def sample_latency_ms(latency_ms: float, jitter_ms: float, distribution: str = "uniform") -> float:
+    """
+    Draw one response delay.
+
+    Args:
+        latency_ms: Base delay
+        jitter_ms: Spread around the base delay
+        distribution: "uniform" adds U(0, jitter); "normal" draws N(latency, jitter);
+            "exponential" adds an exponential tail with mean jitter
+
+    Returns:
+        Delay in milliseconds, never negative
+    """
+    if distribution == "normal":
+        return max(0.0, random.gauss(latency_ms, jitter_ms))
+    if distribution == "exponential":
+        return latency_ms + (random.expovariate(1 / jitter_ms) if jitter_ms else 0.0)
+    return latency_ms + random.uniform(0, jitter_ms)
+
+class FakeAPIServer:
+    """
+    Threaded HTTP server answering JSON requests with injected latency and failures.
+
+    Args:
+        latency_ms: Base delay added to every response
+        jitter_ms: Spread of the delay, interpreted by latency_distribution
+        rate_limit_probability: Fraction of requests answered with 429
+        retry_after: Value of the Retry-After header sent with 429s, in seconds
+        error_probability: Fraction of requests answered with 500
+        latency_distribution: One of LATENCY_DISTRIBUTIONS
+    """
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0,
+                 rate_limit_probability: float = 0.0, retry_after: float = 0.1,
+                 error_probability: float = 0.0, latency_distribution: str = "uniform"):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.error_probability = error_probability
+        self.latency_distribution = latency_distribution
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.error_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rate_limited_body(self) -> dict:
+        return {"error": {"message": "Rate limited", "type": "rate_limit_error"}}
+
+    def error_body(self) -> dict:
+        return {"error": {"message": "Internal error", "type": "server_error"}}
+
+    def respond(self, method: str, path: str, body: dict) -> dict:
+        """Return the JSON body of a successful response. Implemented by subclasses."""
+        raise NotImplementedError
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: dict, headers: dict = None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                try:
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the request, e.g. a cancelled hedge
+                    self.close_connection = True
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                with fake._lock:
+                    fake.request_count += 1
+                delay = sample_latency_ms(fake.latency_ms, fake.jitter_ms, fake.latency_distribution)
+                if delay:
+                    time.sleep(delay / 1000)
+
+                roll = random.random()
+                if roll < fake.rate_limit_probability:
+                    with fake._lock:
+                        fake.rate_limited_count += 1
+                    self._send(429, fake.rate_limited_body(), {"Retry-After": str(fake.retry_after)})
+                    return
+                if roll < fake.rate_limit_probability + fake.error_probability:
+                    with fake._lock:
+                        fake.error_count += 1
+                    self._send(500, fake.error_body())
+                    return
+
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+                self._send(200, fake.respond(self.command, self.path, body))
+
+            do_POST = _handle
+            do_PATCH = _handle
+            do_GET = _handle
+
+        return Handler
@@ -0,0 +1,225 @@
+'''
+Offline end-to-end load test for /scan.
+
+Starts local stand-ins for the OpenAI Responses API and the Notion API, points
+the app at them through its environment, and drives the real FastAPI app
+in-process (httpx ASGITransport, lifespan included) at a fixed concurrency.
+Reports throughput, latency percentiles, per-stage latencies from the app's
+own metrics, status codes and peak memory, so a performance change can be
+checked on a laptop with no network.
+
+Without --corpus, a few synthetic phone-sized photos are used. The receipt
+cache is off by default so repeated corpus images still exercise the full path.
+
+Usage:
+    python -m benchmarks.load_test --requests 200 --concurrency 16 \
+        --openai-latency-ms 1500 --openai-jitter-ms 500 --notion-latency-ms 150 \
+        --rate-limit-probability 0.02 --error-probability 0.01
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from benchmarks.bench_image_normalization import IMAGE_EXTENSIONS, synthetic_corpus
+from benchmarks.fake_notion import FakeNotionServer
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_server import LATENCY_DISTRIBUTIONS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = (
+    "validation", "upload_read", "image_normalize", "base64_encode", "openai_call",
+    "notion_page_create", "notion_item_db_create", "notion_item_writes",
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--corpus", help="Directory of receipt images")
+    parser.add_argument("--defer-notion", action="store_true", help="Return before the Notion write")
+    parser.add_argument("--cache", action="store_true", help="Leave the receipt cache enabled")
+    parser.add_argument("--items", type=int, default=5, help="Line items per extracted receipt")
+    parser.add_argument("--write-layout", default="inline_database", choices=["inline_database", "table"])
+    parser.add_argument("--notion-rate", type=float, default=0,
+                        help="Notion governor requests/s; 0 disables (the fake server has no quota)")
+    parser.add_argument("--openai-latency-ms", type=float, default=1000)
+    parser.add_argument("--openai-jitter-ms", type=float, default=300)
+    parser.add_argument("--notion-latency-ms", type=float, default=150)
+    parser.add_argument("--notion-jitter-ms", type=float, default=50)
+    parser.add_argument("--distribution", default="uniform", choices=LATENCY_DISTRIBUTIONS)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--error-probability", type=float, default=0.0)
+    parser.add_argument("--invalid-probability", type=float, default=0.0,
+                        help="Fraction of extractions that fail the local checks and are escalated")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Hedge slow OpenAI calls; compare p99 against a run without it")
+    parser.add_argument("--hedge-budget", type=float, default=0.05)
+    parser.add_argument("--hedge-min-delay", type=float, default=0.0,
+                        help="Hedge delay floor in seconds (the app defaults to 1.0)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Also report peak Python heap (slows the run down)")
+    return parser.parse_args()
+
+def load_corpus(path):
+    if not path:
+        return synthetic_corpus()
+    corpus = []
+    for name in sorted(os.listdir(path)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            with open(os.path.join(path, name), "rb") as f:
+                corpus.append((name, f.read()))
+    if not corpus:
+        sys.exit(f"No images found in {path}")
+    return corpus
+
+def configure_environment(args, openai_url: str, notion_url: str, workdir: str):
+    """Point the app at the fake servers. Must run before `app` is imported."""
+    os.environ.update({
+        "OPENAI_API_KEY": "fake-openai-key",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "NOTION_TOKEN": "fake-notion-token",
+        "NOTION_BASE_URL": notion_url,
+        "NOTION_TRANSACTIONS_DATABASE_ID": "bench-transactions",
+        "PAGE_ID": "bench-page",
+        "NOTION_WRITE_LAYOUT": args.write_layout,
+        "NOTION_REQUESTS_PER_SECOND": str(args.notion_rate),
+        "AUTH_TOKEN": "",
+        "ALLOWED_HOSTS": "",
+        "RATE_LIMIT_PER_MINUTE": str(10 ** 9),
+        "OPENAI_HEDGE_ENABLED": "true" if args.hedge else "false",
+        "OPENAI_HEDGE_BUDGET": str(args.hedge_budget),
+        "OPENAI_HEDGE_MIN_DELAY_SECONDS": str(args.hedge_min_delay),
+        "RECEIPT_CACHE_ENABLED": "true" if args.cache else "false",
+        "RECEIPT_CACHE_PATH": os.path.join(workdir, "receipts.sqlite3"),
+        "NOTION_OUTBOX_PATH": os.path.join(workdir, "notion_outbox.sqlite3"),
+    })
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+async def drive(app, corpus, args):
+    import httpx
+
+    latencies = []
+    statuses = Counter()
+    next_request = iter(range(args.requests))
+    query = "?defer_notion=true" if args.defer_notion else "?defer_notion=false"
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost", timeout=None) as client:
+
+            async def worker():
+                for index in next_request:
+                    name, data = corpus[index % len(corpus)]
+                    start = time.perf_counter()
+                    try:
+                        response = await client.post(f"/scan{query}", files={"file": (name, data, "image/jpeg")})
+                        status = response.status_code
+                        if status == 200 and response.json()["notion_response"].get("status") not in ("success", "pending"):
+                            status = "200 (notion queued)"
+                    except Exception as e:
+                        status = type(e).__name__
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+    return latencies, statuses, elapsed
+
+def main():
+    args = parse_args()
+    corpus = load_corpus(args.corpus)
+
+    openai_server = FakeOpenAIServer(
+        item_count=args.items, invalid_probability=args.invalid_probability, latency_ms=args.openai_latency_ms, jitter_ms=args.openai_jitter_ms,
+        rate_limit_probability=args.rate_limit_probability, error_probability=args.error_probability,
+        latency_distribution=args.distribution,
+    )
+    notion_server = FakeNotionServer(
+        latency_ms=args.notion_latency_ms, jitter_ms=args.notion_jitter_ms,
+        rate_limit_probability=args.rate_limit_probability, error_probability=args.error_probability,
+        latency_distribution=args.distribution,
+    )
+
+    with openai_server, notion_server, tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, openai_server.base_url, notion_server.base_url, workdir)
+        from app.main import app
+        from app.hedging import openai_hedger
+        from app.overload import openai_breaker, openai_limiter
+        from app.metrics import OPENAI_TIER_SECONDS, RECEIPT_MODEL_ROUTING, SCAN_STAGE_SECONDS
+
+        baseline_rss = peak_rss_mb()
+        if args.tracemalloc:
+            tracemalloc.start()
+        latencies, statuses, elapsed = asyncio.run(drive(app, corpus, args))
+        heap_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        tracemalloc.stop()
+
+        print(f"{args.requests} requests, concurrency {args.concurrency}, {len(corpus)} corpus images, "
+              f"openai {args.openai_latency_ms}±{args.openai_jitter_ms}ms, "
+              f"notion {args.notion_latency_ms}±{args.notion_jitter_ms}ms ({args.distribution}), "
+              f"429 p={args.rate_limit_probability}, 500 p={args.error_probability}")
+        print(f"throughput: {len(latencies) / elapsed:.2f} req/s over {elapsed:.2f}s")
+        print(f"latency: p50 {percentile(latencies, 0.5) * 1000:.0f}ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f}ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:.0f}ms  "
+              f"max {max(latencies) * 1000:.0f}ms")
+        print(f"statuses: {dict(statuses)}")
+
+        print(f"{'stage':<24} {'count':>6} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+        for stage in STAGES:
+            count = SCAN_STAGE_SECONDS.count(stage=stage)
+            if count:
+                p50 = SCAN_STAGE_SECONDS.quantile(0.5, stage=stage) * 1000
+                p99 = SCAN_STAGE_SECONDS.quantile(0.99, stage=stage) * 1000
+                print(f"{stage:<24} {count:>6} {p50:>9.1f} {p99:>9.1f}")
+
+        for tier in ("fast", "strong"):
+            count = OPENAI_TIER_SECONDS.count(tier=tier)
+            if count:
+                print(f"{'openai tier ' + tier:<24} {count:>6} "
+                      f"{OPENAI_TIER_SECONDS.quantile(0.5, tier=tier) * 1000:>9.1f} "
+                      f"{OPENAI_TIER_SECONDS.quantile(0.99, tier=tier) * 1000:>9.1f}  "
+                      f"(used for {RECEIPT_MODEL_ROUTING.value(tier=tier):.0f})")
+
+        if args.hedge:
+            print(f"hedging: {openai_hedger.stats()}")
+        print(f"openai concurrency: {openai_limiter.stats()}")
+        print(f"openai circuit: {openai_breaker.stats()}")
+
+        peak = peak_rss_mb()
+        if peak is not None:
+            print(f"memory: peak RSS {peak:.0f}MB (before load {baseline_rss:.0f}MB)")
+        if heap_peak is not None:
+            print(f"memory: peak Python heap {heap_peak / (1024 * 1024):.1f}MB")
+        print(f"fake openai: {openai_server.request_count} requests, {openai_server.rate_limited_count} rate limited, "
+              f"{openai_server.error_count} errors")
+        print(f"fake notion: {notion_server.request_count} requests, {notion_server.rate_limited_count} rate limited, "
+              f"{notion_server.error_count} errors")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+'''
+Shared payloads for the microbenchmarks.
+
+Receipts come in 5/50/200-item sizes and images in a small (~200KB,
+already-normalized photo) and large (~5MB, raw phone photo) size.
+'''
+
+import os
+import random
+
+import pytest
+
+from app.models import Receipt, ReceiptCategory
+
+ITEM_COUNTS = [5, 50, 200]
+IMAGE_SIZES = {"small": 200 * 1024, "large": 5 * 1024 * 1024}
+
+def receipt_payload(item_count: int) -> dict:
+    rng = random.Random(item_count)
+    prices = [round(rng.uniform(0.5, 20), 2) for _ in range(item_count)]
+    return {
+        "date": "2025-07-27",
+        "total": round(sum(prices), 2),
+        "items": [f"Item {index} {'x' * rng.randint(5, 25)}" for index in range(item_count)],
+        "items_price": prices,
+        "items_quantity": [rng.randint(1, 4) for _ in range(item_count)],
+        "reciept_category": ReceiptCategory.GROCERY.value,
+        "store_name": "Benchmark Store",
+        "store_first_line": "1 Test Street",
+        "store_second_line": None,
+        "store_postcode": "TE1 1ST",
+        "discount": None,
+    }
+
+@pytest.fixture(params=ITEM_COUNTS, ids=lambda count: f"{count}_items")
+def payload(request) -> dict:
+    return receipt_payload(request.param)
+
+@pytest.fixture
+def receipt(payload) -> Receipt:
+    return Receipt.model_validate(payload)
+
+@pytest.fixture(params=list(IMAGE_SIZES), ids=lambda size: f"{size}_image")
+def image_bytes(request) -> bytes:
+    # JPEG magic so MIME sniffing takes the common path; the rest is incompressible noise
+    return b"\xff\xd8\xff\xe0" + os.urandom(IMAGE_SIZES[request.param] - 4)
@@ -0,0 +1,128 @@
+'''
+Microbenchmarks for the pure-Python code that runs on every request.
+
+Not collected by the regular test run (testpaths is tests/). Requires
+pytest-benchmark:
+
+    pip install pytest-benchmark
+
+Record a baseline, then compare later runs against it:
+
+    python -m pytest benchmarks/micro --benchmark-storage=benchmarks/micro/baselines --benchmark-save=baseline
+    python -m pytest benchmarks/micro --benchmark-storage=benchmarks/micro/baselines \
+        --benchmark-compare --benchmark-compare-fail=median:15%
+'''
+
+import logging
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.image_processing import NormalizedImage
+from app.llm_handler import build_receipt_request, normalize_receipt_for_notion
+from app.models import Receipt
+from app.notion_client import NotionReceiptManager
+from app.security import SensitiveDataFilter
+
+def make_manager() -> NotionReceiptManager:
+    return NotionReceiptManager(client=MagicMock(), async_client=MagicMock())
+
+def test_build_receipt_request(benchmark, image_bytes):
+    """base64 encoding and data-URL construction for the OpenAI request"""
+    image = NormalizedImage(image_bytes, "image/jpeg", len(image_bytes))
+    request = benchmark(build_receipt_request, image)
+    assert request["input"][1]["content"][1]["image_url"].startswith("data:image/jpeg;base64,")
+
+def test_receipt_validation(benchmark, payload):
+    """Validating the structured model output into a Receipt"""
+    receipt = benchmark(Receipt.model_validate, payload)
+    assert len(receipt.items) == len(payload["items"])
+
+def test_receipt_json_validation(benchmark, payload):
+    """Validating a cached or outboxed Receipt from its JSON form"""
+    raw = Receipt.model_validate(payload).model_dump_json()
+    receipt = benchmark(Receipt.model_validate_json, raw)
+    assert len(receipt.items) == len(payload["items"])
+
+def test_normalize_receipt_for_notion(benchmark, receipt):
+    """The Receipt -> Notion property dict conversion in push_to_notion"""
+    properties = benchmark(normalize_receipt_for_notion, receipt)
+    assert properties["store_second_line"] == "Unknown"
+
+def test_build_page_properties(benchmark, receipt):
+    """Transaction page property payload built by create_page"""
+    manager = make_manager()
+    properties = normalize_receipt_for_notion(receipt)
+    page_properties = benchmark(manager.build_page_properties, properties)
+    assert "Store Name" in page_properties
+
+def test_build_page_with_items_table(benchmark, receipt):
+    """Single-call page payload with the items table (table layout)"""
+    manager = make_manager()
+    properties = normalize_receipt_for_notion(receipt)
+    payload, overflow = benchmark(manager.build_page_with_items_table, "transactions-db", properties)
+    assert payload["children"]
+
+def test_item_properties(benchmark, receipt):
+    """Per-item row payloads built for the item writes"""
+    manager = make_manager()
+
+    def build_all():
+        return [
+            manager._item_properties(item, price, quantity, "transaction-id")
+            for item, price, quantity in zip(receipt.items, receipt.items_price, receipt.items_quantity)
+        ]
+
+    rows = benchmark(build_all)
+    assert len(rows) == len(receipt.items)
+
+def _record(message: str, args=(), exc_info=None) -> logging.LogRecord:
+    return logging.LogRecord("app", logging.INFO, __file__, 1, message, args, exc_info)
+
+def test_sensitive_data_filter_plain(benchmark):
+    """Filtering a typical log line with nothing to redact"""
+    log_filter = SensitiveDataFilter()
+    record = _record("Receipt cache hit for 3f2a9c1b77e0")
+    assert benchmark(log_filter.filter, record)
+
+def test_sensitive_data_filter_secrets(benchmark):
+    """Filtering a log line carrying a bearer token and an API key"""
+    log_filter = SensitiveDataFilter()
+    message = "Authorization: Bearer abcdef0123456789 key=" + "k" * 48
+
+    def run():
+        return log_filter.filter(_record(message))
+
+    assert benchmark(run)
+
+def test_sensitive_data_filter_large_response(benchmark, receipt):
+    """Filtering the large OpenAI response line logged after every extraction"""
+    log_filter = SensitiveDataFilter()
+    message = f"OpenAIResponse: {receipt!r} " * 4
+
+    def run():
+        return log_filter.filter(_record(message))
+
+    assert benchmark(run)
+
+def test_sensitive_data_filter_args(benchmark, receipt):
+    """Filtering a record whose large payload is passed as a %-style argument"""
+    log_filter = SensitiveDataFilter()
+
+    def run():
+        return log_filter.filter(_record("OpenAIResponse: %s", (receipt,)))
+
+    assert benchmark(run)
+
+@pytest.mark.parametrize("size_kb", [16, 256])
+def test_sensitive_data_filter_huge_payload(benchmark, size_kb):
+    """Per-record cost on oversized payloads, which are truncated before scanning"""
+    log_filter = SensitiveDataFilter()
+    message = "OpenAIResponse: " + "ParsedResponse(output=[...], usage=Usage(input_tokens=1234)) " * (size_kb * 16)
+
+    def run():
+        return log_filter.filter(_record(message))
+
+    assert benchmark(run)
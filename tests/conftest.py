@@ -0,0 +1,15 @@
+'''
+Shared pytest fixtures
+'''
+
+import pytest
+from unittest.mock import patch
+from app.cache import ReceiptCache
+
+@pytest.fixture(autouse=True)
+def isolated_receipt_cache(tmp_path):
+    """Keep every test's receipt cache in its own temporary directory, out of the working tree"""
+    cache = ReceiptCache(path=str(tmp_path / "receipts.sqlite3"))
+    with patch("app.llm_handler.receipt_cache", cache):
+        yield cache
+    cache.close()
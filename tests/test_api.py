@@ -5,12 +5,21 @@ pytest scripts for the API
 '''
 
 import pytest
+import asyncio
 import os
+import time
+import json
 from fastapi.testclient import TestClient
 from io import BytesIO
-from unittest.mock import patch
+from unittest.mock import patch, AsyncMock, MagicMock
 from importlib import reload
+from datetime import datetime
 import app.main
+from app.models import Receipt, ReceiptCategory
+from app.idempotency import IdempotencyStore
+from app.jobs import JobManager, JobQueueFull, JobStage
+from app.outbox import NotionOutbox
+from app.overload import CircuitOpen
 
 # We'll create the client fresh for each test that needs auth testing
 client = TestClient(app.main.app)
@@ -73,5 +82,334 @@ def test_scan_missing_file():
     response = client.post("/scan")
     assert response.status_code == 422  # Unprocessable Entity for missing required field
 
+def make_receipt(**overrides):
+    """Build a small parsed receipt for tests that mock the LLM"""
+    data = {
+        "date": datetime(2025, 8, 9),
+        "total": 6.5,
+        "items": ["Milk", "Bread"],
+        "items_price": [1.5, 2.5],
+        "items_quantity": [1, 2],
+        "reciept_category": ReceiptCategory.GROCERY,
+        "store_name": "Test Store",
+        "store_first_line": None,
+        "store_second_line": None,
+        "store_postcode": None,
+        "discount": None,
+    }
+    data.update(overrides)
+    return Receipt(**data)
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_awaits_async_extraction():
+    """Test scan endpoint awaits the async extraction path instead of the blocking one"""
+    receipt = make_receipt()
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+
+    with patch("app.main.extract_receipt", AsyncMock(return_value=receipt)) as mock_async, \
+         patch("app.main.process_receipt") as mock_sync, \
+         patch("app.main.push_to_notion_async", AsyncMock(return_value={"status": "success"})):
+        response = TestClient(app.main.app).post("/scan", files=files)
+
+    assert response.status_code == 200
+    assert response.json()["receipt_data"]["store_name"] == "Test Store"
+    mock_async.assert_awaited_once()
+    assert mock_async.await_args.args[0] == b"fake image content"
+    mock_sync.assert_not_called()
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_async_mode_returns_job():
+    """Test async scan returns 202 with a job id and the job completes in the background"""
+    receipt = make_receipt()
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+
+    with patch("app.jobs.extract_receipt", AsyncMock(return_value=receipt)), \
+         patch("app.jobs.push_to_notion_async", AsyncMock(return_value={"status": "success", "page_id": "abc"})), \
+         TestClient(app.main.app) as test_client:
+        response = test_client.post("/scan?async=true", files=files)
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        for _ in range(50):
+            job = test_client.get(f"/jobs/{job_id}").json()
+            if job["stage"] in ("done", "failed"):
+                break
+            time.sleep(0.01)
+
+    assert job["stage"] == "done"
+    assert job["receipt_data"]["store_name"] == "Test Store"
+    assert job["notion_response"]["page_id"] == "abc"
+    assert {"queued", "extraction", "notion", "total"} <= set(job["timings"])
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_unknown_job_returns_404():
+    """Test polling a job id that doesn't exist"""
+    response = TestClient(app.main.app).get("/jobs/does-not-exist")
+    assert response.status_code == 404
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_batch_runs_in_parallel_with_per_file_errors():
+    """Test batch scan processes images concurrently and reports failures per file"""
+    receipt = make_receipt()
+    in_flight = 0
+    peak = 0
+
+    async def fake_extract(image_bytes, image_hash=None, image_base64=None):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return receipt
+
+    files = [
+        ("files", ("a.jpg", BytesIO(b"image a"), "image/jpeg")),
+        ("files", ("b.jpg", BytesIO(b"image b"), "image/jpeg")),
+        ("files", ("c.jpg", BytesIO(b"image c"), "image/jpeg")),
+        ("files", ("notes.txt", BytesIO(b"not an image"), "text/plain")),
+    ]
+
+    with patch("app.main.extract_receipt", side_effect=fake_extract), \
+         patch("app.main.push_to_notion_async", AsyncMock(return_value={"status": "success"})):
+        response = TestClient(app.main.app).post("/scan/batch", files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "partial"
+    assert body["succeeded"] == 3
+    assert [result["status"] for result in body["results"]] == ["success", "success", "success", "error"]
+    assert peak == 3
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_defer_notion_returns_before_notion_write():
+    """Test deferred mode returns the receipt immediately and the Notion page id later via /jobs"""
+    receipt = make_receipt()
+    release_notion = asyncio.Event()
+
+    async def slow_push(receipt_data):
+        await release_notion.wait()
+        return {"status": "success", "page_id": "page-123", "page_url": "https://notion.so/page-123"}
+
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+    with patch("app.main.extract_receipt", AsyncMock(return_value=receipt)), \
+         patch("app.jobs.push_to_notion_async", side_effect=slow_push), \
+         TestClient(app.main.app) as test_client:
+        response = test_client.post("/scan?defer_notion=true", files=files)
+        assert response.status_code == 200
+        body = response.json()
+        assert body["receipt_data"]["store_name"] == "Test Store"
+        assert body["notion_response"]["status"] == "pending"
+
+        job_id = body["notion_response"]["job_id"]
+        assert test_client.get(f"/jobs/{job_id}").json()["stage"] == "pushing_to_notion"
+
+        test_client.portal.call(release_notion.set)
+        for _ in range(50):
+            job = test_client.get(f"/jobs/{job_id}").json()
+            if job["stage"] == "done":
+                break
+            time.sleep(0.01)
+
+    assert job["notion_response"]["page_id"] == "page-123"
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_deferred_notion_write_waits_for_outbox_delivery():
+    """Test a Notion write left to the outbox isn't done until the outbox delivers it"""
+    outbox = MagicMock()
+    outbox.get.return_value = {"status": "pending", "attempts": 1, "last_error": "down",
+                               "page_id": None, "page_url": None}
+    queued = {"status": "queued", "outbox_id": "entry-1", "message": "Failed to push to Notion: down (will retry)"}
+
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+    with patch("app.main.extract_receipt", AsyncMock(return_value=make_receipt())), \
+         patch("app.jobs.notion_outbox", outbox), \
+         patch("app.jobs.push_to_notion_async", AsyncMock(return_value=queued)), \
+         TestClient(app.main.app) as test_client:
+        job_id = test_client.post("/scan?defer_notion=true", files=files).json()["notion_response"]["job_id"]
+        for _ in range(50):
+            job = test_client.get(f"/jobs/{job_id}").json()
+            if job["stage"] != "pushing_to_notion":
+                break
+            time.sleep(0.01)
+        assert job["stage"] == "notion_queued"
+        assert job["outbox_id"] == "entry-1"
+
+        outbox.get.return_value = {"status": "delivered", "attempts": 2, "last_error": None,
+                                   "page_id": "page-9", "page_url": "https://notion.so/page-9"}
+        job = test_client.get(f"/jobs/{job_id}").json()
+
+    assert job["stage"] == "done"
+    assert job["notion_response"]["page_id"] == "page-9"
+    outbox.get.assert_called_with("entry-1")
+
+def test_deferred_notion_writes_beyond_the_cap_are_left_to_the_outbox(tmp_path):
+    """Test deferred writes past JOB_MAX_NOTION_WRITES are queued in the outbox, or refused without one"""
+    release = None
+
+    async def slow_push(receipt_data):
+        await release.wait()
+        return {"status": "success", "page_id": "page-1"}
+
+    async def run(outbox):
+        nonlocal release
+        release = asyncio.Event()
+        manager = JobManager()
+        with patch("app.jobs.notion_outbox", outbox):
+            first = await manager.submit_notion_write(make_receipt())
+            try:
+                second = await manager.submit_notion_write(make_receipt())
+            finally:
+                release.set()
+                await asyncio.gather(*manager._background)
+        return first, second
+
+    outbox = NotionOutbox(AsyncMock(), path=str(tmp_path / "outbox.sqlite3"))
+    with patch("app.jobs.JOB_MAX_NOTION_WRITES", 1), \
+         patch("app.jobs.push_to_notion_async", side_effect=slow_push):
+        first, second = asyncio.run(run(outbox))
+        assert first.stage is JobStage.DONE
+        assert second.stage is JobStage.NOTION_QUEUED
+        assert outbox.get(second.outbox_id)["status"] == "pending"
+
+        outbox.enabled = False
+        with pytest.raises(JobQueueFull):
+            asyncio.run(run(outbox))
+
+def test_notion_write_error_fails_job():
+    """Test a Notion write that errors marks its job failed rather than done"""
+    async def run():
+        manager = JobManager()
+        job = await manager.submit_notion_write(make_receipt())
+        await asyncio.gather(*manager._background)
+        return job
+
+    error = {"status": "error", "message": "Failed to push to Notion: bad request"}
+    with patch("app.jobs.push_to_notion_async", AsyncMock(return_value=error)):
+        job = asyncio.run(run())
+
+    assert job.stage is JobStage.FAILED
+    assert "bad request" in job.error
+
+def test_scan_rejects_oversized_request_before_parsing():
+    """Test a Content-Length over the limit is refused with 413 up front"""
+    too_large = str((app.main.MAX_FILE_SIZE + 2) * 1024 * 1024)
+    response = TestClient(app.main.app).post(
+        "/scan",
+        content=b"x",
+        headers={"Content-Type": "multipart/form-data; boundary=x", "Content-Length": too_large},
+    )
+    assert response.status_code == 413
+
+def test_scan_batch_rejects_body_over_batch_limit():
+    """Test a batch body over BATCH_MAX_BODY_MB is refused with 413 up front"""
+    too_large = str((app.main.BATCH_MAX_BODY_MB + 2) * 1024 * 1024)
+    response = TestClient(app.main.app).post(
+        "/scan/batch",
+        content=b"x",
+        headers={"Content-Type": "multipart/form-data; boundary=x", "Content-Length": too_large},
+    )
+    assert response.status_code == 413
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_metrics_reports_scan_stages():
+    """Test /metrics exposes per-stage latency, request counts and component stats"""
+    receipt = make_receipt()
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+
+    with patch("app.main.extract_receipt", AsyncMock(return_value=receipt)), \
+         patch("app.main.push_to_notion_async", AsyncMock(return_value={"status": "success"})):
+        test_client = TestClient(app.main.app)
+        assert test_client.post("/scan", files=files).status_code == 200
+        response = test_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'receipt_scan_stage_duration_seconds_count{stage="upload_read"}' in body
+    assert 'receipt_scan_stage_duration_seconds_quantile{stage="validation",quantile="0.99"}' in body
+    assert 'receipt_scanner_http_requests_total{path="/scan",status="200"}' in body
+    assert 'receipt_scanner_http_requests_in_flight{path="/scan"} 0' in body
+    assert 'receipt_cache_lookups_total{result="misses"}' in body
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_fails_fast_while_circuit_is_open():
+    """An open OpenAI circuit answers 503 with Retry-After instead of waiting on OpenAI"""
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+
+    with patch("app.main.extract_receipt", AsyncMock(side_effect=CircuitOpen(12.3))):
+        response = TestClient(app.main.app).post("/scan", files=files)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "13"
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_stream_reports_each_stage():
+    """The stream emits stage events in order, with the receipt as soon as it is extracted"""
+    receipt = make_receipt()
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+
+    async def extract(data, sha256, base64, on_progress):
+        on_progress("normalized", {"normalized_bytes": 18})
+        on_progress("extracting", {"tier": "fast"})
+        return receipt
+
+    async def push(receipt, on_progress):
+        on_progress("notion_page_created", {"page_id": "page-1"})
+        on_progress("notion_items_written", {"written": 1, "total": 1})
+        return {"status": "success", "page_id": "page-1"}
+
+    with patch("app.main.extract_receipt", side_effect=extract), \
+         patch("app.main.push_to_notion_async", side_effect=push):
+        response = TestClient(app.main.app).post("/scan/stream", files=files)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block.split("\n") for block in response.text.strip().split("\n\n")]
+    names = [lines[0].removeprefix("event: ") for lines in events]
+    data = [json.loads(lines[1].removeprefix("data: ")) for lines in events]
+    assert names == ["received", "normalized", "extracting", "extracted",
+                     "notion_page_created", "notion_items_written", "done"]
+    assert data[3]["receipt_data"]["store_name"] == "Test Store"
+    assert data[-1]["notion_response"]["status"] == "success"
+    assert all("timestamp" in event and event["elapsed_ms"] >= 0 for event in data)
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_stream_ends_with_error_event():
+    """A failed extraction ends the stream with an error event"""
+    files = {"file": ("test_receipt.jpg", BytesIO(b"fake image content"), "image/jpeg")}
+
+    with patch("app.main.extract_receipt", AsyncMock(side_effect=RuntimeError("boom"))):
+        response = TestClient(app.main.app).post("/scan/stream", files=files)
+
+    assert response.status_code == 200
+    assert response.text.strip().split("\n\n")[-1].startswith("event: error")
+
+@patch("app.main.AUTH_TOKEN", None)
+def test_scan_with_idempotency_key_replays_result():
+    """A retry with the same Idempotency-Key gets the stored response without extracting or writing again"""
+    receipt = make_receipt()
+    extract = AsyncMock(return_value=receipt)
+    push = AsyncMock(return_value={"status": "success", "page_id": "page-1"})
+    client = TestClient(app.main.app)
+
+    def scan(image=b"fake image content"):
+        files = {"file": ("test_receipt.jpg", BytesIO(image), "image/jpeg")}
+        return client.post("/scan", files=files, headers={"Idempotency-Key": "retry-key-1"})
+
+    with patch("app.main.idempotency_store", IdempotencyStore()), \
+         patch("app.main.extract_receipt", extract), \
+         patch("app.main.push_to_notion_async", push):
+        first = scan()
+        second = scan()
+        conflict = scan(b"another image")
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert "Idempotent-Replayed" not in first.headers
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert extract.await_count == 1
+    assert push.await_count == 1
+    assert conflict.status_code == 422
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,98 @@
+'''
+pytest scripts for the receipt extraction cache
+'''
+
+import asyncio
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.cache import ReceiptCache
+from app.models import Receipt, ReceiptCategory
+import app.llm_handler
+
+def make_receipt(store_name="Test Store"):
+    return Receipt(
+        date=datetime(2025, 8, 9),
+        total=4.0,
+        items=["Milk"],
+        items_price=[4.0],
+        items_quantity=[1],
+        reciept_category=ReceiptCategory.GROCERY,
+        store_name=store_name,
+        store_first_line=None,
+        store_second_line=None,
+        store_postcode=None,
+        discount=None,
+    )
+
+def test_memory_and_disk_tiers(tmp_path):
+    """A stored receipt is served from memory, and from disk after a restart"""
+    path = str(tmp_path / "receipts.sqlite3")
+    cache = ReceiptCache(path=path, enabled=True)
+    key = cache.key(b"image bytes")
+
+    assert cache.get(key) is None
+    cache.set(key, make_receipt())
+    assert cache.get(key).store_name == "Test Store"
+    assert cache.stats()["memory_hits"] == 1
+    cache.close()
+
+    restarted = ReceiptCache(path=path, enabled=True)
+    assert restarted.get(key).store_name == "Test Store"
+    assert restarted.stats() == {"memory_hits": 0, "disk_hits": 1, "misses": 0, "memory_entries": 1}
+
+def test_expired_entries_are_misses(tmp_path):
+    """Entries older than the TTL are not returned from either tier"""
+    cache = ReceiptCache(path=str(tmp_path / "receipts.sqlite3"), ttl_seconds=-1, enabled=True)
+    key = cache.key(b"image bytes")
+    cache.set(key, make_receipt())
+    assert cache.get(key) is None
+    assert cache.stats()["misses"] == 1
+
+def test_size_eviction(tmp_path):
+    """The memory tier is an LRU and the disk tier keeps at most max_entries"""
+    cache = ReceiptCache(path=str(tmp_path / "receipts.sqlite3"), memory_entries=1, max_entries=2, enabled=True)
+    for name in ["a", "b", "c"]:
+        cache.set(cache.key(name.encode()), make_receipt(name))
+
+    assert cache.stats()["memory_entries"] == 1
+    assert cache.get(cache.key(b"a")) is None
+    assert cache.get(cache.key(b"b")).store_name == "b"
+    assert cache.get(cache.key(b"c")).store_name == "c"
+
+def test_extract_receipt_skips_llm_on_repeat_upload():
+    """The same image bytes only trigger one OpenAI call"""
+    cache = ReceiptCache(path="", enabled=True)
+    extraction = AsyncMock(return_value=MagicMock(output_parsed=make_receipt()))
+
+    async def scan_twice():
+        first = await app.llm_handler.extract_receipt(b"same photo")
+        second = await app.llm_handler.extract_receipt(b"same photo")
+        return first, second
+
+    with patch("app.llm_handler.receipt_cache", cache), \
+         patch("app.llm_handler.process_receipt_async", extraction):
+        first, second = asyncio.run(scan_twice())
+
+    assert first == second
+    extraction.assert_awaited_once()
+    assert cache.stats()["memory_hits"] == 1
+
+def test_extraction_settings_change_the_cache_key():
+    """A new model (or prompt, schema, normalization) misses entries cached under the old one"""
+    cache = ReceiptCache(path="", enabled=True)
+    extraction = AsyncMock(return_value=MagicMock(output_parsed=make_receipt()))
+
+    def scan():
+        app.llm_handler.extraction_version.cache_clear()
+        return asyncio.run(app.llm_handler.extract_receipt(b"same photo"))
+
+    try:
+        with patch("app.llm_handler.receipt_cache", cache), \
+             patch("app.llm_handler.process_receipt_async", extraction):
+            scan()
+            with patch("app.llm_handler.OPENAI_STRONG_MODEL", "gpt-6"):
+                scan()
+    finally:
+        app.llm_handler.extraction_version.cache_clear()
+
+    assert extraction.await_count == 2
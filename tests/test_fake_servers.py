@@ -0,0 +1,37 @@
+'''
+pytest scripts for the benchmark stand-in servers
+'''
+
+import httpx
+from openai import OpenAI
+from app.models import Receipt
+from benchmarks.fake_notion import FakeNotionServer
+from benchmarks.fake_openai import FakeOpenAIServer
+
+def test_fake_openai_answers_responses_parse():
+    """The OpenAI SDK parses the fake response into a Receipt"""
+    with FakeOpenAIServer(item_count=3) as server:
+        client = OpenAI(api_key="test-key", base_url=f"{server.base_url}/v1", max_retries=0)
+        response = client.responses.parse(
+            model="gpt-5",
+            input=[{"role": "user", "content": "receipt"}],
+            text_format=Receipt,
+        )
+        client.close()
+
+    assert response.output_parsed.store_name == "Benchmark Store"
+    assert len(response.output_parsed.items) == 3
+    assert server.request_count == 1
+
+def test_fake_server_injects_rate_limits_and_errors():
+    """Injected 429s carry Retry-After and 500s are counted separately"""
+    with FakeNotionServer(rate_limit_probability=1.0, retry_after=2) as server:
+        response = httpx.post(f"{server.base_url}/v1/pages", json={})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert server.rate_limited_count == 1
+
+    with FakeNotionServer(error_probability=1.0) as server:
+        response = httpx.post(f"{server.base_url}/v1/pages", json={})
+    assert response.status_code == 500
+    assert server.error_count == 1
@@ -0,0 +1,120 @@
+'''
+pytest scripts for OpenAI request hedging
+'''
+
+import asyncio
+from app.hedging import RequestHedger
+from app.overload import AdaptiveLimiter
+
+def _warm(hedger: RequestHedger, seconds: float = 0.01, samples: int = 20):
+    for _ in range(samples):
+        hedger._record("model", seconds)
+        hedger.calls += 1
+
+def test_no_hedge_until_enough_samples():
+    """Without a latency history the call is awaited as-is"""
+    hedger = RequestHedger(enabled=True, min_samples=20, min_delay=0)
+    assert hedger.hedge_delay("model") is None
+    _warm(hedger)
+    assert hedger.hedge_delay("model") == 0.01
+
+def test_slow_call_is_hedged_and_loser_cancelled():
+    """A call slower than the percentile gets a duplicate; the first to finish wins"""
+    hedger = RequestHedger(enabled=True, min_delay=0, budget=1.0)
+    _warm(hedger)
+    durations = iter([10.0, 0.01])
+    cancelled = []
+
+    async def call():
+        duration = next(durations)
+        try:
+            await asyncio.sleep(duration)
+        except asyncio.CancelledError:
+            cancelled.append(duration)
+            raise
+        return duration
+
+    assert asyncio.run(asyncio.wait_for(hedger.run("model", call), 2)) == 0.01
+    assert cancelled == [10.0]
+    assert hedger.stats()["hedges"] == 1
+    assert hedger.stats()["hedge_wins"] == 1
+
+def test_hedge_wins_do_not_lower_the_hedge_delay():
+    """Latency is recorded from the primary's start, so repeated hedge wins can't shrink the delay"""
+    hedger = RequestHedger(enabled=True, percentile=0.5, min_delay=0, budget=1.0, window=20)
+    _warm(hedger, seconds=0.02)
+    delay = hedger.hedge_delay("model")
+
+    async def call():
+        await asyncio.sleep(1.0 if next(durations) == "primary" else 0.001)
+        return "done"
+
+    for _ in range(12):
+        durations = iter(["primary", "hedge"])
+        assert asyncio.run(hedger.run("model", call)) == "done"
+        assert hedger.hedge_delay("model") >= delay
+
+    assert hedger.stats()["hedge_wins"] == 12
+
+def test_failed_hedge_falls_back_to_primary():
+    """If the first call to finish raised, the other one is still awaited"""
+    hedger = RequestHedger(enabled=True, min_delay=0, budget=1.0)
+    _warm(hedger)
+    durations = iter([0.1, 0.0])
+
+    async def call():
+        duration = next(durations)
+        await asyncio.sleep(duration)
+        if duration == 0.0:
+            raise ConnectionError("hedge failed")
+        return duration
+
+    assert asyncio.run(hedger.run("model", call)) == 0.1
+    assert hedger.stats()["hedge_wins"] == 0
+
+def test_budget_caps_hedges():
+    """No hedge is sent once hedges would exceed the budget share of calls"""
+    hedger = RequestHedger(enabled=True, min_delay=0, budget=0.0)
+    _warm(hedger)
+    started = []
+
+    async def call():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    assert asyncio.run(hedger.run("model", call)) == "done"
+    assert len(started) == 1
+    assert hedger.stats()["over_budget"] == 1
+
+def test_hedge_needs_a_free_limiter_slot():
+    """A hedge takes its own concurrency slot and is skipped when none is free"""
+    def scan(limit):
+        hedger = RequestHedger(enabled=True, min_delay=0, budget=1.0)
+        _warm(hedger)
+        limiter = AdaptiveLimiter(initial=limit, max_limit=limit)
+        durations = iter([0.05, 0.0])
+        in_flight = []
+
+        async def call():
+            in_flight.append(limiter.in_flight)
+            await asyncio.sleep(next(durations))
+            return len(in_flight)
+
+        async def guarded():
+            await limiter.acquire()
+            try:
+                return await hedger.run("model", call, limiter)
+            finally:
+                limiter.release(0.01, "success")
+
+        return asyncio.run(guarded()), in_flight, hedger.stats(), limiter.stats()
+
+    result, in_flight, hedging, limits = scan(limit=1)
+    assert (result, in_flight) == (1, [1])
+    assert hedging["no_slot"] == 1 and hedging["hedges"] == 0
+
+    result, in_flight, hedging, limits = scan(limit=2)
+    assert (result, in_flight) == (2, [1, 2])
+    assert hedging["hedge_wins"] == 1
+    assert limits["in_flight"] == 0
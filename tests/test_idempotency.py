@@ -0,0 +1,118 @@
+'''
+pytest scripts for the Idempotency-Key store
+'''
+
+import asyncio
+import pytest
+from app.idempotency import IdempotencyConflict, IdempotencyStore
+
+def test_concurrent_duplicates_attach_to_in_flight_work():
+    """Duplicates arriving while the first request runs share its single execution"""
+    store = IdempotencyStore()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(store.run("key", "body", work) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert sorted(results, key=lambda result: result[1]) == [("result", False), ("result", True), ("result", True)]
+    assert store.stats()["attached"] == 2
+
+def test_completed_result_is_replayed_until_it_expires():
+    """A later duplicate gets the stored result; after the TTL the work runs again"""
+    store = IdempotencyStore(ttl=60)
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        first = await store.run("key", "body", work)
+        second = await store.run("key", "body", work)
+        store._entries["key"].created_at -= 61
+        third = await store.run("key", "body", work)
+        return first, second, third
+
+    assert asyncio.run(main()) == ((1, False), (1, True), (2, False))
+    assert store.stats()["replays"] == 1
+
+def test_failed_work_is_not_stored():
+    """A retry after a failure runs the work again"""
+    store = IdempotencyStore()
+    outcomes = iter([RuntimeError("boom"), "ok"])
+
+    async def work():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await store.run("key", "body", work)
+        return await store.run("key", "body", work)
+
+    assert asyncio.run(main()) == ("ok", False)
+
+def test_reused_key_with_different_body_conflicts():
+    """The same key with a different request is refused"""
+    store = IdempotencyStore()
+
+    async def work():
+        return "result"
+
+    async def main():
+        await store.run("key", "body", work)
+        await store.run("key", "other body", work)
+
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(main())
+
+def test_oldest_completed_entries_are_evicted():
+    """The store holds at most max_entries completed results"""
+    store = IdempotencyStore(max_entries=2)
+
+    async def work():
+        return "result"
+
+    async def main():
+        for key in ("a", "b", "c"):
+            await store.run(key, "body", work)
+        await store.run("d", "body", work)
+
+    asyncio.run(main())
+    assert list(store._entries) == ["c", "d"]
+
+def test_in_flight_count_tracks_running_and_failed_work():
+    """stats() reports running work from a counter kept on the loop, including work that fails"""
+    store = IdempotencyStore()
+    release = None
+
+    async def work():
+        await release.wait()
+        return "result"
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        running = asyncio.ensure_future(store.run("key", "body", work))
+        await asyncio.sleep(0)
+        during = store.stats()["in_flight"]
+        release.set()
+        await running
+        with pytest.raises(RuntimeError):
+            await store.run("other", "body", failing)
+        return during
+
+    assert asyncio.run(main()) == 1
+    assert store.stats()["in_flight"] == 0
@@ -0,0 +1,58 @@
+'''
+pytest scripts for image normalization
+'''
+
+from io import BytesIO
+from unittest.mock import patch
+from PIL import Image
+from app.image_processing import normalize_image, sniff_mime_type
+
+def make_image(size, format="JPEG", color=(200, 30, 30), orientation=None):
+    image = Image.new("RGB", size, color)
+    buffer = BytesIO()
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(buffer, format=format, exif=exif)
+    else:
+        image.save(buffer, format=format)
+    return buffer.getvalue()
+
+def test_large_photo_is_downsized_and_grayscale():
+    """A phone-sized photo is shrunk to the long-edge budget and converted to grayscale"""
+    original = make_image((4000, 3000))
+    normalized = normalize_image(original, max_long_edge=1000, grayscale=True, output_format="JPEG")
+
+    assert (normalized.width, normalized.height) == (1000, 750)
+    assert normalized.mime_type == "image/jpeg"
+    assert normalized.original_bytes == len(original)
+    assert Image.open(BytesIO(normalized.data)).mode == "L"
+
+def test_exif_orientation_is_applied():
+    """Orientation 6 (rotate 90 degrees) swaps width and height"""
+    original = make_image((400, 200), orientation=6)
+    normalized = normalize_image(original, max_long_edge=2048)
+    assert (normalized.width, normalized.height) == (200, 400)
+
+def test_png_reencoded_with_matching_mime_type():
+    """The MIME type follows the output format rather than being hardcoded to JPEG"""
+    original = make_image((3000, 3000), format="PNG")
+    assert sniff_mime_type(original) == "image/png"
+
+    normalized = normalize_image(original, max_long_edge=512, output_format="WEBP")
+    assert normalized.mime_type == "image/webp"
+    assert sniff_mime_type(normalized.data) == "image/webp"
+
+def test_undecodable_bytes_pass_through():
+    """Bytes Pillow can't read are sent unchanged so the model can still try"""
+    normalized = normalize_image(b"fake image content")
+    assert normalized.data == b"fake image content"
+    assert normalized.mime_type == "image/jpeg"
+
+def test_decompression_bomb_passes_through():
+    """An image over Pillow's pixel limit is sent unchanged rather than failing the scan"""
+    original = make_image((200, 200), format="PNG")
+    with patch("PIL.Image.MAX_IMAGE_PIXELS", 1000):
+        normalized = normalize_image(original)
+    assert normalized.data == original
+    assert normalized.mime_type == "image/png"
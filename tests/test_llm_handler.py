@@ -0,0 +1,96 @@
+'''
+pytest scripts for OpenAI request construction and usage accounting
+'''
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from app.image_processing import NormalizedImage
+from app.llm_handler import (
+    OPENAI_FAST_MODEL, OPENAI_STRONG_MODEL, build_receipt_request, process_receipt_async, receipt_problems,
+    record_openai_usage,
+)
+from app.metrics import (
+    OPENAI_INPUT_TOKENS, OPENAI_REQUESTS, OPENAI_TIER_SECONDS, RECEIPT_ESCALATIONS, RECEIPT_MODEL_ROUTING, registry,
+)
+from app.models import Receipt
+
+def _image(data: bytes) -> NormalizedImage:
+    return NormalizedImage(data=data, mime_type="image/jpeg", original_bytes=len(data))
+
+def test_request_prefix_is_identical_across_images():
+    """Only the trailing image differs between two receipts, so the prompt cache can match the prefix"""
+    first = build_receipt_request(_image(b"first receipt"))
+    second = build_receipt_request(_image(b"second receipt"))
+
+    assert first["input"][0] == second["input"][0]
+    assert first["input"][1]["content"][:-1] == second["input"][1]["content"][:-1]
+    assert first["input"][1]["content"][-1]["type"] == "input_image"
+    assert first["input"][1]["content"][-1] != second["input"][1]["content"][-1]
+    assert first["extra_body"] == {"prompt_cache_key": "receipt-extraction-v1"}
+
+def test_usage_splits_cached_and_uncached_input_tokens():
+    """cached_tokens from the usage details feed the counters and the hit ratio"""
+    cached_before = OPENAI_INPUT_TOKENS.value(cache="cached")
+    uncached_before = OPENAI_INPUT_TOKENS.value(cache="uncached")
+    hits_before = OPENAI_REQUESTS.value(cache="hit")
+    usage = SimpleNamespace(input_tokens=1500, output_tokens=200,
+                            input_tokens_details=SimpleNamespace(cached_tokens=1280))
+
+    record_openai_usage(SimpleNamespace(id="resp_1", model="gpt-5", usage=usage))
+    record_openai_usage(SimpleNamespace(id="resp_2", model="gpt-5", usage=None))
+
+    assert OPENAI_INPUT_TOKENS.value(cache="cached") - cached_before == 1280
+    assert OPENAI_INPUT_TOKENS.value(cache="uncached") - uncached_before == 220
+    assert OPENAI_REQUESTS.value(cache="hit") - hits_before == 1
+    assert "openai_prompt_cache_hit_ratio " in registry.render()
+
+def _receipt(**overrides) -> Receipt:
+    data = {
+        "date": "2025-07-27", "total": 4.5, "items": ["Milk", "Bread"], "items_price": [1.5, 3.0],
+        "items_quantity": [1, 1], "reciept_category": "Grocery", "store_name": "Test Store",
+        "store_first_line": None, "store_second_line": None, "store_postcode": None, "discount": 0.0,
+    }
+    data.update(overrides)
+    return Receipt(**data)
+
+def test_receipt_problems_checks_consistency():
+    """Mismatched lists, unreconciled totals and implausible dates are reported"""
+    assert receipt_problems(_receipt()) == []
+    # Per-unit prices with a discount still reconcile
+    assert receipt_problems(_receipt(items_quantity=[2, 1], total=5.0, discount=1.0)) == []
+    assert receipt_problems(None) == ["not_parsed"]
+    assert receipt_problems(_receipt(items_quantity=[1])) == ["length_mismatch"]
+    assert receipt_problems(_receipt(total=9.99)) == ["total_mismatch"]
+    assert receipt_problems(_receipt(date="1999-12-31")) == ["implausible_date"]
+
+def _parse_returning(*receipts):
+    responses = [SimpleNamespace(id="resp", model="m", usage=None, output_parsed=r) for r in receipts]
+    return AsyncMock(side_effect=responses)
+
+def test_consistent_fast_extraction_is_not_escalated():
+    """A receipt that passes the checks is returned from the fast model alone"""
+    parse = _parse_returning(_receipt())
+    client = SimpleNamespace(responses=SimpleNamespace(parse=parse))
+    fast_before = RECEIPT_MODEL_ROUTING.value(tier="fast")
+
+    with patch("app.llm_handler.get_async_openai_client", return_value=client):
+        response = asyncio.run(process_receipt_async(b"image", image_base64="aW1hZ2U="))
+
+    assert response.output_parsed.total == 4.5
+    assert [call.kwargs["model"] for call in parse.await_args_list] == [OPENAI_FAST_MODEL]
+    assert RECEIPT_MODEL_ROUTING.value(tier="fast") - fast_before == 1
+
+def test_inconsistent_fast_extraction_escalates_to_strong_model():
+    """A failed check re-extracts with the strong model and uses its result"""
+    parse = _parse_returning(_receipt(total=9.99), _receipt())
+    client = SimpleNamespace(responses=SimpleNamespace(parse=parse))
+    escalations_before = RECEIPT_ESCALATIONS.value(reason="total_mismatch")
+
+    with patch("app.llm_handler.get_async_openai_client", return_value=client):
+        response = asyncio.run(process_receipt_async(b"image", image_base64="aW1hZ2U="))
+
+    assert response.output_parsed.total == 4.5
+    assert [call.kwargs["model"] for call in parse.await_args_list] == [OPENAI_FAST_MODEL, OPENAI_STRONG_MODEL]
+    assert RECEIPT_ESCALATIONS.value(reason="total_mismatch") - escalations_before == 1
+    assert OPENAI_TIER_SECONDS.count(tier="strong") >= 1
@@ -0,0 +1,86 @@
+'''
+pytest scripts for the queued structured logging pipeline
+'''
+
+import io
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+from app.logging_setup import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, log_event, parse_sample_rates
+from app.security import SensitiveDataFilter
+
+class ExpensiveRepr:
+    """Stands in for a large response object; counts how often it is rendered"""
+    renders = 0
+
+    def __str__(self):
+        ExpensiveRepr.renders += 1
+        return "ParsedResponse(...)"
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+    """Records are queued unformatted, and a full queue drops instead of blocking"""
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    logger = make_logger("test.queue", handler)
+    ExpensiveRepr.renders = 0
+
+    logger.info("OpenAIResponse: %s", ExpensiveRepr())
+    logger.info("second record")
+
+    assert ExpensiveRepr.renders == 0
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().getMessage() == "OpenAIResponse: ParsedResponse(...)"
+
+def test_disabled_level_builds_nothing():
+    """log_event skips disabled levels before touching its fields"""
+    handler = NonBlockingQueueHandler(queue.Queue())
+    logger = make_logger("test.disabled", handler)
+    log_event(logger, logging.DEBUG, "openai_response", "response %s", ExpensiveRepr())
+    assert handler.queue.empty()
+
+def test_sampling_filter_keeps_configured_fraction():
+    """Events with a rate of 0 are dropped and counted; others pass"""
+    sampling = SamplingFilter(parse_sample_rates("receipt_scan_requested=0, openai_response=1"))
+    handler = NonBlockingQueueHandler(queue.Queue())
+    handler.addFilter(sampling)
+    logger = make_logger("test.sampling", handler)
+
+    for _ in range(5):
+        log_event(logger, logging.INFO, "receipt_scan_requested", "scan")
+    log_event(logger, logging.INFO, "openai_response", "response")
+    logger.info("plain record")
+
+    assert handler.queue.qsize() == 2
+    assert sampling.dropped == 5
+
+def test_listener_writes_redacted_truncated_json():
+    """The listener thread formats JSON, redacts fields and truncates long values"""
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter(max_field_length=20))
+    output.addFilter(SensitiveDataFilter())
+    handler = NonBlockingQueueHandler(queue.Queue())
+    logger = make_logger("test.listener", handler)
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+
+    api_key = "k" * 40
+    log_event(logger, logging.WARNING, "receipt_scan_error", "Security event: %s", "receipt_scan_error",
+              error=f"auth failed for {api_key}", payload="ab " * 40, file_size=123)
+    listener.stop()
+
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "Security event: receipt_scan_error"
+    assert entry["event"] == "receipt_scan_error"
+    assert entry["level"] == "WARNING"
+    assert entry["error"] == "auth failed for ***"
+    assert entry["payload"] == ("ab " * 40)[:20] + "... [truncated 100 chars]"
+    assert entry["file_size"] == 123
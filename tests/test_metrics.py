@@ -0,0 +1,53 @@
+'''
+pytest scripts for the in-process metrics
+'''
+
+import pytest
+from app.metrics import Counter, Histogram, MetricsRegistry, SCAN_STAGE_ERRORS, SCAN_STAGE_SECONDS, stage
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    """p50/p99 are estimated from the bucket the rank falls into"""
+    histogram = Histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 0.2, 0.4))
+    for _ in range(50):
+        histogram.observe(0.05, stage="a")
+    for _ in range(50):
+        histogram.observe(0.3, stage="a")
+
+    assert histogram.count(stage="a") == 100
+    assert histogram.quantile(0.5, stage="a") == pytest.approx(0.1)
+    assert histogram.quantile(0.99, stage="a") == pytest.approx(0.396)
+    assert histogram.quantile(0.5, stage="b") is None
+
+def test_registry_renders_prometheus_text():
+    """Histograms render cumulative buckets, sum, count and quantile estimates"""
+    registry = MetricsRegistry()
+    histogram = registry.register(Histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0)))
+    counter = registry.register(Counter("errors_total", "Errors", ["stage"]))
+    registry.register_collector(lambda: [("cache_hits", "gauge", "Hits", [("", {}, 3)])])
+    histogram.observe(0.05, stage="openai_call")
+    histogram.observe(0.5, stage="openai_call")
+    counter.inc(stage="openai_call")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{stage="openai_call",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="openai_call",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{stage="openai_call",le="+Inf"} 2' in lines
+    assert 'latency_seconds_count{stage="openai_call"} 2' in lines
+    assert any(line.startswith('latency_seconds_quantile{stage="openai_call",quantile="0.95"}') for line in lines)
+    assert 'errors_total{stage="openai_call"} 1' in lines
+    assert "cache_hits 3" in lines
+
+def test_stage_times_and_counts_errors():
+    """A failing stage is still timed and increments the stage error counter"""
+    before_count = SCAN_STAGE_SECONDS.count(stage="test_stage")
+    before_errors = SCAN_STAGE_ERRORS.value(stage="test_stage")
+
+    with stage("test_stage"):
+        pass
+    with pytest.raises(ValueError):
+        with stage("test_stage"):
+            raise ValueError("boom")
+
+    assert SCAN_STAGE_SECONDS.count(stage="test_stage") == before_count + 2
+    assert SCAN_STAGE_ERRORS.value(stage="test_stage") == before_errors + 1
@@ -0,0 +1,421 @@
+'''
+pytest scripts for the Notion write paths
+'''
+
+import asyncio
+import json
+import os
+import httpx
+import pytest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+from notion_client import AsyncClient
+from app.notion_client import ConnectionStats, NotionReceiptManager, WriteCheckpoint, create_async_notion_client
+from app.notion_governor import NotionGovernor, PRIORITY_HIGH, PRIORITY_LOW
+from benchmarks.fake_notion import FakeNotionServer
+
+ITEMS = {
+    "items": [f"Item {i}" for i in range(12)],
+    "items_price": [1.0] * 12,
+    "items_quantity": [1] * 12,
+}
+
+def make_manager(handler, max_concurrency=4, write_layout="inline_database"):
+    """Build a manager whose async client talks to an in-memory transport"""
+    manager = NotionReceiptManager(
+        client=MagicMock(),
+        async_client=AsyncClient(
+            auth="test-token",
+            client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        ),
+        write_layout=write_layout,
+    )
+    manager.governor = NotionGovernor(rate=0)
+    manager.max_concurrency = max_concurrency
+    return manager
+
+def test_items_written_concurrently_within_limit():
+    """Item writes fan out but never exceed max_concurrency in flight"""
+    in_flight = 0
+    peak = 0
+    created = []
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        created.append(request.url.path)
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    manager = make_manager(handler, max_concurrency=4)
+    assert asyncio.run(manager.create_items_within_page_async("items-db", ITEMS))
+    assert len(created) == 12
+    assert peak == 4
+
+def test_rate_limited_item_is_retried_after_retry_after():
+    """A 429 is retried after the Retry-After delay instead of failing the receipt"""
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) == 1:
+            return httpx.Response(
+                429,
+                headers={"Retry-After": "0.05"},
+                json={"object": "error", "status": 429, "code": "rate_limited", "message": "Rate limited"},
+            )
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    manager = make_manager(handler, max_concurrency=1)
+    properties = {"items": ["Milk"], "items_price": [1.5], "items_quantity": [1]}
+    assert asyncio.run(manager.create_items_within_page_async("items-db", properties))
+    assert len(calls) == 2
+
+def test_governor_spaces_requests_after_burst():
+    """The governor allows a burst, then spaces requests at the configured rate"""
+    governor = NotionGovernor(rate=50, burst=2)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(6):
+            await governor.acquire()
+        return loop.time() - start
+
+    # 2 free tokens, then 4 more at 20ms intervals
+    assert asyncio.run(run()) >= 0.06
+    assert governor.stats()["requests"] == 6
+
+def test_governor_serves_high_priority_first():
+    """Queued transaction pages overtake queued item rows"""
+    governor = NotionGovernor(rate=100, burst=1)
+    order = []
+
+    async def call(name, priority):
+        await governor.acquire(priority)
+        order.append(name)
+
+    async def run():
+        await governor.acquire()  # drain the bucket so everything below queues
+        await asyncio.gather(
+            call("item-1", PRIORITY_LOW),
+            call("item-2", PRIORITY_LOW),
+            call("page", PRIORITY_HIGH),
+        )
+
+    asyncio.run(run())
+    assert order == ["page", "item-1", "item-2"]
+
+def test_rate_limit_pauses_every_caller():
+    """A 429 on one request holds back the others sharing the governor"""
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) == 1:
+            return httpx.Response(
+                429,
+                headers={"Retry-After": "0.1"},
+                json={"object": "error", "status": 429, "code": "rate_limited", "message": "Rate limited"},
+            )
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    manager = make_manager(handler, max_concurrency=4)
+    manager.governor = NotionGovernor(rate=1000, burst=1)
+    properties = {"items": ["A", "B", "C"], "items_price": [1.0] * 3, "items_quantity": [1] * 3}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        assert await manager.create_items_within_page_async("items-db", properties)
+        return loop.time() - start
+
+    assert asyncio.run(run()) >= 0.1
+    assert len(calls) == 4
+    assert manager.governor.stats()["throttled"] == 1
+
+def test_sync_writes_share_the_governor():
+    """Synchronous writes draw tokens from the same governor"""
+    manager = make_manager(lambda request: httpx.Response(200, json={}))
+    manager.governor = NotionGovernor(rate=0)
+    assert manager.create_items_within_page("items-db", ITEMS)
+    assert manager.client.pages.create.call_count == 12
+    assert manager.governor.stats()["requests"] == 12
+
+def table_layout_requests(item_count):
+    """Write a receipt with the table layout and return the (method, path) of every call"""
+    calls = []
+
+    def handler(request):
+        calls.append((request.method, request.url.path))
+        if request.method == "GET":
+            return httpx.Response(200, json={"results": [
+                {"id": "heading-id", "type": "heading_3"},
+                {"id": "table-id", "type": "table"},
+            ]})
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    manager = make_manager(handler, write_layout="table")
+    manager.transaction_db_id = "transactions-db"
+    properties = {
+        "store_name": "Test Store",
+        "total": 10.0,
+        "reciept_category": "Grocery",
+        "date": datetime(2025, 8, 9),
+        "items": [f"Item {i}" for i in range(item_count)],
+        "items_price": [1.0] * item_count,
+        "items_quantity": [1] * item_count,
+    }
+    page = asyncio.run(manager.create_new_entry_async(properties))
+    assert page["id"] == "page-id"
+    return calls
+
+def test_table_layout_writes_page_and_items_in_one_call():
+    """A normal receipt is a single pages.create with the items table inline"""
+    assert table_layout_requests(40) == [("POST", "/v1/pages")]
+
+def test_table_layout_appends_rows_beyond_block_limit():
+    """Rows past Notion's 100-children limit are appended to the table in chunks"""
+    # 250 items + header = 251 rows: 100 in the create, then 100 + 51 appended
+    assert table_layout_requests(250) == [
+        ("POST", "/v1/pages"),
+        ("GET", "/v1/blocks/page-id/children"),
+        ("PATCH", "/v1/blocks/table-id/children"),
+        ("PATCH", "/v1/blocks/table-id/children"),
+    ]
+
+def test_table_layout_missing_table_raises_clear_error():
+    """If the page's children list has no table, the overflow append fails with a clear error"""
+    def handler(request):
+        if request.method == "GET":
+            return httpx.Response(200, json={"object": "list", "results": []})
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    manager = make_manager(handler, write_layout="table")
+    manager.transaction_db_id = "transactions-db"
+    properties = {"store_name": "Test Store", "total": 250.0, "reciept_category": "Grocery",
+                  "date": datetime(2025, 8, 9), "items": [f"Item {i}" for i in range(250)],
+                  "items_price": [1.0] * 250, "items_quantity": [1] * 250}
+
+    with pytest.raises(RuntimeError, match="Items table not found"):
+        asyncio.run(manager.create_new_entry_async(properties))
+
+def test_shared_items_layout_relates_items_without_creating_databases():
+    """Items go to the shared database with a Transaction relation; no per-receipt database"""
+    bodies = []
+
+    def handler(request):
+        bodies.append((request.method, request.url.path, json.loads(request.content or b"{}")))
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    manager = make_manager(handler, write_layout="shared_items")
+    manager.transaction_db_id = "transactions-db"
+    manager.items_db_id = "items-db"
+    properties = {
+        "store_name": "Test Store",
+        "total": 3.0,
+        "reciept_category": "Grocery",
+        "date": datetime(2025, 8, 9),
+        **{key: value[:3] for key, value in ITEMS.items()},
+    }
+    with patch("app.notion_client.shared_items_db_id", "items-db"), \
+         patch("app.notion_client.shared_items_db_ready", True):
+        asyncio.run(manager.create_new_entry_async(properties))
+
+    assert [path for _, path, _ in bodies] == ["/v1/pages"] * 4
+    item_bodies = [body for _, _, body in bodies[1:]]
+    assert all(body["parent"] == {"database_id": "items-db"} for body in item_bodies)
+    assert all(body["properties"]["Transaction"] == {"relation": [{"id": "page-id"}]} for body in item_bodies)
+
+def test_ensure_shared_items_db_adds_missing_properties():
+    """An existing Items database gets its title renamed and the relation added"""
+    calls = []
+
+    def handler(request):
+        calls.append((request.method, request.url.path, json.loads(request.content or b"{}")))
+        if request.method == "GET":
+            return httpx.Response(200, json={"object": "database", "id": "items-db", "properties": {
+                "Name": {"type": "title"},
+                "Price": {"type": "number"},
+                "Quantity": {"type": "number"},
+            }})
+        return httpx.Response(200, json={"object": "database", "id": "items-db"})
+
+    manager = make_manager(handler, write_layout="shared_items")
+    manager.transaction_db_id = "transactions-db"
+    manager.items_db_id = "items-db"
+    with patch("app.notion_client.shared_items_db_id", None), patch("app.notion_client.shared_items_db_ready", False):
+        assert asyncio.run(manager.ensure_shared_items_db_async()) == "items-db"
+
+    method, path, body = calls[-1]
+    assert (method, path) == ("PATCH", "/v1/databases/items-db")
+    assert body["properties"] == {
+        "Name": {"name": "Item"},
+        "Transaction": {"relation": {"database_id": "transactions-db", "single_property": {}}},
+    }
+
+def test_ensure_shared_items_db_reuses_existing_database_under_page():
+    """Without a configured id, an Items database already under PAGE_ID is reused rather than created again"""
+    calls = []
+
+    def handler(request):
+        calls.append((request.method, request.url.path))
+        if request.url.path == "/v1/search":
+            return httpx.Response(200, json={"object": "list", "has_more": False, "next_cursor": None, "results": [
+                {"object": "database", "id": "elsewhere-db", "title": [{"plain_text": "Items"}],
+                 "parent": {"type": "page_id", "page_id": "other-page"}},
+                {"object": "database", "id": "items-db", "title": [{"plain_text": "Items"}],
+                 "parent": {"type": "page_id", "page_id": "parent-page"}},
+            ]})
+        return httpx.Response(200, json={"object": "database", "id": "items-db", "properties": {
+            "Item": {"type": "title"},
+            "Price": {"type": "number"},
+            "Quantity": {"type": "number"},
+            "Transaction": {"type": "relation"},
+        }})
+
+    manager = make_manager(handler, write_layout="shared_items")
+    manager.transaction_db_id = "transactions-db"
+    manager.parent_page_id = "parent-page"
+    manager.items_db_id = None
+    with patch("app.notion_client.shared_items_db_id", None), patch("app.notion_client.shared_items_db_ready", False):
+        assert asyncio.run(manager.ensure_shared_items_db_async()) == "items-db"
+
+    assert ("POST", "/v1/databases") not in calls
+    assert calls == [("POST", "/v1/search"), ("GET", "/v1/databases/items-db")]
+
+def test_shared_items_write_retries_failed_startup_preparation():
+    """A write after a failed startup check prepares the Items database first, then writes"""
+    calls = []
+
+    def handler(request):
+        calls.append((request.method, request.url.path))
+        if request.method == "GET":
+            return httpx.Response(200, json={"object": "database", "id": "items-db", "properties": {
+                "Item": {"type": "title"},
+                "Price": {"type": "number"},
+                "Quantity": {"type": "number"},
+                "Transaction": {"type": "relation"},
+            }})
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    manager = make_manager(handler, write_layout="shared_items")
+    manager.transaction_db_id = "transactions-db"
+    manager.items_db_id = "items-db"
+    properties = {"store_name": "Test Store", "total": 1.0, "reciept_category": "Grocery",
+                  "date": datetime(2025, 8, 9), **{key: value[:1] for key, value in ITEMS.items()}}
+    with patch("app.notion_client.shared_items_db_ready", False):
+        asyncio.run(manager.create_new_entry_async(properties))
+        asyncio.run(manager.create_new_entry_async(properties))
+
+    assert calls.count(("GET", "/v1/databases/items-db")) == 1
+    assert calls.count(("POST", "/v1/pages")) == 4
+
+def test_manager_built_before_setup_uses_the_prepared_items_db():
+    """A manager created before another one prepared the Items database still writes items to it"""
+    bodies = []
+
+    def handler(request):
+        body = json.loads(request.content or b"{}")
+        bodies.append((request.method, request.url.path, body))
+        if request.url.path == "/v1/search":
+            return httpx.Response(200, json={"object": "list", "has_more": False, "next_cursor": None,
+                                             "results": []})
+        if request.url.path == "/v1/databases":
+            return httpx.Response(200, json={"object": "database", "id": "items-db"})
+        return httpx.Response(200, json={"object": "page", "id": "page-id"})
+
+    properties = {"store_name": "Test Store", "total": 1.0, "reciept_category": "Grocery",
+                  "date": datetime(2025, 8, 9), **{key: value[:1] for key, value in ITEMS.items()}}
+    with patch("app.notion_client.shared_items_db_id", None), patch("app.notion_client.shared_items_db_ready", False):
+        early = make_manager(handler, write_layout="shared_items")
+        early.transaction_db_id = "transactions-db"
+        assert early.items_db_id is None
+
+        other = make_manager(handler, write_layout="shared_items")
+        other.parent_page_id = "parent-page"
+        other.transaction_db_id = "transactions-db"
+        asyncio.run(other.ensure_shared_items_db_async())
+
+        asyncio.run(early.create_new_entry_async(properties))
+
+    item_body = bodies[-1][2]
+    assert item_body["parent"] == {"database_id": "items-db"}
+
+def test_ensure_shared_items_db_requires_a_parent():
+    """With neither an Items database id nor PAGE_ID there is nowhere to find or create it"""
+    manager = make_manager(lambda request: httpx.Response(200, json={}), write_layout="shared_items")
+    manager.items_db_id = None
+    manager.parent_page_id = None
+    with patch("app.notion_client.shared_items_db_ready", False), pytest.raises(ValueError, match="PAGE_ID"):
+        asyncio.run(manager.ensure_shared_items_db_async())
+
+def test_pooled_client_reuses_connections():
+    """Sequential calls on the shared async client ride one keep-alive connection"""
+    stats = ConnectionStats()
+
+    async def run(base_url):
+        with patch.dict(os.environ, {"NOTION_TOKEN": "test-token"}):
+            client = create_async_notion_client(base_url=base_url, stats=stats)
+        for _ in range(5):
+            await client.pages.create(parent={"database_id": "db"}, properties={})
+        await client.aclose()
+
+    with FakeNotionServer() as server:
+        asyncio.run(run(server.base_url))
+
+    assert stats.snapshot() == {"requests": 5, "connections_opened": 1, "connections_reused": 4}
+
+def test_progress_reports_page_then_each_item():
+    """on_progress sees the transaction page first, then a running count of item rows"""
+    def handler(request):
+        return httpx.Response(200, json={"object": "page", "id": "page-id", "url": "https://notion.so/page"})
+
+    manager = make_manager(handler)
+    manager.transaction_db_id = "transactions-db"
+    properties = {"store_name": "Test Store", "total": 12.0, "reciept_category": "Grocery",
+                  "date": datetime(2025, 8, 9), **ITEMS}
+    events = []
+    asyncio.run(manager.create_new_entry_async(properties, on_progress=lambda event, fields: events.append((event, fields))))
+
+    assert events[0] == ("notion_page_created", {"page_id": "page-id", "page_url": "https://notion.so/page"})
+    assert [fields["written"] for event, fields in events[1:]] == list(range(1, 13))
+    assert all(event == "notion_items_written" and fields["total"] == 12 for event, fields in events[1:])
+
+def test_retry_resumes_from_checkpoint():
+    """A retry after a failed item write reuses the page and item database and writes only the missing items"""
+    calls = []
+    failed = []
+
+    def handler(request):
+        body = json.loads(request.content or b"{}")
+        calls.append((request.url.path, body["parent"]))
+        if '"Item 5"' in json.dumps(body) and not failed:
+            failed.append(body)
+            return httpx.Response(400, json={"object": "error", "status": 400,
+                                             "code": "validation_error", "message": "Item rejected"})
+        return httpx.Response(200, json={"object": "page", "id": f"id-{len(calls)}"})
+
+    manager = make_manager(handler, max_concurrency=1)
+    manager.transaction_db_id = "transactions-db"
+    properties = {"store_name": "Test Store", "total": 12.0, "reciept_category": "Grocery",
+                  "date": datetime(2025, 8, 9), **ITEMS}
+    saved = {}
+
+    async def save(state):
+        saved.update(state)
+
+    try:
+        asyncio.run(manager.create_new_entry_async(properties, checkpoint=WriteCheckpoint(saved, save)))
+    except Exception:
+        pass
+    assert saved["page_id"] == "id-1" and saved["item_db_id"] == "id-2"
+    assert 5 not in saved["items_written"]
+
+    page = asyncio.run(manager.create_new_entry_async(properties, checkpoint=WriteCheckpoint(saved, save)))
+    assert page["id"] == "id-1"
+    assert [parent for _, parent in calls].count({"database_id": "transactions-db"}) == 1
+    assert [path for path, _ in calls].count("/v1/databases") == 1
+    assert sorted(saved["items_written"]) == list(range(12))
@@ -0,0 +1,126 @@
+'''
+pytest scripts for the durable Notion outbox
+'''
+
+import asyncio
+import time
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+from app.models import Receipt, ReceiptCategory
+from app.outbox import NotionOutbox, backoff_delay
+
+RECEIPT = Receipt(
+    date=datetime(2025, 8, 9),
+    total=4.0,
+    items=["Milk"],
+    items_price=[4.0],
+    items_quantity=[1],
+    reciept_category=ReceiptCategory.GROCERY,
+    store_name="Test Store",
+    store_first_line=None,
+    store_second_line=None,
+    store_postcode=None,
+    discount=None,
+)
+
+SUCCESS = {"status": "success", "page_id": "page-1", "page_url": "https://notion.so/page-1"}
+
+def test_successful_write_is_marked_delivered(tmp_path):
+    """A write that succeeds first time is recorded as delivered"""
+    outbox = NotionOutbox(AsyncMock(return_value=SUCCESS), path=str(tmp_path / "outbox.sqlite3"))
+    response = asyncio.run(outbox.deliver(RECEIPT))
+
+    assert response["page_id"] == "page-1"
+    assert outbox.stats()["delivered"] == 1
+    assert outbox.get(response["outbox_id"])["page_url"] == "https://notion.so/page-1"
+
+@patch("app.outbox.backoff_delay", return_value=0)
+def test_failed_write_is_retried_by_drainer(_backoff, tmp_path):
+    """A failed write is queued rather than lost, and the drainer delivers it later"""
+    write = AsyncMock(side_effect=[RuntimeError("Notion is down"), SUCCESS])
+    outbox = NotionOutbox(write, path=str(tmp_path / "outbox.sqlite3"))
+
+    response = asyncio.run(outbox.deliver(RECEIPT))
+    assert response["status"] == "queued"
+    assert outbox.stats()["pending"] == 1
+
+    assert asyncio.run(outbox.drain_once()) == 1
+    assert outbox.stats()["delivered"] == 1
+    assert write.await_args.args[0] == RECEIPT
+
+@patch("app.outbox.backoff_delay", return_value=0)
+def test_retry_resumes_from_saved_checkpoint(_backoff, tmp_path):
+    """Progress saved by a failed attempt is handed to the retry instead of starting over"""
+    async def attempt(receipt, checkpoint, save_checkpoint):
+        if not checkpoint:
+            await save_checkpoint({"page_id": "page-1"})
+            raise RuntimeError("item write failed")
+        return SUCCESS
+
+    write = AsyncMock(side_effect=attempt)
+    outbox = NotionOutbox(write, path=str(tmp_path / "outbox.sqlite3"))
+    assert asyncio.run(outbox.deliver(RECEIPT))["status"] == "queued"
+
+    assert asyncio.run(outbox.drain_once()) == 1
+    assert write.await_args.kwargs["checkpoint"] == {"page_id": "page-1"}
+    assert outbox.stats()["delivered"] == 1
+
+def test_interrupted_write_is_replayed_on_startup(tmp_path):
+    """An entry left in flight by a crashed process is retried after restart"""
+    path = str(tmp_path / "outbox.sqlite3")
+    crashed = NotionOutbox(AsyncMock(), path=path)
+    crashed.add(RECEIPT)
+
+    write = AsyncMock(return_value=SUCCESS)
+    restarted = NotionOutbox(write, path=path)
+    assert restarted.replay_interrupted() == 1
+    assert asyncio.run(restarted.drain_once()) == 1
+    write.assert_awaited_once()
+
+@patch("app.outbox.backoff_delay", return_value=0)
+def test_gives_up_after_max_attempts(_backoff, tmp_path):
+    """Entries stop being retried after max_attempts and are kept as failed"""
+    outbox = NotionOutbox(AsyncMock(side_effect=RuntimeError("bad request")),
+                          path=str(tmp_path / "outbox.sqlite3"), max_attempts=2)
+    asyncio.run(outbox.deliver(RECEIPT))
+    asyncio.run(outbox.drain_once())
+
+    assert outbox.stats()["failed"] == 1
+    assert asyncio.run(outbox.drain_once()) == 0
+
+def test_backoff_grows_with_jitter():
+    """Delays double per attempt, stay within [d/2, d] and are capped"""
+    for attempts, full in [(1, 2), (2, 4), (5, 32)]:
+        delay = backoff_delay(attempts, base=2, cap=600)
+        assert full / 2 <= delay <= full
+    assert backoff_delay(30, base=2, cap=600) <= 600
+
+def test_abandoned_in_flight_entry_is_reclaimed_after_its_lease(tmp_path):
+    """An entry left in flight by a write that never finished is claimed again once its lease expires"""
+    outbox = NotionOutbox(AsyncMock(return_value=SUCCESS), path=str(tmp_path / "outbox.sqlite3"), lease_seconds=60)
+    entry_id = outbox.add(RECEIPT)
+    assert outbox.claim_due() == []
+
+    with patch("app.outbox.time.time", return_value=time.time() + 61):
+        assert [claimed[0] for claimed in outbox.claim_due()] == [entry_id]
+
+def test_cancelled_write_returns_to_pending(tmp_path):
+    """A write cancelled mid-flight, e.g. at shutdown, is due for retry straight away rather than stuck in flight"""
+    started = asyncio.Event()
+
+    async def hang(receipt, **kwargs):
+        started.set()
+        await asyncio.sleep(60)
+
+    outbox = NotionOutbox(AsyncMock(side_effect=hang), path=str(tmp_path / "outbox.sqlite3"))
+
+    async def main():
+        task = asyncio.create_task(outbox.deliver(RECEIPT))
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await outbox.stop()
+
+    asyncio.run(main())
+    assert outbox.stats()["pending"] == 1
+    assert len(outbox.claim_due()) == 1
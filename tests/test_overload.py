@@ -0,0 +1,93 @@
+'''
+pytest scripts for the adaptive OpenAI concurrency limit and circuit breaker
+'''
+
+import asyncio
+import pytest
+from unittest.mock import patch
+from app.overload import (
+    AdaptiveLimiter, CircuitBreaker, CircuitOpen, CLIENT_ERROR, FAILURE, OVERLOAD, SUCCESS, classify_error,
+)
+
+class RateLimitError(Exception):
+    status_code = 429
+
+class InternalServerError(Exception):
+    status_code = 500
+
+class BadRequestError(Exception):
+    status_code = 400
+
+def test_classify_error():
+    """429s and timeouts are overload, 5xx and connection errors failures, the rest client errors"""
+    assert classify_error(RateLimitError()) == OVERLOAD
+    assert classify_error(asyncio.TimeoutError()) == OVERLOAD
+    assert classify_error(InternalServerError()) == FAILURE
+    assert classify_error(ConnectionResetError()) == FAILURE
+    assert classify_error(BadRequestError()) == CLIENT_ERROR
+
+def test_limit_grows_additively_and_halves_on_overload():
+    """Stable successes while the limit is in use add 1/limit; a burst of 429s halves it once"""
+    limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=10)
+
+    async def saturate(outcome):
+        await asyncio.gather(*(limiter.acquire() for _ in range(4)))
+        for _ in range(4):
+            limiter.release(0.1, outcome)
+
+    asyncio.run(saturate(SUCCESS))
+    grown = limiter.limit
+    assert 4.25 < grown < 5
+
+    asyncio.run(saturate(OVERLOAD))
+    assert limiter.limit == pytest.approx(grown / 2)
+    assert limiter.stats()["decreases"] == 1
+
+def test_callers_over_the_limit_wait_for_a_slot():
+    """Only `limit` calls run at once; the rest start as slots are released"""
+    limiter = AdaptiveLimiter(initial=2, max_limit=2)
+    running = []
+    peak = []
+
+    async def call():
+        await limiter.acquire()
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        limiter.release(0.01, SUCCESS)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert limiter.stats()["in_flight"] == 0
+
+def test_breaker_opens_probes_and_closes():
+    """A high failure rate opens the breaker; after the cooldown one probe decides"""
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_calls=4, cooldown=30)
+    for outcome in (SUCCESS, FAILURE, OVERLOAD, FAILURE):
+        breaker.before_call()
+        breaker.record(outcome)
+    assert breaker.stats()["state"] == "open"
+
+    with pytest.raises(CircuitOpen) as error:
+        breaker.before_call()
+    assert 0 < error.value.retry_after <= 30
+
+    with patch("app.overload.time.monotonic", return_value=breaker._opened_at + 31):
+        breaker.before_call()
+        with pytest.raises(CircuitOpen):
+            breaker.before_call()
+        breaker.record(SUCCESS)
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.stats()["rejected"] == 2
+
+def test_client_errors_do_not_open_the_breaker():
+    """Bad requests say nothing about OpenAI's health"""
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_calls=4)
+    for _ in range(10):
+        breaker.before_call()
+        breaker.record(CLIENT_ERROR)
+    assert breaker.stats()["state"] == "closed"
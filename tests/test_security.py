@@ -0,0 +1,45 @@
+'''
+pytest scripts for log redaction
+'''
+
+import logging
+import sys
+from app.security import SensitiveDataFilter, redact
+
+API_KEY = "sk" + "a1b2c3d4" * 6
+
+def make_record(msg, args=(), exc_info=None):
+    return logging.LogRecord("app", logging.INFO, __file__, 1, msg, args, exc_info)
+
+def test_redact_masks_bearer_tokens_and_api_keys():
+    """Both patterns are handled in a single pass"""
+    text = f"Authorization: Bearer abc123 key={API_KEY} done"
+    assert redact(text) == "Authorization: Bearer *** key=*** done"
+
+def test_redact_truncates_before_scanning():
+    """Huge messages are capped, and the cap is reported"""
+    redacted = redact("a b " * 5000, max_length=100)
+    assert redacted.startswith("a b a b")
+    assert redacted.endswith("... [truncated 19900 chars]")
+
+def test_filter_redacts_secrets_passed_as_args():
+    """Secrets in %-style args are merged into the message and redacted"""
+    record = make_record("Calling OpenAI with key %s for %s", (API_KEY, "receipt"))
+    assert SensitiveDataFilter().filter(record)
+    assert record.getMessage() == "Calling OpenAI with key *** for receipt"
+
+def test_filter_redacts_exception_text():
+    """Tracebacks are formatted once and redacted"""
+    try:
+        raise ValueError(f"bad token Bearer {API_KEY}")
+    except ValueError:
+        record = make_record("Request failed", exc_info=sys.exc_info())
+
+    SensitiveDataFilter().filter(record)
+    assert "Bearer ***" in record.exc_text
+    assert API_KEY not in logging.Formatter().format(record)
+
+def test_filter_tolerates_mismatched_args():
+    """A record whose args don't fit the format string is still filtered"""
+    record = make_record("%s and %s", ("only one",))
+    assert SensitiveDataFilter().filter(record)
@@ -0,0 +1,26 @@
+'''
+pytest scripts for cold-start behaviour
+'''
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_python(code, cwd):
+    env = {**os.environ, "PYTHONPATH": ROOT, "LOG_LEVEL": "WARNING"}
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True)
+
+def test_importing_app_defers_heavy_sdks():
+    """The OpenAI SDK, the Notion SDK and yaml are not imported until first use"""
+    result = run_python("import sys, app.main; "
+                        "print('openai' in sys.modules, 'notion_client' in sys.modules, 'yaml' in sys.modules)", ROOT)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-3:] == ["False", "False", "False"]
+
+def test_prompt_loads_from_any_working_directory(tmp_path):
+    """The system prompt is resolved relative to the package, not the cwd"""
+    result = run_python("from app.llm_handler import get_system_prompt; print(len(get_system_prompt()) > 0)", tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == "True"
@@ -0,0 +1,60 @@
+'''
+pytest scripts for streaming upload handling
+'''
+
+import asyncio
+import base64
+import hashlib
+import os
+import tempfile
+import tracemalloc
+import pytest
+from fastapi import HTTPException, UploadFile
+from app.uploads import read_upload
+
+def make_upload(size: int) -> UploadFile:
+    """An UploadFile backed by a temp file on disk, like Starlette's spooled uploads"""
+    spool = tempfile.TemporaryFile()
+    block = os.urandom(1024 * 1024)
+    written = 0
+    while written < size:
+        written += spool.write(block[:size - written])
+    spool.seek(0)
+    return UploadFile(spool, size=size, filename="receipt.jpg")
+
+def test_hash_and_base64_match_whole_file():
+    """Chunked hashing and base64 agree with a single pass over the bytes"""
+    upload = make_upload(1_000_003)
+    data = upload.file.read()
+    upload.file.seek(0)
+
+    image = asyncio.run(read_upload(upload, max_size_mb=2, chunk_size=64 * 1024 + 1, encode_base64=True))
+
+    assert image.data == data
+    assert image.sha256 == hashlib.sha256(data).hexdigest()
+    assert image.base64 == base64.b64encode(data).decode()
+
+def test_oversized_upload_aborts():
+    """An upload over the limit raises 413 instead of being read in full"""
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(read_upload(make_upload(3 * 1024 * 1024), max_size_mb=1))
+    assert exc_info.value.status_code == 413
+
+def peak_memory_rejecting(size: int) -> int:
+    upload = make_upload(size)
+    tracemalloc.start()
+    try:
+        with pytest.raises(HTTPException):
+            asyncio.run(read_upload(upload, max_size_mb=1, chunk_size=64 * 1024))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_peak_memory_flat_regardless_of_upload_size():
+    """Rejecting an 8MB and a 64MB upload costs the same memory: about the size limit"""
+    small = peak_memory_rejecting(8 * 1024 * 1024)
+    large = peak_memory_rejecting(64 * 1024 * 1024)
+
+    assert small < 2 * 1024 * 1024
+    assert large < 2 * 1024 * 1024
+    assert abs(large - small) < 256 * 1024